@@ -4,14 +4,17 @@ from __future__ import annotations
 
 import json
 import os
+import queue
 import tempfile
+import threading
 from pathlib import Path
 from types import SimpleNamespace
-from typing import Dict, Optional, Tuple
+from typing import Any, Callable, Dict, Generator, Iterator, Optional, Tuple
 
 import gradio as gr
 
 from auto_llm.auto_exec import pipeline as pipeline_mod
+from auto_llm.generator.response_cache import DEFAULT_CACHE_DIR
 from auto_llm.testcase_generator import StoryMetadata, generate_test_suite
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -22,6 +25,7 @@ DEFAULT_OUTPUT_ROOT = pipeline_mod.BASE_DIR
 DEFAULT_ARTIFACTS_DIR = BASE_DIR / "artifacts"
 DEFAULT_CI_OUTPUT_PATH = pipeline_mod.DEFAULT_CI_OUTPUT
 DEFAULT_GIT_ROOT = pipeline_mod.BASE_DIR.parent.parent
+LIVE_OUTPUT_MAX_CHARS = 64 * 1024
 
 
 def _parse_http_headers(text: Optional[str]) -> list[str]:
@@ -34,16 +38,16 @@ def _extract_summary(stdout: str) -> Tuple[Optional[Dict], Optional[str]]:
     if not stdout:
         return None, "输出为空"
     candidate = None
-    for line in reversed(stdout.strip().splitlines()):
-        line = line.strip()
-        if not line:
+    lines = stdout.strip().splitlines()
+    # 摘要为缩进格式的多行 JSON：从后往前找以 "{" 开头的行，尝试解析到输出末尾
+    for index in range(len(lines) - 1, -1, -1):
+        if not lines[index].startswith("{"):
+            continue
+        try:
+            candidate = json.loads("\n".join(lines[index:]))
+            break
+        except json.JSONDecodeError:
             continue
-        if line.startswith("{"):
-            try:
-                candidate = json.loads(line)
-                break
-            except json.JSONDecodeError:
-                continue
     if candidate is None:
         return None, "未解析到结构化摘要"
     return candidate, None
@@ -55,6 +59,51 @@ def _load_default_suite() -> str:
     return ""
 
 
+def _stream_in_thread(
+    fn: Callable[..., Any],
+    render: Callable[[str], Any],
+    *args: Any,
+    max_chars: Optional[int] = None,
+    **kwargs: Any,
+) -> Generator[Any, None, Any]:
+    """
+    在后台线程中执行 fn(*args, on_delta=..., **kwargs)，每收到一段模型输出就
+    yield render(已累计文本)，供 Gradio 增量刷新；结束后返回 fn 的返回值。
+    max_chars 限制累计文本只保留尾部，用于输出量不可控的测试日志。
+    """
+    chunks: "queue.Queue[Optional[str]]" = queue.Queue()
+    outcome: Dict[str, Any] = {}
+
+    def _target() -> None:
+        try:
+            outcome["value"] = fn(*args, on_delta=chunks.put, **kwargs)
+        except Exception as exc:  # noqa: BLE001
+            outcome["error"] = exc
+        finally:
+            chunks.put(None)
+
+    threading.Thread(target=_target, daemon=True).start()
+    text = ""
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        text += chunk
+        if max_chars is not None and len(text) > max_chars:
+            text = text[-max_chars:]
+        yield render(text)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("value")
+
+
+def _execute_tests_streaming(
+    exec_request: Dict[str, Any], runner_path: Path, on_delta: Callable[[str], None]
+) -> Tuple[int, str, str, Optional[Dict]]:
+    """执行测试并把 stdout / stderr 逐行转发给 on_delta，供页面实时展示。"""
+    return pipeline_mod.execute_tests(exec_request, runner_path, on_output=lambda _stream, line: on_delta(line))
+
+
 def run_pipeline_interactive(
     story_text: str,
     suite_json: str,
@@ -87,7 +136,8 @@ def run_pipeline_interactive(
     git_remote: Optional[str],
     git_branch: Optional[str],
     git_commit_message: Optional[str],
-) -> Tuple[str, str, str, str, str, str, str, str, str]:
+    use_cache: bool = True,
+) -> Iterator[Tuple[str, str, str, str, str, str, str, str, str]]:
     story_clean = (story_text or "").strip()
     suite_clean = (suite_json or "").strip()
     suite_display = ""
@@ -132,6 +182,9 @@ def run_pipeline_interactive(
             "",
         )
 
+    def _progress(status: str, suite_str: str, script_str: str = ""):
+        return _result(status, suite_str, script_str, "", "", "", "", ci_yaml_text, git_log_output)
+
     args = SimpleNamespace()
     args.output_root = str(DEFAULT_OUTPUT_ROOT)
     args.mode = mode
@@ -154,6 +207,8 @@ def run_pipeline_interactive(
     args.http_api_key_env = http_api_key_env or "LLM_API_KEY"
     args.http_timeout = http_timeout
     args.http_schema = "simple"
+    args.no_cache = not use_cache
+    args.cache_dir = str(DEFAULT_CACHE_DIR)
     args.suite_id = suite_id_hint or None
     args.suite_name = suite_name_hint or None
     args.target = target_hint or None
@@ -165,7 +220,8 @@ def run_pipeline_interactive(
     try:
         client = pipeline_mod.build_client(args)
     except Exception as exc:  # noqa: BLE001
-        return _error(f"创建 LLM 客户端失败：{exc}")
+        yield _error(f"创建 LLM 客户端失败：{exc}")
+        return
 
     if story_clean:
         metadata = StoryMetadata(
@@ -176,18 +232,28 @@ def run_pipeline_interactive(
             fixtures_hint=args.fixtures_hint,
         )
         try:
-            suite_data = generate_test_suite(story_clean, client, metadata)
+            # 流式展示模型输出，生成完成后替换为格式化后的 JSON
+            suite_data = yield from _stream_in_thread(
+                generate_test_suite,
+                lambda text: _progress("⏳ 正在根据用户故事生成测试用例…", text),
+                story_clean,
+                client,
+                metadata,
+            )
             suite_display = json.dumps(suite_data, ensure_ascii=False, indent=2)
         except Exception as exc:  # noqa: BLE001
-            return _error(f"根据用户故事生成测试用例失败：{exc}")
+            yield _error(f"根据用户故事生成测试用例失败：{exc}")
+            return
     else:
         if not suite_clean:
-            return _error("请至少提供标准化测试用例 JSON 或用户故事文本")
+            yield _error("请至少提供标准化测试用例 JSON 或用户故事文本")
+            return
         try:
             suite_data = json.loads(suite_clean)
             suite_display = json.dumps(suite_data, ensure_ascii=False, indent=2)
         except json.JSONDecodeError as exc:
-            return _error(f"JSON 解析失败：{exc}")
+            yield _error(f"JSON 解析失败：{exc}")
+            return
 
     with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as tmp:
         json.dump(suite_data, tmp, ensure_ascii=False, indent=2)
@@ -198,14 +264,17 @@ def run_pipeline_interactive(
     guide_text = custom_system_prompt.strip() if custom_system_prompt else None
     output_root_path = Path(args.output_root).resolve()
     try:
-        script_path = pipeline_mod.generate_script(
+        script_path = yield from _stream_in_thread(
+            pipeline_mod.generate_script,
+            lambda text: _progress("⏳ 正在生成测试脚本…", suite_display, text),
             suite_data,
             client,
             output_root_path,
             guide_text,
         )
     except Exception as exc:  # noqa: BLE001
-        return _error(f"生成脚本失败：{exc}")
+        yield _error(f"生成脚本失败：{exc}")
+        return
 
     script_text = script_path.read_text(encoding="utf-8")
     script_location = str(script_path.resolve())
@@ -235,25 +304,62 @@ def run_pipeline_interactive(
         except Exception as exc:  # noqa: BLE001
             ci_yaml_text = f"# 生成 CI 工作流失败: {exc}"
 
-    if not run_pytest:
-        return _result(
+    if run_pytest:
+        yield _result(
+            "⏳ 脚本已生成，正在执行 pytest…",
+            suite_display,
+            script_text,
+            "",
+            "",
+            ci_path_display,
+            "",
+            ci_yaml_text,
+            git_log_output,
+        )
+    else:
+        yield _result(
             "✅ 已生成脚本（未执行测试）",
             suite_display,
             script_text,
             "",
             "",
             ci_path_display,
+            "",
             ci_yaml_text,
             git_log_output,
         )
+        return
 
     try:
         exec_template = pipeline_mod.load_exec_template(Path(args.request_template).resolve())
-        exec_request = pipeline_mod.prepare_exec_request(exec_template, script_location)
+        # 执行引擎取自模板的 engine 字段（默认 subprocess）：inprocess 引擎在同一进程内串行执行，
+        # 多个页面会话需要同时执行时使用 subprocess 或 pool；每次运行使用独立的 <产物根目录>/<run_id>/
+        exec_request = pipeline_mod.prepare_exec_request(
+            exec_template,
+            script_location,
+            client.get_stats(),
+            artifacts_root=Path(args.artifacts_path).resolve(),
+        )
         runner_path_resolved = pipeline_mod.resolve_runner_path(args.runner_path)
-        exit_code, runner_stdout, runner_stderr = pipeline_mod.run_tests(exec_request, runner_path_resolved)
+        exit_code, runner_stdout, runner_stderr, summary = yield from _stream_in_thread(
+            _execute_tests_streaming,
+            lambda text: _result(
+                "⏳ 正在执行 pytest…",
+                suite_display,
+                script_text,
+                text,
+                "",
+                ci_path_display,
+                "",
+                ci_yaml_text,
+                git_log_output,
+            ),
+            exec_request,
+            runner_path_resolved,
+            max_chars=LIVE_OUTPUT_MAX_CHARS,
+        )
     except Exception as exc:  # noqa: BLE001
-        return _result(
+        yield _result(
             f"❌ 测试执行失败：{exc}",
             suite_display,
             script_text,
@@ -264,10 +370,11 @@ def run_pipeline_interactive(
             ci_yaml_text,
             git_log_output,
         )
+        return
 
     fix_log_output = ""
     if auto_fix and exit_code != 0:
-        artifacts_dir = Path(args.artifacts_path).resolve()
+        artifacts_dir = Path(exec_request["artifacts_dir"])
         final_code, fixed_stdout, fixed_stderr, fix_log = pipeline_mod.try_auto_fix(
             suite=suite_data,
             client=client,
@@ -283,6 +390,8 @@ def run_pipeline_interactive(
             exit_code = 0
             runner_stdout = fixed_stdout or runner_stdout
             runner_stderr = fixed_stderr or runner_stderr
+            # 修复后的最终执行结果以回放输出中的摘要为准
+            summary, _ = _extract_summary(runner_stdout)
             runner_stdout += "\n[自动修复] 修复成功，测试通过。"
         if fix_log:
             fix_log_output = fix_log
@@ -312,7 +421,8 @@ def run_pipeline_interactive(
         )
 
     artifact_lines = ""
-    summary, summary_err = _extract_summary(runner_stdout)
+    if summary is None:
+        summary, _ = _extract_summary(runner_stdout)
     artifacts_info = summary.get("artifacts") if isinstance(summary, dict) else None
     if isinstance(artifacts_info, dict):
         artifact_lines = "\n".join(f"{k}: {v}" for k, v in artifacts_info.items())
@@ -322,7 +432,7 @@ def run_pipeline_interactive(
     status = "✅ 测试执行完成" if exit_code == 0 else f"⚠️ 测试执行完成，退出码 {exit_code}"
     if git_status_note and exit_code == 0:
         status += git_status_note
-    return _result(
+    yield _result(
         status,
         suite_display,
         script_text,
@@ -362,7 +472,7 @@ with gr.Blocks(title="自动化测试生成与执行 Demo") as demo:
 
         with gr.Column():
             mode_radio = gr.Radio(
-                choices=["mock", "subprocess", "http"],
+                choices=["mock", "subprocess", "persistent", "http"],
                 value="mock",
                 label="LLM 模式",
             )
@@ -375,6 +485,7 @@ with gr.Blocks(title="自动化测试生成与执行 Demo") as demo:
             http_key_box = gr.Textbox(label="API Key (可选)")
             http_key_env_box = gr.Textbox(value="LLM_API_KEY", label="API Key 环境变量名")
             http_timeout_slider = gr.Slider(10, 300, value=60, step=5, label="HTTP Timeout (秒)")
+            cache_checkbox = gr.Checkbox(value=True, label="启用 LLM 响应缓存")
             system_prompt_box = gr.Textbox(label="自定义系统提示词 (可选)", lines=6)
             request_template_box = gr.Textbox(value=str(DEFAULT_REQUEST_TEMPLATE), label="执行请求模板路径")
             runner_path_box = gr.Textbox(value=str(DEFAULT_RUNNER_PATH), label="runner/run.py 路径")
@@ -384,7 +495,7 @@ with gr.Blocks(title="自动化测试生成与执行 Demo") as demo:
             max_fixes_slider = gr.Slider(1, 10, value=2, step=1, label="最大修复次数")
             artifacts_path_box = gr.Textbox(
                 value=str(DEFAULT_ARTIFACTS_DIR),
-                label="测试产物目录",
+                label="测试产物根目录（每次运行写入 <run_id>/ 子目录）",
             )
             gr.Markdown("### 🚀 CI/CD 与仓库同步")
             generate_ci_checkbox = gr.Checkbox(value=True, label="生成 CI/CD YAML")
@@ -451,6 +562,7 @@ with gr.Blocks(title="自动化测试生成与执行 Demo") as demo:
             git_remote_box,
             git_branch_box,
             git_commit_box,
+            cache_checkbox,
         ],
         outputs=[
             status_output,
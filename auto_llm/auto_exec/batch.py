@@ -0,0 +1,350 @@
+"""
+批量流水线：对目录或清单中的多个测试套件 / 用户故事完成“生成 → 执行”，最后输出一份汇总摘要。
+
+两个阶段分别限流：
+- 生成阶段在同一事件循环中并发调用模型，同时进行的调用数受 --llm-concurrency 限制（推理端的瓶颈）；
+- 执行阶段由 --exec-workers 个线程执行 pytest（本机 CPU 的瓶颈）。
+每个任务生成完成后立即进入执行阶段，两个阶段流水并行，推理端与本机核数可以同时跑满。
+
+清单为 JSON：列表或 {"jobs": [...]}，每项为路径字符串或对象：
+    {"suite": "case_inputs/a.json"}
+    {"story_file": "stories/b.txt", "suite_id": "...", "suite_name": "...", "target": "...",
+     "entry_point": "tests/test_b.py", "fixtures_hint": "...", "name": "b"}
+相对路径以清单所在目录为基准。
+
+入口：python -m auto_llm.auto_exec.batch --batch <目录或清单> ...（其余参数与 pipeline 相同）。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from ..generator.llm_client import LLMClient
+from ..generator.sharding import DEFAULT_SHARD_MAX_CHARS
+from ..generator.prompt_builder import prompt_layout_from_args
+from ..generator.token_budget import budget_from_args
+from ..testcase_generator import StoryMetadata, generate_test_suite
+from .pipeline import (
+    DEFAULT_ARTIFACTS_DIR,
+    EXEC_ENGINE_INPROCESS,
+    EXEC_ENGINE_POOL,
+    REPAIR_CONTEXT_DIGEST,
+    agenerate_script,
+    build_client,
+    build_exec_template,
+    commit_regen_manifest,
+    execute_tests,
+    extract_summary,
+    get_regen_manifest,
+    load_suite,
+    new_run_id,
+    parse_args,
+    prepare_exec_request,
+    report_client_stats,
+    resolve_runner_path,
+    resolve_script_path,
+    try_auto_fix,
+)
+
+SUITE_SUFFIXES = {".json"}
+STORY_SUFFIXES = {".txt", ".md"}
+STORY_METADATA_FIELDS = ("suite_id", "suite_name", "target", "entry_point", "fixtures_hint")
+
+
+@dataclass
+class BatchJob:
+    name: str
+    suite_path: Optional[Path] = None
+    story_path: Optional[Path] = None
+    story: Optional[str] = None
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class JobResult:
+    name: str
+    source: str
+    status: str = "pending"  # passed / failed / error；dry-run 时为 generated
+    script: Optional[str] = None
+    run_id: Optional[str] = None
+    artifacts_dir: Optional[str] = None
+    exit_code: Optional[int] = None
+    totals: Optional[Dict[str, int]] = None
+    generation_s: float = 0.0
+    execution_s: float = 0.0
+    auto_fixed: bool = False
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in self.__dict__.items() if value is not None}
+
+
+def _unique_name(stem: str, used: Set[str]) -> str:
+    name = stem
+    index = 2
+    while name in used:
+        name = f"{stem}-{index}"
+        index += 1
+    used.add(name)
+    return name
+
+
+def _manifest_job(entry: Any, base_dir: Path, used: Set[str]) -> BatchJob:
+    if isinstance(entry, str):
+        entry = {"story_file" if Path(entry).suffix.lower() in STORY_SUFFIXES else "suite": entry}
+    if not isinstance(entry, dict):
+        raise ValueError(f"无法识别的清单条目: {entry!r}")
+    metadata = {key: str(entry[key]) for key in STORY_METADATA_FIELDS if entry.get(key)}
+    if entry.get("suite"):
+        path = (base_dir / entry["suite"]).resolve()
+        return BatchJob(_unique_name(entry.get("name") or path.stem, used), suite_path=path, metadata=metadata)
+    if entry.get("story_file"):
+        path = (base_dir / entry["story_file"]).resolve()
+        return BatchJob(_unique_name(entry.get("name") or path.stem, used), story_path=path, metadata=metadata)
+    if entry.get("story"):
+        stem = entry.get("name") or metadata.get("suite_id") or "story"
+        return BatchJob(_unique_name(stem, used), story=str(entry["story"]), metadata=metadata)
+    raise ValueError(f"清单条目缺少 suite / story_file / story: {entry!r}")
+
+
+def discover_jobs(source: Path) -> List[BatchJob]:
+    """目录：*.json 作为测试套件、*.txt / *.md 作为用户故事（按文件名排序）；文件：按 JSON 清单解析。"""
+    used: Set[str] = set()
+    if source.is_dir():
+        jobs: List[BatchJob] = []
+        for path in sorted(source.iterdir()):
+            if not path.is_file():
+                continue
+            suffix = path.suffix.lower()
+            if suffix in SUITE_SUFFIXES:
+                jobs.append(BatchJob(_unique_name(path.stem, used), suite_path=path.resolve()))
+            elif suffix in STORY_SUFFIXES:
+                jobs.append(BatchJob(_unique_name(path.stem, used), story_path=path.resolve()))
+        return jobs
+    if not source.exists():
+        raise FileNotFoundError(f"未找到批量输入: {source}")
+    manifest = json.loads(source.read_text(encoding="utf-8"))
+    entries = manifest.get("jobs", []) if isinstance(manifest, dict) else manifest
+    return [_manifest_job(entry, source.parent, used) for entry in entries]
+
+
+class BatchRunner:
+    """按任务流水执行：生成阶段受 LLM 并发额度限制，执行阶段受 exec_workers 个线程限制。"""
+
+    def __init__(self, args: argparse.Namespace, client: LLMClient) -> None:
+        self.args = args
+        self.client = client
+        self.output_root = Path(args.output_root).resolve()
+        self.guide_text = Path(args.system_guide).read_text(encoding="utf-8") if args.system_guide else None
+        self.shard_size = int(getattr(args, "shard_size", 0) or 0)
+        self.shard_max_chars = int(getattr(args, "shard_max_chars", DEFAULT_SHARD_MAX_CHARS) or DEFAULT_SHARD_MAX_CHARS)
+        # 所有任务共用同一份提示词预算与布局；显式传入，不依赖 pipeline 模块的全局状态
+        self.prompt_budget = budget_from_args(args)
+        self.prompt_layout = prompt_layout_from_args(args)
+        self.exec_workers = max(int(getattr(args, "exec_workers", 1) or 1), 1)
+        self.runner_path = resolve_runner_path(args.runner_path)
+        self.artifacts_root = Path(getattr(args, "artifacts_path", str(DEFAULT_ARTIFACTS_DIR))).resolve()
+        # 与单次流水线一致：dry-run 不执行测试，也不读取执行模板
+        self.exec_template = {} if args.dry_run else build_exec_template(args)
+        if self.exec_template.get("engine") == EXEC_ENGINE_POOL:
+            # worker 池至少要能同时容纳所有执行线程
+            self.exec_template["pool_size"] = max(int(self.exec_template.get("pool_size") or 1), self.exec_workers)
+        elif self.exec_template.get("engine") == EXEC_ENGINE_INPROCESS and self.exec_workers > 1:
+            print(
+                "[batch] 警告：inprocess 引擎在同一进程内串行执行，--exec-workers 不生效，建议改用 subprocess 或 pool",
+                file=sys.stderr,
+            )
+        self._claimed_scripts: Set[Path] = set()
+
+    # --- 生成阶段 ---------------------------------------------------------
+    def _load_or_generate_suite_sync(self, job: BatchJob) -> Dict[str, Any]:
+        story_text = job.story
+        if story_text is None and job.story_path is not None:
+            story_text = job.story_path.read_text(encoding="utf-8")
+        metadata = StoryMetadata(**{key: job.metadata.get(key) for key in STORY_METADATA_FIELDS})
+        return generate_test_suite(story_text or "", self.client, metadata)
+
+    def _job_output_root(self, job: BatchJob, suite: Dict[str, Any]) -> Path:
+        """多个任务的入口文件相同时，后来者写入 <output_root>/batch/<任务名>/，避免互相覆盖。"""
+        output_root = self.output_root
+        if resolve_script_path(suite, output_root).resolve() in self._claimed_scripts:
+            output_root = self.output_root / "batch" / job.name
+        self._claimed_scripts.add(resolve_script_path(suite, output_root).resolve())
+        return output_root
+
+    async def _generate(self, job: BatchJob, result: JobResult) -> tuple[Dict[str, Any], Path, Path]:
+        start = time.time()
+        try:
+            if job.suite_path is not None:
+                suite = load_suite(job.suite_path)
+            else:
+                suite = await self.client.arun_bounded(self._load_or_generate_suite_sync, job)
+            # 检查与登记入口文件之间没有 await，事件循环内不会并发冲突
+            output_root = self._job_output_root(job, suite)
+            script_path = await agenerate_script(
+                suite,
+                self.client,
+                output_root,
+                self.guide_text,
+                self.shard_size,
+                self.shard_max_chars,
+                regen=get_regen_manifest(output_root, force=getattr(self.args, "full_regen", False)),
+                budget=self.prompt_budget,
+                layout=self.prompt_layout,
+            )
+        finally:
+            result.generation_s = round(time.time() - start, 4)
+        return suite, output_root, script_path
+
+    # --- 执行阶段（在执行线程池中运行） ------------------------------------
+    def _execute(self, suite: Dict[str, Any], output_root: Path, script_path: Path, result: JobResult) -> None:
+        start = time.time()
+        script_location = str(script_path.resolve())
+        exec_request = prepare_exec_request(
+            self.exec_template, script_location, self.client.get_stats(), artifacts_root=self.artifacts_root
+        )
+        result.run_id = exec_request["run_id"]
+        result.artifacts_dir = exec_request["artifacts_dir"]
+        exit_code, stdout_text, _, summary = execute_tests(exec_request, self.runner_path, echo=False)
+        if exit_code != 0 and getattr(self.args, "auto_fix", False):
+            exit_code, fixed_stdout, _, _ = try_auto_fix(
+                suite=suite,
+                client=self.client,
+                output_root=output_root,
+                artifacts_dir=Path(exec_request["artifacts_dir"]),
+                runner_path=self.runner_path,
+                exec_template=self.exec_template,
+                script_relative=script_location,
+                max_fixes=int(getattr(self.args, "max_fixes", 2)),
+                fix_scope=getattr(self.args, "fix_scope", "file"),
+                rerun_failed=getattr(self.args, "rerun_failed", False),
+                repair_context=getattr(self.args, "repair_context", REPAIR_CONTEXT_DIGEST),
+                echo=False,
+                budget=self.prompt_budget,
+                layout=self.prompt_layout,
+            )
+            result.auto_fixed = exit_code == 0
+            summary = None
+            stdout_text = fixed_stdout or stdout_text
+        summary = summary or extract_summary(stdout_text) or {}
+        result.exit_code = exit_code
+        result.totals = summary.get("totals")
+        if summary.get("run_id"):
+            result.run_id = summary["run_id"]
+            result.artifacts_dir = summary.get("artifacts_dir", result.artifacts_dir)
+        result.status = "passed" if exit_code == 0 else "failed"
+        if exit_code == 0:
+            commit_regen_manifest(get_regen_manifest(output_root), suite, script_path)
+        result.execution_s = round(time.time() - start, 4)
+
+    async def _run_job(self, job: BatchJob, executor: ThreadPoolExecutor) -> JobResult:
+        source = job.suite_path or job.story_path or "<story>"
+        result = JobResult(name=job.name, source=str(source))
+        try:
+            suite, output_root, script_path = await self._generate(job, result)
+            result.script = str(script_path)
+            if self.args.dry_run:
+                result.status = "generated"
+            else:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(executor, self._execute, suite, output_root, script_path, result)
+        except Exception as exc:  # noqa: BLE001
+            result.status = "error"
+            result.error = f"{type(exc).__name__}: {exc}"
+            print(f"[batch] {job.name} 失败: {result.error}", file=sys.stderr)
+        else:
+            print(f"[batch] {job.name}: {result.status}（生成 {result.generation_s:.2f}s，执行 {result.execution_s:.2f}s）")
+        return result
+
+    async def arun(self, jobs: List[BatchJob]) -> List[JobResult]:
+        with ThreadPoolExecutor(max_workers=self.exec_workers, thread_name_prefix="batch-exec") as executor:
+            return list(await asyncio.gather(*(self._run_job(job, executor) for job in jobs)))
+
+
+def aggregate(results: List[JobResult], duration_s: float, runner: BatchRunner, source: Path) -> Dict[str, Any]:
+    """汇总各任务结果：任务状态计数、用例总数，以及两个阶段的累计耗时与墙钟时间。"""
+    totals = {"total": 0, "passed": 0, "failed": 0, "skipped": 0}
+    for result in results:
+        for key in totals:
+            totals[key] += int((result.totals or {}).get(key, 0) or 0)
+    return {
+        "source": str(source),
+        "duration_s": round(duration_s, 4),
+        "jobs": {
+            "total": len(results),
+            "passed": sum(1 for result in results if result.status == "passed"),
+            "failed": sum(1 for result in results if result.status == "failed"),
+            "error": sum(1 for result in results if result.status == "error"),
+            "generated": sum(1 for result in results if result.status == "generated"),
+            "auto_fixed": sum(1 for result in results if result.auto_fixed),
+        },
+        "totals": totals,
+        "stages": {
+            "llm_concurrency": runner.client.max_concurrency,
+            "exec_workers": runner.exec_workers,
+            "engine": runner.exec_template.get("engine", "subprocess"),
+            # 累计耗时 / 墙钟时间 ≈ 该阶段的平均并行度
+            "generation_busy_s": round(sum(result.generation_s for result in results), 4),
+            "execution_busy_s": round(sum(result.execution_s for result in results), 4),
+        },
+        "llm": runner.client.get_stats(),
+        "results": [result.to_dict() for result in results],
+    }
+
+
+def run_batch(args: argparse.Namespace, client: LLMClient) -> int:
+    """批量模式入口，返回进程退出码：全部任务通过为 0，否则为 1。"""
+    source = Path(args.batch).resolve()
+    jobs = discover_jobs(source)
+    if not jobs:
+        raise SystemExit(f"批量输入中没有可执行的测试套件或用户故事: {source}")
+    if not getattr(args, "skip_ci", False) or getattr(args, "git_auto_push", False):
+        print("[batch] 批量模式不生成 CI 工作流，也不自动 git push")
+
+    batch_id = new_run_id("batch")
+    runner = BatchRunner(args, client)
+    print(
+        f"[batch] {batch_id}: {len(jobs)} 个任务，LLM 并发 {client.max_concurrency}，"
+        f"执行并发 {runner.exec_workers}（引擎 {runner.exec_template.get('engine', 'subprocess')}）"
+    )
+    if args.dry_run:
+        print("[batch] dry-run 模式，只生成脚本不执行测试")
+
+    start = time.time()
+    results = asyncio.run(runner.arun(jobs))
+    summary = {"batch_id": batch_id, **aggregate(results, time.time() - start, runner, source)}
+
+    summary_path = Path(args.batch_summary).resolve() if getattr(args, "batch_summary", None) else (
+        runner.artifacts_root / f"{batch_id}.json"
+    )
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    summary_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps({key: value for key, value in summary.items() if key != "results"}, ensure_ascii=False, indent=2))
+    print(f"[batch] 汇总摘要已写入: {summary_path}")
+    jobs_summary = summary["jobs"]
+    return 0 if jobs_summary["passed"] + jobs_summary["generated"] == jobs_summary["total"] else 1
+
+
+def main() -> None:
+    args = parse_args()
+    if not getattr(args, "batch", None):
+        raise SystemExit("请通过 --batch 指定测试套件目录或 JSON 清单")
+
+    client = build_client(args)
+    try:
+        exit_code = run_batch(args, client)
+    finally:
+        report_client_stats(client)
+        client.close()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,24 +10,55 @@ from __future__ import annotations
 print(f"[pipeline] module loaded from: {__file__}")
 
 import argparse
+import ast
+import asyncio
+import atexit
+import importlib.util
 import json
 import os
 import shlex
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 
+from ..generator.http_session import DEFAULT_POOL_SIZE
 from ..generator.llm_client import LLMClient, load_local_qwen_client
-from ..generator.prompt_builder import PromptBuilder
+from ..generator.response_cache import add_cache_arguments, response_cache_from_args
+from ..generator.stop_detection import STOP_AT_CODE_BLOCK
+from ..generator.structured_output import add_structured_output_arguments
+from ..generator.token_budget import TokenBudget, add_prompt_budget_arguments, budget_from_args
+from ..generator.targeted_fix import extract_repair_unit, failing_targets, splice_definitions
+from ..generator.prompt_builder import (
+    LAYOUT_DEFAULT,
+    PromptBuilder,
+    add_prompt_layout_arguments,
+    prompt_layout_from_args,
+)
+from ..generator.load_balancer import add_http_balance_arguments, http_balance_kwargs
+from ..generator.resilience import add_http_resilience_arguments, http_resilience_kwargs
+from ..generator.regen_manifest import REGEN_PARTIAL, REGEN_SKIP, RegenManifest, RegenPlan, suite_fingerprint
+from ..generator.sharding import DEFAULT_SHARD_MAX_CHARS, merge_test_modules, shard_suite
 from ..generator.tooling import WorkspaceManager, extract_code_block
-from ..testcase_generator import StoryMetadata, generate_test_suite
+from ..testcase_generator import StoryMetadata, generate_test_suite, suite_response_format
 
 BASE_DIR = Path(__file__).resolve().parent
 DEFAULT_EXEC_TEMPLATE = BASE_DIR / "input_examples" / "exec_request.json"
-DEFAULT_ARTIFACTS_DIR = BASE_DIR / "artifacts"
+DEFAULT_ARTIFACTS_DIR = BASE_DIR.parent / "artifacts"
 DEFAULT_CI_OUTPUT = BASE_DIR.parent / "artifacts" / "generated_ci.yml"
+EXEC_ENGINE_SUBPROCESS = "subprocess"
+EXEC_ENGINE_INPROCESS = "inprocess"
+EXEC_ENGINE_POOL = "pool"
+DEFAULT_EXEC_POOL_SIZE = 2
+REPAIR_CONTEXT_DIGEST = "digest"
+REPAIR_CONTEXT_FULL = "full"
 
 
 def parse_args() -> argparse.Namespace:
@@ -40,6 +71,23 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--target", help="测试上下文中的目标地址，例如 API 网关")
     parser.add_argument("--entry-point", help="自动生成测试套件时的入口文件名")
     parser.add_argument("--fixtures-hint", help="提醒模型在 fixtures 中补充的额外信息，例如鉴权方式")
+    parser.add_argument(
+        "--batch",
+        help=(
+            "批量模式：目录（其中的 *.json 作为测试套件，*.txt / *.md 作为用户故事）或 JSON 清单，"
+            "逐个生成并执行后输出一份汇总摘要"
+        ),
+    )
+    parser.add_argument(
+        "--exec-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="批量模式下同时执行 pytest 的任务数（与 --llm-concurrency 分别限流），默认 CPU 核数",
+    )
+    parser.add_argument(
+        "--batch-summary",
+        help="批量模式汇总摘要的输出路径，默认 <artifacts-path>/<batch_id>.json",
+    )
     parser.add_argument(
         "--output-root",
         default=str(BASE_DIR),
@@ -47,9 +95,9 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "--mode",
-        choices=["mock", "subprocess", "http"],
+        choices=["mock", "subprocess", "persistent", "http"],
         default="mock",
-        help="LLM 调用模式",
+        help="LLM 调用模式；persistent 以 --worker 常驻运行本地模型脚本，模型只加载一次",
     )
     parser.add_argument("--mock-response", help="mock 模式下的模型响应文件")
     parser.add_argument(
@@ -91,12 +139,62 @@ def parse_args() -> argparse.Namespace:
         default=60.0,
         help="HTTP 请求超时时间（秒），默认 60",
     )
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help=f"HTTP 连接池大小（单个 endpoint 的最大并发连接数），默认 {DEFAULT_POOL_SIZE}",
+    )
+    parser.add_argument(
+        "--http-no-keep-alive",
+        action="store_true",
+        help="禁用 HTTP keep-alive，每次请求后关闭连接（仅用于对比排查）",
+    )
+    parser.add_argument(
+        "--http-stream",
+        action="store_true",
+        help="以流式请求调用 HTTP 接口，代码块/JSON 完整后客户端立即断开（适用于不支持 stop_at 的服务端）",
+    )
+    add_http_resilience_arguments(parser)
+    add_http_balance_arguments(parser)
+    add_prompt_budget_arguments(parser)
+    add_prompt_layout_arguments(parser)
+    add_structured_output_arguments(parser)
     parser.add_argument(
         "--http-schema",
         choices=["openai", "simple"],
         default="openai",
         help="HTTP 请求 payload 结构：openai 使用 messages 数组，simple 使用 system/user 字段",
     )
+    parser.add_argument(
+        "--async-llm",
+        action="store_true",
+        help="并发发起相互独立的 LLM 调用（脚本生成与 CI YAML 生成同时进行）",
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=4,
+        help="异步模式下同时进行的 LLM 调用上限，默认 4",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=0,
+        help="大套件分片生成：每个分片最多包含的用例数，各分片并发生成后合并为一个脚本；0 表示不分片（默认）",
+    )
+    parser.add_argument(
+        "--shard-max-chars",
+        type=int,
+        default=DEFAULT_SHARD_MAX_CHARS,
+        help=f"单个分片中用例 JSON 的最大字符数，默认 {DEFAULT_SHARD_MAX_CHARS}",
+    )
+    parser.add_argument(
+        "--full-regen",
+        action="store_true",
+        help="忽略增量再生成清单，始终完整生成脚本（测试通过后仍会更新清单）",
+    )
+    add_cache_arguments(parser)
     parser.add_argument(
         "--request-template",
         default=str(DEFAULT_EXEC_TEMPLATE),
@@ -122,10 +220,45 @@ def parse_args() -> argparse.Namespace:
         default=2,
         help="自动修复的最大迭代次数（默认 2）",
     )
+    parser.add_argument(
+        "--fix-scope",
+        choices=["file", "failing"],
+        default="file",
+        help="自动修复范围：file 整文件重写（默认）；failing 只修复 report.json 中失败的测试函数及其依赖并拼回原文件",
+    )
+    parser.add_argument(
+        "--repair-context",
+        choices=[REPAIR_CONTEXT_DIGEST, REPAIR_CONTEXT_FULL],
+        default=REPAIR_CONTEXT_DIGEST,
+        help=(
+            "整文件修复时提供给模型的失败信息：digest 按错误类型去重后的失败摘要（默认，只含异常、断言信息、"
+            "生成脚本中的出错行与捕获输出）；full 附带 junit/coverage/benchmark 与全部日志"
+        ),
+    )
+    parser.add_argument(
+        "--exec-engine",
+        choices=[EXEC_ENGINE_SUBPROCESS, EXEC_ENGINE_INPROCESS, EXEC_ENGINE_POOL],
+        default=None,
+        help=(
+            "测试执行引擎：subprocess 启动 runner 子进程；inprocess 在当前进程内调用 pytest.main；"
+            "pool 交给预加载 pytest 插件的常驻 worker 池（默认沿用执行模板）"
+        ),
+    )
+    parser.add_argument(
+        "--exec-pool-size",
+        type=int,
+        default=DEFAULT_EXEC_POOL_SIZE,
+        help="pool 引擎预先 fork 的 pytest worker 数",
+    )
+    parser.add_argument(
+        "--rerun-failed",
+        action="store_true",
+        help="自动修复迭代中只重跑上一轮失败的用例（不采集覆盖率），全部通过后再完整执行一次确认",
+    )
     parser.add_argument(
         "--artifacts-path",
         default=str(DEFAULT_ARTIFACTS_DIR),
-        help="测试产物目录（包含日志与报告），可设置为绝对路径",
+        help="测试产物根目录，每次执行的日志与报告写入其下的 <run_id>/ 子目录，可设置为绝对路径",
     )
     parser.add_argument(
         "--ci-output",
@@ -202,6 +335,16 @@ def _collect_http_headers(args: argparse.Namespace) -> Dict[str, str]:
 
 
 def build_client(args: argparse.Namespace) -> LLMClient:
+    client = _build_mode_client(args)
+    client.max_concurrency = max(int(getattr(args, "llm_concurrency", 4) or 4), 1)
+    client.response_cache = response_cache_from_args(args)
+    if getattr(args, "structured_output", False):
+        # 只影响 stop_at="json" 的 HTTP 请求，即测试套件生成与其修复调用
+        client.json_response_format = suite_response_format()
+    return client
+
+
+def _build_mode_client(args: argparse.Namespace) -> LLMClient:
     if args.local_qwen:
         return load_local_qwen_client(args.local_qwen)
     if args.mode == "mock" and args.subprocess_cmd:
@@ -212,6 +355,9 @@ def build_client(args: argparse.Namespace) -> LLMClient:
     if args.mode == "subprocess":
         cmd = _normalize_subprocess_cmd(args.subprocess_cmd)
         return LLMClient(mode="subprocess", subprocess_cmd=cmd)
+    if args.mode == "persistent":
+        cmd = _normalize_subprocess_cmd(args.subprocess_cmd)
+        return LLMClient(mode="persistent", subprocess_cmd=cmd)
     if args.mode == "http":
         if not args.http_endpoint:
             raise ValueError("HTTP 模式需要提供 --http-endpoint")
@@ -223,35 +369,403 @@ def build_client(args: argparse.Namespace) -> LLMClient:
             http_model=args.http_model,
             http_timeout=args.http_timeout,
             http_schema=getattr(args, "http_schema", "openai"),
+            http_pool_size=getattr(args, "http_pool_size", DEFAULT_POOL_SIZE),
+            http_keep_alive=not getattr(args, "http_no_keep_alive", False),
+            http_stream=getattr(args, "http_stream", False),
+            **http_resilience_kwargs(args),
+            **http_balance_kwargs(args),
         )
     raise ValueError(f"不支持的模式: {args.mode}")
 
 
+def _script_entry_point(suite: Dict[str, Any]) -> str:
+    return suite.get("context", {}).get("entry_point", "tests/test_generated.py")
+
+
+def resolve_script_path(suite: Dict[str, Any], output_root: Path) -> Path:
+    """返回脚本的落盘位置（与 WorkspaceManager.write_file 的规则一致），生成前即可确定。"""
+    return output_root / _script_entry_point(suite)
+
+
+def make_prompt_builder(
+    guide_text: Optional[str] = None,
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> PromptBuilder:
+    """
+    budget 由调用方根据命令行参数创建（见 token_budget.budget_from_args），为 None 时不限制 token 数；
+    layout 对应 --prompt-layout（见 prompt_builder.prompt_layout_from_args）。
+    """
+    return PromptBuilder(script_guide=guide_text, token_budget=budget, layout=layout)
+
+
+def _report_prompt_budget(builder: PromptBuilder, label: str) -> None:
+    """设置了 token 预算时打印每段提示词的最终 token 数；必需内容本身超出预算时给出警告。"""
+    report = builder.last_report
+    if report is None or report.max_tokens is None:
+        return
+    print(f"[pipeline] 提示词预算（{label}）: {report.describe()}")
+    if report.over_budget:
+        print(
+            f"[pipeline] 警告：{label}提示词的必需内容已超出 token 预算，可调小 --shard-max-chars 拆分套件或调大预算",
+            file=sys.stderr,
+        )
+
+
+def _build_script_prompts(
+    suite: Dict[str, Any],
+    guide_text: Optional[str],
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> Tuple[str, str]:
+    builder = make_prompt_builder(guide_text, budget, layout)
+    user_prompt = builder.build_user_prompt(suite)
+    _report_prompt_budget(builder, "脚本生成")
+    return builder.build_system_prompt(), user_prompt
+
+
+def _write_script_code(suite: Dict[str, Any], output_root: Path, code_text: str) -> Path:
+    workspace = WorkspaceManager(output_root)
+    target_path = workspace.write_file(_script_entry_point(suite), code_text)
+    print(f"[pipeline] 已生成脚本: {target_path}")
+    return target_path
+
+
+@dataclass(frozen=True)
+class _CodeCall:
+    """生成流程请求的一次模型调用；checked 时做语法检查，语法错误的输出丢弃缓存后重试一次。"""
+
+    system_prompt: str
+    user_prompt: str
+    label: str = "整个套件"
+    checked: bool = False
+    stream: bool = False
+
+
+# 生成流程：每次 yield 一批相互独立、可并发的模型调用，接收按顺序提取出的代码，最终返回脚本路径
+_ScriptFlow = Generator[List[_CodeCall], List[str], Path]
+
+
+def _extract_call_code(client: LLMClient, call: _CodeCall, response: str) -> str:
+    code_text = extract_code_block(response)
+    if call.checked:
+        try:
+            ast.parse(code_text)
+        except SyntaxError:
+            client.invalidate_cached(call.system_prompt, call.user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+            raise
+    return code_text
+
+
+def _generate_call_code(
+    client: LLMClient,
+    call: _CodeCall,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """_agenerate_call_code 的同步版本；on_delta 只用于 stream=True 的调用。"""
+    last_error: Optional[SyntaxError] = None
+    for _ in range(2):
+        response = client.generate_code(
+            call.system_prompt,
+            call.user_prompt,
+            on_delta=on_delta if call.stream else None,
+            stop_at=STOP_AT_CODE_BLOCK,
+        )
+        try:
+            return _extract_call_code(client, call, response)
+        except SyntaxError as exc:
+            last_error = exc
+    raise ValueError(f"{call.label}生成的脚本存在语法错误: {last_error}")
+
+
+async def _agenerate_call_code(client: LLMClient, call: _CodeCall) -> str:
+    """执行一次模型调用并提取代码块；checked 的调用语法错误时重试一次，保证可以参与 AST 合并。"""
+    last_error: Optional[SyntaxError] = None
+    for _ in range(2):
+        response = await client.agenerate_code(call.system_prompt, call.user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+        try:
+            return _extract_call_code(client, call, response)
+        except SyntaxError as exc:
+            last_error = exc
+    raise ValueError(f"{call.label}生成的脚本存在语法错误: {last_error}")
+
+
+def _run_script_flow(
+    flow: _ScriptFlow,
+    client: LLMClient,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Path:
+    """
+    同步驱动生成流程：一批中的多个调用在线程池中并发执行（线程数不超过 client.max_concurrency），
+    不创建事件循环，因此可以在已有事件循环的线程中调用（例如 Gradio 的回调）。
+    """
+    try:
+        calls = next(flow)
+        while True:
+            if len(calls) == 1:
+                codes = [_generate_call_code(client, calls[0], on_delta)]
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(calls), client.max_concurrency)) as executor:
+                    codes = list(executor.map(partial(_generate_call_code, client), calls))
+            calls = flow.send(codes)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _arun_script_flow(flow: _ScriptFlow, client: LLMClient) -> Path:
+    """异步驱动生成流程：一批中的多个调用并发执行（并发数受 client.max_concurrency 限制）。"""
+    try:
+        calls = next(flow)
+        while True:
+            codes = list(await asyncio.gather(*(_agenerate_call_code(client, call) for call in calls)))
+            calls = flow.send(codes)
+    except StopIteration as stop:
+        return stop.value
+
+
+# 生成出各脚本当前内容的模型调用（按脚本绝对路径记录，含自动修复的调用）。
+# 脚本执行失败时丢弃这些调用的响应缓存，否则同一份失败的脚本会在缓存有效期内被反复命中
+_SCRIPT_CALLS: Dict[Path, Tuple[LLMClient, List[_CodeCall]]] = {}
+_SCRIPT_CALLS_LOCK = threading.Lock()
+
+
+def _record_script_calls(script_path: Path, client: LLMClient, calls: List[_CodeCall]) -> None:
+    if client.response_cache is None:
+        return
+    with _SCRIPT_CALLS_LOCK:
+        _SCRIPT_CALLS[Path(script_path).resolve()] = (client, list(calls))
+
+
+def _discard_script_responses(script_path: str) -> None:
+    """丢弃生成该脚本当前内容的模型响应缓存，下次运行重新调用模型。"""
+    with _SCRIPT_CALLS_LOCK:
+        entry = _SCRIPT_CALLS.pop(Path(script_path).resolve(), None)
+    if entry is None:
+        return
+    client, calls = entry
+    for call in calls:
+        client.invalidate_cached(call.system_prompt, call.user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+    print(f"[pipeline] 脚本执行失败，已丢弃生成它的 {len(calls)} 条模型响应缓存: {script_path}")
+
+
+def _build_shard_prompts(
+    shards: List[Dict[str, Any]],
+    guide_text: Optional[str],
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> Tuple[str, List[str]]:
+    builder = make_prompt_builder(guide_text, budget, layout)
+    system_prompt = builder.build_system_prompt()
+    print(f"[pipeline] 分片生成：{len(shards)} 个分片，用例数 {[len(shard.get('test_cases', [])) for shard in shards]}")
+    user_prompts = []
+    for index, shard in enumerate(shards, start=1):
+        user_prompts.append(builder.build_shard_user_prompt(shard, index, len(shards)))
+        _report_prompt_budget(builder, f"分片 {index}")
+    return system_prompt, user_prompts
+
+
+def _merge_shard_codes(codes: List[str]) -> str:
+    merged = merge_test_modules(codes)
+    if merged.duplicates:
+        print(f"[pipeline] 合并时去重的定义: {sorted(set(merged.duplicates))}")
+    if merged.renamed:
+        print(f"[pipeline] 合并时重命名的定义: {merged.renamed}")
+    if merged.conflicts:
+        print(
+            f"[pipeline] 警告：以下定义在不同分片中实现不一致，已按分片重命名: {sorted(set(merged.conflicts))}",
+            file=sys.stderr,
+        )
+    return merged.code
+
+
+_REGEN_MANIFESTS: Dict[Path, RegenManifest] = {}
+_REGEN_LOCK = threading.Lock()
+
+
+def get_regen_manifest(output_root: Path, force: bool = False) -> RegenManifest:
+    """获取脚本输出根目录对应的增量再生成清单（同一进程内共享，批量模式下各任务并发使用）。"""
+    resolved = Path(output_root).resolve()
+    with _REGEN_LOCK:
+        manifest = _REGEN_MANIFESTS.get(resolved)
+        if manifest is None:
+            manifest = _REGEN_MANIFESTS[resolved] = RegenManifest(resolved, force=force)
+    return manifest
+
+
+def commit_regen_manifest(regen: Optional[RegenManifest], suite: Dict[str, Any], script_path: Path) -> None:
+    """测试通过后记录本次生成输入，下次输入未变化时跳过生成。"""
+    if regen is not None and regen.commit(_script_entry_point(suite), script_path):
+        print(f"[pipeline] 已更新增量再生成清单: {regen.path}")
+
+
+def _plan_regeneration(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    output_root: Path,
+    guide_text: Optional[str],
+    regen: Optional[RegenManifest],
+) -> Optional[RegenPlan]:
+    if regen is None:
+        return None
+    fingerprint = suite_fingerprint(suite, guide_text, client.model_identity())
+    plan = regen.plan(_script_entry_point(suite), suite, fingerprint, resolve_script_path(suite, output_root))
+    print(f"[pipeline] 增量再生成: {plan.action}（{plan.reason}）")
+    return plan
+
+
+def _build_incremental_prompts(
+    suite: Dict[str, Any],
+    plan: RegenPlan,
+    guide_text: Optional[str],
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> Tuple[str, str]:
+    builder = make_prompt_builder(guide_text, budget, layout)
+    subset = dict(suite, test_cases=plan.changed_cases)
+    user_prompt = builder.build_incremental_user_prompt(subset, plan.base_code or "")
+    _report_prompt_budget(builder, "增量生成")
+    return builder.build_system_prompt(), user_prompt
+
+
+def _write_incremental_script(
+    suite: Dict[str, Any],
+    output_root: Path,
+    plan: RegenPlan,
+    new_code: Optional[str],
+) -> Path:
+    """把新生成的用例按 AST 合并回删除过期用例后的现有脚本；合并失败时抛出 ValueError。"""
+    code_text = plan.base_code or ""
+    if new_code:
+        merged = merge_test_modules([code_text, new_code])
+        if merged.renamed:
+            print(f"[pipeline] 增量合并时重命名的定义: {merged.renamed}")
+        if merged.conflicts:
+            print(
+                f"[pipeline] 警告：以下定义与现有脚本实现不一致，新用例改用重命名后的版本: {sorted(set(merged.conflicts))}",
+                file=sys.stderr,
+            )
+        code_text = merged.code
+    return _write_script_code(suite, output_root, code_text)
+
+
+def _script_flow(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    output_root: Path,
+    guide_text: Optional[str],
+    shard_size: int,
+    shard_max_chars: int,
+    regen: Optional[RegenManifest],
+    budget: Optional[TokenBudget],
+    layout: str,
+) -> _ScriptFlow:
+    """
+    generate_script 与 agenerate_script 共用的生成流程：增量计划、分片、合并与写入都在这里完成，
+    模型调用以 _CodeCall 批次交给同步或异步驱动方执行。
+    """
+    plan = _plan_regeneration(suite, client, output_root, guide_text, regen)
+    if plan is not None and plan.action == REGEN_SKIP:
+        return resolve_script_path(suite, output_root)
+    if plan is not None and plan.action == REGEN_PARTIAL:
+        new_code: Optional[str] = None
+        if plan.changed_cases:
+            call = _CodeCall(*_build_incremental_prompts(suite, plan, guide_text, budget, layout), label="增量生成")
+            (new_code,) = yield [call]
+        try:
+            script_path = _write_incremental_script(suite, output_root, plan, new_code)
+        except ValueError as exc:
+            if plan.changed_cases:
+                client.invalidate_cached(call.system_prompt, call.user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+            print(f"[pipeline] 增量合并失败，改为完整生成: {exc}", file=sys.stderr)
+        else:
+            _record_script_calls(script_path, client, [call] if plan.changed_cases else [])
+            return script_path
+    shards = shard_suite(suite, shard_size, shard_max_chars)
+    if len(shards) > 1:
+        # 分片之间相互独立，作为一批并发生成后按 AST 合并；分片模式下不做增量展示
+        system_prompt, user_prompts = _build_shard_prompts(shards, guide_text, budget, layout)
+        calls = [
+            _CodeCall(system_prompt, user_prompt, label=f"第 {index} 个分片", checked=True)
+            for index, user_prompt in enumerate(user_prompts, start=1)
+        ]
+        codes = yield calls
+        script_path = _write_script_code(suite, output_root, _merge_shard_codes(codes))
+    else:
+        calls = [_CodeCall(*_build_script_prompts(suite, guide_text, budget, layout), checked=True, stream=True)]
+        (code_text,) = yield calls
+        script_path = _write_script_code(suite, output_root, code_text)
+    _record_script_calls(script_path, client, calls)
+    return script_path
+
+
 def generate_script(
     suite: Dict[str, Any],
     client: LLMClient,
     output_root: Path,
     guide_text: Optional[str] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
+    shard_size: int = 0,
+    shard_max_chars: int = DEFAULT_SHARD_MAX_CHARS,
+    regen: Optional[RegenManifest] = None,
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
 ) -> Path:
-    builder = PromptBuilder(script_guide=guide_text)
-    system_prompt = builder.build_system_prompt()
-    user_prompt = builder.build_user_prompt(suite)
+    """
+    生成测试脚本并写入入口文件。给出 regen 时先对照增量再生成清单：
+    输入未变化直接复用现有脚本；只有部分用例变化时只生成这些用例并合并回现有脚本。
+    同步接口：分片在线程池中并发生成，可在任意线程调用；协程中请使用 agenerate_script。
+    """
+    flow = _script_flow(suite, client, output_root, guide_text, shard_size, shard_max_chars, regen, budget, layout)
+    return _run_script_flow(flow, client, on_delta)
 
-    response = client.generate_code(system_prompt, user_prompt)
-    code_text = extract_code_block(response)
 
-    entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
-    workspace = WorkspaceManager(output_root)
-    target_path = workspace.write_file(entry_point, code_text)
-    print(f"[pipeline] 已生成脚本: {target_path}")
-    return target_path
+async def agenerate_script(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    output_root: Path,
+    guide_text: Optional[str] = None,
+    shard_size: int = 0,
+    shard_max_chars: int = DEFAULT_SHARD_MAX_CHARS,
+    regen: Optional[RegenManifest] = None,
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> Path:
+    """generate_script 的异步版本。"""
+    flow = _script_flow(suite, client, output_root, guide_text, shard_size, shard_max_chars, regen, budget, layout)
+    return await _arun_script_flow(flow, client)
+
 
+def new_run_id(prefix: Optional[str] = None) -> str:
+    """生成唯一的 run_id：模板中的 run_id 作为前缀，追加时间戳与随机后缀，保证并发执行互不覆盖。"""
+    suffix = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    return f"{prefix}-{suffix}" if prefix else suffix
 
-def prepare_exec_request(template: Dict[str, Any], script_relative: str) -> Dict[str, Any]:
+
+def prepare_exec_request(
+    template: Dict[str, Any],
+    script_relative: str,
+    llm_stats: Optional[Dict[str, Any]] = None,
+    nodeids: Optional[List[str]] = None,
+    artifacts_root: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """
+    基于执行模板生成本次执行请求。每次调用分配新的 run_id；
+    给出 artifacts_root 时产物写入 <artifacts_root>/<run_id>/（写入请求的 artifacts_dir 字段）。
+    """
     modified = dict(template)
+    modified["run_id"] = new_run_id(template.get("run_id"))
+    if artifacts_root is not None:
+        modified["artifacts_dir"] = str(Path(artifacts_root).resolve() / modified["run_id"])
     suite = dict(modified.get("suite", {}))
     suite["paths"] = [script_relative]
+    if nodeids:
+        # 只执行指定用例：部分重跑不需要覆盖率报告
+        suite["nodeids"] = list(nodeids)
+        suite["config"] = dict(suite.get("config", {}), coverage=False)
     modified["suite"] = suite
+    if llm_stats:
+        # 由 runner 原样写入结构化摘要，便于查看本次运行的缓存命中情况
+        modified["llm"] = llm_stats
     return modified
 
 
@@ -276,7 +790,141 @@ def resolve_runner_path(custom_path: Optional[str]) -> Path:
     )
 
 
-def run_tests(exec_request: Dict[str, Any], runner_path: Path) -> tuple[int, str, str]:
+_RUNNER_MODULES: Dict[Path, Any] = {}
+_EXEC_POOLS: Dict[Path, Any] = {}
+# 并发执行时 runner 模块只能导入一次，否则各线程拿到不同的模块对象（以及不同的进程内执行锁）
+_RUNNER_LOAD_LOCK = threading.RLock()
+
+
+def _load_runner_module(runner_path: Path, module_name: str = "_auto_llm_runner") -> Any:
+    """按文件路径导入 runner 目录下的模块并缓存，进程内多次执行只导入一次（连同 pytest 及其插件）。"""
+    resolved = runner_path.resolve()
+    with _RUNNER_LOAD_LOCK:
+        module = _RUNNER_MODULES.get(resolved)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, resolved)
+            if spec is None or spec.loader is None:
+                raise ImportError(f"无法加载 runner: {resolved}")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _RUNNER_MODULES[resolved] = module
+    return module
+
+
+def _close_exec_pools() -> None:
+    for pool in _EXEC_POOLS.values():
+        stats = pool.get_stats()
+        if stats.get("runs"):
+            print(
+                f"[pipeline] pytest worker 池: 执行 {stats['runs']} 次，"
+                f"相比冷启动共节省约 {stats['startup_saved_s']:.2f}s 启动时间"
+            )
+        pool.close()
+    _EXEC_POOLS.clear()
+
+
+def get_exec_pool(runner_path: Path, size: int = DEFAULT_EXEC_POOL_SIZE) -> Any:
+    """获取与 runner 同目录的常驻 pytest worker 池（首次调用时启动，进程退出时关闭）。"""
+    pool_path = runner_path.resolve().parent / "pool.py"
+    with _RUNNER_LOAD_LOCK:
+        pool = _EXEC_POOLS.get(pool_path)
+        if pool is None:
+            pool_module = _load_runner_module(pool_path, "_auto_llm_runner_pool")
+            pool = pool_module.WarmPytestPool(size=size)
+            if not _EXEC_POOLS:
+                atexit.register(_close_exec_pools)
+            _EXEC_POOLS[pool_path] = pool
+    return pool
+
+
+def execute_tests(
+    exec_request: Dict[str, Any],
+    runner_path: Path,
+    on_output: Optional[Callable[[str, str], None]] = None,
+    echo: bool = True,
+) -> tuple[int, str, str, Optional[Dict[str, Any]]]:
+    """
+    按执行请求的 engine 字段执行测试，返回 (退出码, stdout, stderr, 结构化摘要)。
+    stdout / stderr 为有界尾部（完整输出见产物目录中的日志）；on_output(stream, line) 逐行接收输出。
+    echo=False 时不把测试输出回显到终端（批量并发执行时避免输出交错），进程内引擎始终回显。
+    subprocess 引擎的摘要需调用方自行从 stdout 解析，此处返回 None。
+    执行失败时丢弃生成（或修复）被测脚本的模型响应缓存，下次运行不会再命中同一份失败的脚本。
+    """
+    result = _execute_tests(exec_request, runner_path, on_output, echo)
+    if result[0] != 0:
+        for script_path in exec_request.get("suite", {}).get("paths", []):
+            _discard_script_responses(script_path)
+    return result
+
+
+def _execute_tests(
+    exec_request: Dict[str, Any],
+    runner_path: Path,
+    on_output: Optional[Callable[[str, str], None]],
+    echo: bool,
+) -> tuple[int, str, str, Optional[Dict[str, Any]]]:
+    engine = exec_request.get("engine", EXEC_ENGINE_SUBPROCESS)
+    if engine == EXEC_ENGINE_POOL:
+        pool = get_exec_pool(runner_path, int(exec_request.get("pool_size") or DEFAULT_EXEC_POOL_SIZE))
+        print("[pipeline] 提交到常驻 pytest worker 池执行")
+        exit_code, summary, stdout_text, stderr_text = pool.execute(exec_request)
+        # worker 池在执行结束后一次性返回输出，此处按行转发
+        for stream, text, target in (("stdout", stdout_text, sys.stdout), ("stderr", stderr_text, sys.stderr)):
+            for line in text.splitlines(keepends=True):
+                if echo:
+                    target.write(line)
+                if on_output is not None:
+                    on_output(stream, line)
+    elif engine == EXEC_ENGINE_INPROCESS:
+        print(f"[pipeline] 进程内执行: {runner_path}")
+        runner = _load_runner_module(runner_path)
+        exit_code, summary, stdout_text, stderr_text = runner.execute(exec_request, on_line=on_output)
+    else:
+        return (*_run_tests_subprocess(exec_request, runner_path, on_output, echo), None)
+
+    # 与子进程模式保持一致：stdout 末尾附带 JSON 摘要，便于日志与修复提示词复用
+    summary_text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if echo:
+        print(summary_text)
+    if on_output is not None:
+        for line in (summary_text + "\n").splitlines(keepends=True):
+            on_output("stdout", line)
+    if exit_code != 0:
+        print(f"[pipeline] 测试执行失败，退出码 {exit_code}", file=sys.stderr)
+    return exit_code, stdout_text + summary_text + "\n", stderr_text, summary
+
+
+def extract_summary(stdout_text: str) -> Optional[Dict[str, Any]]:
+    """从 runner 的 stdout 中解析末尾的 JSON 摘要（subprocess 引擎不直接返回摘要）。"""
+    lines = stdout_text.splitlines()
+    for index in range(len(lines) - 1, -1, -1):
+        if not lines[index].startswith("{"):
+            continue
+        try:
+            data = json.loads("\n".join(lines[index:]))
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def run_tests(
+    exec_request: Dict[str, Any],
+    runner_path: Path,
+    on_output: Optional[Callable[[str, str], None]] = None,
+    echo: bool = True,
+) -> tuple[int, str, str]:
+    exit_code, stdout_text, stderr_text, _ = execute_tests(exec_request, runner_path, on_output, echo)
+    return exit_code, stdout_text, stderr_text
+
+
+def _run_tests_subprocess(
+    exec_request: Dict[str, Any],
+    runner_path: Path,
+    on_output: Optional[Callable[[str, str], None]] = None,
+    echo: bool = True,
+) -> tuple[int, str, str]:
     with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as tmp:
         json.dump(exec_request, tmp, ensure_ascii=False, indent=2)
         tmp_path = Path(tmp.name)
@@ -285,20 +933,12 @@ def run_tests(exec_request: Dict[str, Any], runner_path: Path) -> tuple[int, str
     cmd = [sys.executable, str(runner_path), str(tmp_path)]
     print(f"[pipeline] 调用: {' '.join(cmd)}")
     runner_cwd = runner_path.parent.parent
-    result = subprocess.run(
-        cmd,
-        cwd=runner_cwd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    if result.stdout:
-        print(result.stdout, end="")
-    if result.stderr:
-        print(result.stderr, end="", file=sys.stderr)
+    # runner 输出边执行边回显并转发给 on_output，内存中只保留有界尾部
+    stream_capture = _load_runner_module(runner_path.parent / "stream_capture.py", "_auto_llm_stream_capture")
+    result = stream_capture.run_streaming(cmd, cwd=runner_cwd, on_line=on_output, echo=echo)
     if result.returncode != 0:
         print(f"[pipeline] 测试执行失败，退出码 {result.returncode}", file=sys.stderr)
-    return result.returncode, result.stdout or "", result.stderr or ""
+    return result.returncode, result.stdout, result.stderr
 
 
 # ----------------------- CI/CD generation ----------------------------------
@@ -309,6 +949,32 @@ def _resolve_output_path(base_root: Path, path_str: str) -> Path:
     return path
 
 
+def build_ci_context(
+    python_version: str,
+    script_path: Path,
+    repo_root: Path,
+    artifacts_path: str,
+    entry_point: str,
+) -> Dict[str, str]:
+    script_rel_repo = os.path.relpath(script_path.resolve(), repo_root)
+    return {
+        "python_version": python_version,
+        "test_command": f"python -m pytest {script_rel_repo}",
+        "artifacts_path": artifacts_path,
+        "requirements_file": "auto_llm/requirements.txt",
+        "entry_point": entry_point,
+    }
+
+
+def _write_ci_yaml(output_root: Path, ci_output_path: str, response: str) -> Tuple[Path, str]:
+    yaml_text = extract_code_block(response).strip()
+    target_path = _resolve_output_path(output_root, ci_output_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    target_path.write_text(yaml_text, encoding="utf-8")
+    print(f"[pipeline] 已生成 CI 工作流: {target_path}")
+    return target_path, yaml_text
+
+
 def generate_ci_yaml(
     suite: Dict[str, Any],
     client: LLMClient,
@@ -320,15 +986,65 @@ def generate_ci_yaml(
     调用 LLM 生成 CI/CD YAML 并写入目标路径。
     返回 (文件路径, 文本内容)。
     """
-    builder = PromptBuilder()
+    builder = make_prompt_builder()
     system_prompt, user_prompt = builder.build_ci_prompts(suite, ci_context)
-    response = client.generate_code(system_prompt, user_prompt)
-    yaml_text = extract_code_block(response).strip()
-    target_path = _resolve_output_path(output_root, ci_output_path)
-    target_path.parent.mkdir(parents=True, exist_ok=True)
-    target_path.write_text(yaml_text, encoding="utf-8")
-    print(f"[pipeline] 已生成 CI 工作流: {target_path}")
-    return target_path, yaml_text
+    response = client.generate_code(system_prompt, user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+    return _write_ci_yaml(output_root, ci_output_path, response)
+
+
+async def agenerate_ci_yaml(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    output_root: Path,
+    ci_output_path: str,
+    ci_context: Dict[str, str],
+) -> Tuple[Path, str]:
+    """generate_ci_yaml 的异步版本。CI 提示词不依赖生成的脚本内容，可与脚本生成并发。"""
+    builder = make_prompt_builder()
+    system_prompt, user_prompt = builder.build_ci_prompts(suite, ci_context)
+    response = await client.agenerate_code(system_prompt, user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+    return _write_ci_yaml(output_root, ci_output_path, response)
+
+
+async def agenerate_script_and_ci(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    output_root: Path,
+    guide_text: Optional[str],
+    ci_output_path: Optional[str],
+    ci_context: Optional[Dict[str, str]],
+    shard_size: int = 0,
+    shard_max_chars: int = DEFAULT_SHARD_MAX_CHARS,
+    regen: Optional[RegenManifest] = None,
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
+) -> Tuple[Path, Optional[Path]]:
+    """
+    并发生成测试脚本与 CI YAML，整体耗时接近两者中较慢的一次调用。
+    CI 生成失败只打印告警，不影响脚本结果；脚本生成失败则向上抛出。
+    """
+
+    async def _ci_task() -> Optional[Path]:
+        if not ci_output_path or ci_context is None:
+            return None
+        try:
+            ci_path, _ = await agenerate_ci_yaml(
+                suite=suite,
+                client=client,
+                output_root=output_root,
+                ci_output_path=ci_output_path,
+                ci_context=ci_context,
+            )
+            return ci_path
+        except Exception as exc:  # noqa: BLE001
+            print(f"[pipeline] 生成 CI 工作流失败: {exc}", file=sys.stderr)
+            return None
+
+    script_path, ci_path = await asyncio.gather(
+        agenerate_script(suite, client, output_root, guide_text, shard_size, shard_max_chars, regen, budget, layout),
+        _ci_task(),
+    )
+    return script_path, ci_path
 
 
 def _run_git_command(cmd: List[str], cwd: Path) -> Tuple[int, str, str]:
@@ -434,7 +1150,7 @@ def _read_text(path: Path) -> str:
 
 def collect_failure_context(artifacts_dir: Path) -> Tuple[Dict[str, Any], Dict[str, str]]:
     """
-    读取摘要与关键日志，供 LLM 进行失败原因分析与修复。
+    读取某次执行产物目录（<产物根目录>/<run_id>/）中的摘要与关键日志，供 LLM 进行失败原因分析与修复。
     返回 (summary_json, logs_map)
     """
     summary_path = artifacts_dir / "report.json"
@@ -463,6 +1179,95 @@ def collect_failure_context(artifacts_dir: Path) -> Tuple[Dict[str, Any], Dict[s
     return summary_json, logs
 
 
+def distill_failure_context(
+    artifacts_dir: Path,
+    runner_path: Path,
+    entry_point: str,
+) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    用 runner 目录下的 digest.py 流式提炼失败摘要，返回 (只含失败用例的 report, 摘要文本)。
+    digest 不可用或没有提炼出任何失败（例如 pytest 本身启动失败）时返回 None，由调用方回退到 collect_failure_context。
+    """
+    digest_path = runner_path.parent / "digest.py"
+    if not digest_path.exists():
+        return None
+    try:
+        digest_module = _load_runner_module(digest_path, "_auto_llm_runner_digest")
+        digest = digest_module.distill_failures(artifacts_dir, entry_point, keep_failed_tests=True)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[pipeline][auto-fix] 提炼失败摘要出错，改用完整日志: {exc}", file=sys.stderr)
+        return None
+    if not digest.get("groups"):
+        return None
+    report = {"tests": digest.pop("failed_tests", [])}
+    return report, digest_module.render_digest(digest)
+
+
+PYTEST_USAGE_ERROR = 4
+PYTEST_NO_TESTS_COLLECTED = 5
+
+
+def _script_nodeids(failures: List[Any], script_path: str) -> List[str]:
+    """把 report.json 中相对 rootdir 的 nodeid 换成以脚本绝对路径开头的形式，与 runner 的工作目录无关。"""
+    nodeids: List[str] = []
+    for failure in failures:
+        _, _, rest = failure.nodeid.partition("::")
+        if rest:
+            nodeid = f"{script_path}::{rest}"
+            if nodeid not in nodeids:
+                nodeids.append(nodeid)
+    return nodeids
+
+
+def _targeted_repair(
+    suite: Dict[str, Any],
+    client: LLMClient,
+    builder: PromptBuilder,
+    current_code: str,
+    report: Dict[str, Any],
+    entry_point: str,
+    log_messages: List[str],
+) -> Optional[Tuple[str, _CodeCall]]:
+    """
+    只修复 report.json 中失败的测试函数及其依赖，返回 (拼接后的完整源码, 本次模型调用)；
+    无法定位失败函数或拼接失败时返回 None，由调用方回退到整文件修复。
+    """
+    failures = failing_targets(report, entry_point)
+    unit = extract_repair_unit(current_code, failures) if failures else None
+    if unit is None:
+        msg = "[pipeline][auto-fix] 未能从 report.json 定位失败的测试函数，回退为整文件修复。"
+        print(msg)
+        log_messages.append(msg)
+        return None
+
+    call = _CodeCall(
+        *builder.build_targeted_repair_prompts(
+            suite,
+            unit.imports,
+            unit.render_code(),
+            [{"nodeid": failure.nodeid, "detail": failure.detail} for failure in unit.failures],
+        ),
+        label="定向修复",
+    )
+    _report_prompt_budget(builder, "定向修复")
+    try:
+        merged, touched = splice_definitions(current_code, _generate_call_code(client, call), anchor=unit.targets[0])
+    except ValueError as exc:
+        client.invalidate_cached(call.system_prompt, call.user_prompt, stop_at=STOP_AT_CODE_BLOCK)
+        msg = f"[pipeline][auto-fix] 定向修复结果无法拼接（{exc}），回退为整文件修复。"
+        print(msg, file=sys.stderr)
+        log_messages.append(msg)
+        return None
+
+    msg = (
+        f"[pipeline][auto-fix] 定向修复 {len(unit.targets)} 个失败测试（共 {len(unit.definitions)} 个定义，"
+        f"提示词 {len(call.user_prompt)} 字符），已替换/新增: {touched}"
+    )
+    print(msg)
+    log_messages.append(msg)
+    return merged, call
+
+
 def try_auto_fix(
     suite: Dict[str, Any],
     client: LLMClient,
@@ -472,15 +1277,31 @@ def try_auto_fix(
     exec_template: Dict[str, Any],
     script_relative: str,
     max_fixes: int,
+    fix_scope: str = "file",
+    rerun_failed: bool = False,
+    echo: bool = True,
+    repair_context: str = REPAIR_CONTEXT_DIGEST,
+    budget: Optional[TokenBudget] = None,
+    layout: str = LAYOUT_DEFAULT,
 ) -> Tuple[int, str, str, str]:
     """
     当首次执行失败时，迭代：收集日志 -> 让 LLM 生成修复版本 -> 覆盖写回 -> 重跑。
+    artifacts_dir 为首次（失败）执行的产物目录，重跑的产物写入同一根目录下新的 run_id 子目录，
+    下一轮从最近一次执行的目录读取失败信息。
+    fix_scope="failing" 时只把失败的测试函数及其依赖交给模型修复并拼回原文件，
+    无法定位时自动回退为整文件修复。
+    rerun_failed=True 时每轮只重跑上一轮失败的用例，全部通过后再做一次完整的确认执行。
+    repair_context="digest" 时整文件修复只提供去重后的失败摘要（见 distill_failure_context），
+    "full" 或无法提炼时提供完整的报告与日志。
+    echo=False 时重跑的测试输出不回显到终端（见 execute_tests）。
+    budget 为修复提示词的 token 预算，None 表示不限制；layout 为提示词布局。
     返回 (最终退出码, 最新 stdout, 最新 stderr, 修复日志字符串)。
     """
-    builder = PromptBuilder()
+    builder = make_prompt_builder(budget=budget, layout=layout)
     workspace = WorkspaceManager(output_root)
     entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
 
+    artifacts_root = artifacts_dir.parent
     log_messages: List[str] = []
     last_stdout = ""
     last_stderr = ""
@@ -489,23 +1310,67 @@ def try_auto_fix(
         print(msg)
         log_messages.append(msg)
         current_code = workspace.read_file(entry_point) or ""
-        summary_json, logs = collect_failure_context(artifacts_dir)
-        system_prompt, user_prompt = builder.build_repair_prompts(
-            suite, current_code, summary_json, logs
-        )
+        distilled = None
+        if repair_context == REPAIR_CONTEXT_DIGEST:
+            distilled = distill_failure_context(artifacts_dir, runner_path, entry_point)
+        failure_digest: Optional[str] = None
+        if distilled is not None:
+            summary_json, failure_digest = distilled
+            logs: Dict[str, str] = {}
+        else:
+            summary_json, logs = collect_failure_context(artifacts_dir)
+        failed_nodeids = _script_nodeids(failing_targets(summary_json, entry_point), script_relative)
         try:
-            response = client.generate_code(system_prompt, user_prompt)
-            repaired_code = extract_code_block(response)
-            workspace.write_file(entry_point, repaired_code, overwrite=True)
+            repaired: Optional[Tuple[str, _CodeCall]] = None
+            if fix_scope == "failing":
+                repaired = _targeted_repair(
+                    suite, client, builder, current_code, summary_json, entry_point, log_messages
+                )
+            if repaired is None:
+                call = _CodeCall(
+                    *builder.build_repair_prompts(
+                        suite,
+                        current_code,
+                        None if failure_digest else summary_json,
+                        logs,
+                        failure_digest=failure_digest,
+                    ),
+                    label="整文件修复",
+                )
+                _report_prompt_budget(builder, "整文件修复")
+                repaired = _generate_call_code(client, call), call
+            repaired_code, call = repaired
+            script_path = workspace.write_file(entry_point, repaired_code, overwrite=True)
+            # 修复结果同样只在测试通过后保留缓存（失败时由 execute_tests 丢弃）
+            _record_script_calls(script_path, client, [call])
         except Exception as exc:  # noqa: BLE001
             err_msg = f"[pipeline][auto-fix] 生成或写回修复代码失败: {exc}"
             print(err_msg, file=sys.stderr)
             log_messages.append(err_msg)
             return 1, last_stdout, last_stderr, "\n".join(log_messages)
 
-        # 重新执行
-        exec_request = prepare_exec_request(exec_template, script_relative)
-        exit_code, last_stdout, last_stderr = run_tests(exec_request, runner_path)
+        # 重新执行：先只跑上一轮失败的用例，通过后再完整确认
+        if rerun_failed and failed_nodeids:
+            exec_request = prepare_exec_request(
+                exec_template,
+                script_relative,
+                client.get_stats(),
+                nodeids=failed_nodeids,
+                artifacts_root=artifacts_root,
+            )
+            msg = f"[pipeline][auto-fix] 仅重跑上轮失败的 {len(failed_nodeids)} 个用例 …"
+            print(msg)
+            log_messages.append(msg)
+            exit_code, last_stdout, last_stderr = run_tests(exec_request, runner_path, echo=echo)
+            artifacts_dir = Path(exec_request["artifacts_dir"])
+            if exit_code not in (0, PYTEST_USAGE_ERROR, PYTEST_NO_TESTS_COLLECTED):
+                continue
+            # 用例已被改名或删除时 pytest 报告找不到 nodeid，直接进入完整执行
+        exec_request = prepare_exec_request(
+            exec_template, script_relative, client.get_stats(), artifacts_root=artifacts_root
+        )
+        exit_code, last_stdout, last_stderr = run_tests(exec_request, runner_path, echo=echo)
+        artifacts_dir = Path(exec_request["artifacts_dir"])
         if exit_code == 0:
             success_msg = "[pipeline][auto-fix] 修复成功，测试通过。"
             print(success_msg)
@@ -518,13 +1383,45 @@ def try_auto_fix(
     return 1, last_stdout, last_stderr, "\n".join(log_messages)
 
 
-def main() -> None:
-    args = parse_args()
+def report_client_stats(client: LLMClient) -> None:
+    """打印 LLM 客户端的调用统计（响应缓存命中、HTTP 连接建立/复用次数等）。"""
+    stats = client.get_stats()
+    cache_stats = stats.get("cache")
+    if isinstance(cache_stats, dict):
+        print(
+            "[pipeline] LLM 响应缓存: "
+            f"命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+            f"淘汰 {cache_stats['evictions']} 条，过期 {cache_stats['expired']} 条"
+        )
+    conn_stats = stats.get("connections")
+    if isinstance(conn_stats, dict):
+        print(
+            "[pipeline] HTTP 连接统计: "
+            f"请求 {conn_stats['requests']} 次，新建连接 {conn_stats['connections_opened']} 个，"
+            f"复用 {conn_stats['connections_reused']} 次"
+        )
+    retry_stats = stats.get("retries")
+    if isinstance(retry_stats, dict):
+        print(
+            "[pipeline] HTTP 重试统计: "
+            f"重试 {retry_stats['retries']} 次，故障转移 {retry_stats['failovers']} 次，"
+            f"熔断 {retry_stats['circuit_opens']} 次，最终失败 {retry_stats['failed_calls']} 次，"
+            f"损失约 {retry_stats['time_lost_s']:.2f}s"
+        )
 
-    if not args.suite and not args.story and not args.story_file:
-        raise SystemExit("请提供 --suite 或 --story/--story-file 之一")
 
-    client = build_client(args)
+def build_exec_template(args: argparse.Namespace) -> Dict[str, Any]:
+    """读取执行请求模板，并按命令行参数覆盖执行引擎与 worker 池大小。"""
+    exec_template = load_exec_template(Path(args.request_template).resolve())
+    exec_engine = getattr(args, "exec_engine", None)
+    if exec_engine:
+        exec_template["engine"] = exec_engine
+    if exec_template.get("engine") == EXEC_ENGINE_POOL:
+        exec_template.setdefault("pool_size", getattr(args, "exec_pool_size", DEFAULT_EXEC_POOL_SIZE))
+    return exec_template
+
+
+def run_pipeline(args: argparse.Namespace, client: LLMClient) -> None:
     output_root = Path(args.output_root).resolve()
 
     suite: Dict[str, Any]
@@ -570,31 +1467,63 @@ def main() -> None:
     if args.system_guide:
         guide_text = Path(args.system_guide).read_text(encoding="utf-8")
 
-    script_path = generate_script(suite, client, output_root, guide_text)
     ci_path: Optional[Path] = None
     repo_root = Path(args.git_root).resolve()
-    entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
-
+    entry_point = _script_entry_point(suite)
+    ci_context: Optional[Dict[str, str]] = None
     if not args.skip_ci and args.ci_output:
-        try:
-            artifacts_hint = getattr(args, "artifacts_path", str(DEFAULT_ARTIFACTS_DIR))
-            script_rel_repo = os.path.relpath(script_path.resolve(), repo_root)
-            ci_context = {
-                "python_version": args.ci_python,
-                "test_command": f"python -m pytest {script_rel_repo}",
-                "artifacts_path": artifacts_hint,
-                "requirements_file": "auto_llm/requirements.txt",
-                "entry_point": entry_point,
-            }
-            ci_path, _ = generate_ci_yaml(
+        ci_context = build_ci_context(
+            python_version=args.ci_python,
+            script_path=resolve_script_path(suite, output_root),
+            repo_root=repo_root,
+            artifacts_path=getattr(args, "artifacts_path", str(DEFAULT_ARTIFACTS_DIR)),
+            entry_point=entry_point,
+        )
+
+    shard_size = int(getattr(args, "shard_size", 0) or 0)
+    shard_max_chars = int(getattr(args, "shard_max_chars", DEFAULT_SHARD_MAX_CHARS) or DEFAULT_SHARD_MAX_CHARS)
+    regen = get_regen_manifest(output_root, force=getattr(args, "full_regen", False))
+    budget = budget_from_args(args)
+    layout = prompt_layout_from_args(args)
+    if getattr(args, "async_llm", False):
+        script_path, ci_path = asyncio.run(
+            agenerate_script_and_ci(
                 suite=suite,
                 client=client,
                 output_root=output_root,
-                ci_output_path=args.ci_output,
+                guide_text=guide_text,
+                ci_output_path=args.ci_output if ci_context is not None else None,
                 ci_context=ci_context,
+                shard_size=shard_size,
+                shard_max_chars=shard_max_chars,
+                regen=regen,
+                budget=budget,
+                layout=layout,
             )
-        except Exception as exc:  # noqa: BLE001
-            print(f"[pipeline] 生成 CI 工作流失败: {exc}", file=sys.stderr)
+        )
+    else:
+        script_path = generate_script(
+            suite,
+            client,
+            output_root,
+            guide_text,
+            shard_size=shard_size,
+            shard_max_chars=shard_max_chars,
+            regen=regen,
+            budget=budget,
+            layout=layout,
+        )
+        if ci_context is not None:
+            try:
+                ci_path, _ = generate_ci_yaml(
+                    suite=suite,
+                    client=client,
+                    output_root=output_root,
+                    ci_output_path=args.ci_output,
+                    ci_context=ci_context,
+                )
+            except Exception as exc:  # noqa: BLE001
+                print(f"[pipeline] 生成 CI 工作流失败: {exc}", file=sys.stderr)
 
     runner_path = resolve_runner_path(args.runner_path)
     script_location = str(script_path.resolve())
@@ -605,13 +1534,17 @@ def main() -> None:
             print(f"[pipeline] CI 工作流文件位于: {ci_path}")
         return
 
-    exec_template = load_exec_template(Path(args.request_template).resolve())
-    exec_request = prepare_exec_request(exec_template, script_location)
+    exec_template = build_exec_template(args)
+    artifacts_root = Path(getattr(args, "artifacts_path", str(DEFAULT_ARTIFACTS_DIR))).resolve()
+    exec_request = prepare_exec_request(
+        exec_template, script_location, client.get_stats(), artifacts_root=artifacts_root
+    )
     print(f"[pipeline] 准备执行脚本路径: {script_location}")
     print(f"[pipeline] pytest paths: {exec_request.get('suite', {}).get('paths')}")
     exit_code, runner_stdout, runner_stderr = run_tests(exec_request, runner_path)
     if exit_code == 0:
         print("[pipeline] 测试执行完成，结果成功。")
+        commit_regen_manifest(regen, suite, script_path)
         print(runner_stdout, end="")
         if ci_path:
             print(f"[pipeline] CI 工作流文件位于: {ci_path}")
@@ -634,7 +1567,7 @@ def main() -> None:
     print("[pipeline] 初次执行存在失败。", file=sys.stderr)
 
     if getattr(args, "auto_fix", False):
-        artifacts_dir = Path(getattr(args, "artifacts_path", str(DEFAULT_ARTIFACTS_DIR))).resolve()
+        artifacts_dir = Path(exec_request["artifacts_dir"])
         final_code, fixed_stdout, fixed_stderr, fix_log = try_auto_fix(
             suite=suite,
             client=client,
@@ -644,11 +1577,17 @@ def main() -> None:
             exec_template=exec_template,
             script_relative=script_location,
             max_fixes=int(getattr(args, "max_fixes", 2)),
+            fix_scope=getattr(args, "fix_scope", "file"),
+            rerun_failed=getattr(args, "rerun_failed", False),
+            repair_context=getattr(args, "repair_context", REPAIR_CONTEXT_DIGEST),
+            budget=budget,
+            layout=layout,
         )
         if fix_log:
             print(fix_log, file=sys.stderr)
         if final_code == 0:
             print("[pipeline] 自动修复成功，使用修复后的结果。")
+            commit_regen_manifest(regen, suite, script_path)
             runner_stdout = fixed_stdout or runner_stdout
             runner_stderr = fixed_stderr or runner_stderr
             print(runner_stdout, end="")
@@ -670,9 +1609,29 @@ def main() -> None:
                     print("[pipeline] git push 未成功，请检查日志。", file=sys.stderr)
             return
 
-    print("[pipeline] 测试执行完成，存在失败，请查看 artifacts/ 日志与摘要。", file=sys.stderr)
+    print(f"[pipeline] 测试执行完成，存在失败，请查看 {exec_request['artifacts_dir']} 中的日志与摘要。", file=sys.stderr)
     sys.exit(exit_code)
 
 
+def main() -> None:
+    args = parse_args()
+
+    batch_source = getattr(args, "batch", None)
+    if not batch_source and not args.suite and not args.story and not args.story_file:
+        raise SystemExit("请提供 --suite、--story/--story-file 或 --batch 之一")
+
+    if batch_source:
+        # 以 -m 运行时本模块是 __main__，在这里导入 batch 会再加载一份 auto_llm.auto_exec.pipeline
+        # （各自持有增量清单、执行池等模块级状态），因此转交给 batch 自己的入口
+        os.execv(sys.executable, [sys.executable, "-m", "auto_llm.auto_exec.batch", *sys.argv[1:]])
+
+    client = build_client(args)
+    try:
+        run_pipeline(args, client)
+    finally:
+        report_client_stats(client)
+        client.close()
+
+
 if __name__ == "__main__":
     main()
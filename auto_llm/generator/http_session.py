@@ -0,0 +1,97 @@
+"""
+HTTP 连接池封装：为 LLMClient 提供可复用的 keep-alive 会话。
+
+同一个客户端实例内的所有调用（测试套件生成、脚本生成、CI YAML 生成、自动修复）
+共享一个 requests.Session，避免每次调用都重新建立 TCP/TLS 连接；
+同时统计实际新建的连接数与复用次数，便于在压测时确认握手开销已被消除。
+"""
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_POOL_SIZE = 4
+
+
+@dataclass
+class ConnectionStats:
+    """记录经由连接池发出的请求数与新建连接数（线程安全）。"""
+
+    requests: int = 0
+    opened: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_open(self) -> None:
+        with self._lock:
+            self.opened += 1
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.opened, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.opened,
+                "connections_reused": max(self.requests - self.opened, 0),
+            }
+
+
+def _counting_pool(base: type, stats: ConnectionStats) -> type:
+    """生成一个在真正建立底层连接（TCP/TLS 握手）时计数的连接池子类。"""
+
+    class _CountingConnection(base.ConnectionCls):  # type: ignore[misc, name-defined]
+        def connect(self) -> None:
+            stats.record_open()
+            super().connect()
+
+    class _CountingPool(base):  # type: ignore[misc, valid-type]
+        ConnectionCls = _CountingConnection
+
+    _CountingPool.__name__ = f"Counting{base.__name__}"
+    return _CountingPool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """带连接计数的 HTTPAdapter，pool_size 同时控制 host 数与单 host 连接上限。"""
+
+    def __init__(self, stats: ConnectionStats, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        # HTTPAdapter.__init__ 内部会调用 init_poolmanager，需提前绑定 stats
+        self.stats = stats
+        size = max(int(pool_size), 1)
+        super().__init__(pool_connections=size, pool_maxsize=size)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:  # noqa: ANN002, ANN003
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+    def send(self, request, **kwargs):  # noqa: ANN001, ANN003, ANN201
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+def build_session(
+    stats: ConnectionStats,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    keep_alive: bool = True,
+) -> requests.Session:
+    """创建挂载计数连接池的 Session；keep_alive=False 时每次请求后关闭连接。"""
+    session = requests.Session()
+    adapter = CountingHTTPAdapter(stats, pool_size=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive" if keep_alive else "close"
+    return session
@@ -1,21 +1,46 @@
 """
 LLM 客户端封装，负责与大模型交互。
 
-目前支持三种模式：
+目前支持四种模式：
 1. mock：从指定文件读取预置响应，便于离线调试。
 2. subprocess：通过命令行调用本地模型，可对接 /home/.../qwen2.5 等离线推理脚本。
-3. （预留）HTTP：可在后续接入竞赛提供的 API。
+3. persistent：与 subprocess 使用同一命令，但以 --worker 常驻运行，模型只加载一次。
+4. HTTP：调用 OpenAI 兼容接口或 scripts/deepseek_server.py。
 """
 from __future__ import annotations
 
+import asyncio
 import json
 import subprocess
+import threading
+from contextlib import asynccontextmanager, closing, contextmanager
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
 
 import requests
 from requests import RequestException
 
+from .http_session import DEFAULT_POOL_SIZE, ConnectionStats, build_session
+from .load_balancer import (
+    BALANCE_FAILOVER,
+    DEFAULT_HEALTH_INTERVAL_S,
+    DEFAULT_HEALTH_PATH,
+    LoadBalancer,
+)
+from .resilience import (
+    CircuitBreaker,
+    RetryPolicy,
+    RetryStats,
+    TransientHTTPError,
+    call_with_retry,
+    parse_retry_after,
+)
+from .response_cache import ResponseCache, make_cache_key
+from .stop_detection import STOP_AT_JSON, StopDetector, clip_stream
+from .worker_client import PersistentWorker
+
+T = TypeVar("T")
+
 
 class LLMClient:
     """简单的对话式大模型客户端。"""
@@ -30,56 +55,350 @@ class LLMClient:
         http_model: Optional[str] = None,
         http_timeout: Optional[float] = None,
         http_schema: str = "openai",
+        http_pool_size: int = DEFAULT_POOL_SIZE,
+        http_keep_alive: bool = True,
+        max_concurrency: int = 4,
+        response_cache: Optional[ResponseCache] = None,
+        http_stream: bool = False,
+        http_fallback_endpoints: Optional[Iterable[str]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout_s: float = 30.0,
+        http_balance: str = BALANCE_FAILOVER,
+        http_health_interval_s: float = DEFAULT_HEALTH_INTERVAL_S,
+        http_health_path: str = DEFAULT_HEALTH_PATH,
+        json_response_format: Optional[dict] = None,
     ) -> None:
         self.mode = mode
         self.mock_response_path = Path(mock_response_path) if mock_response_path else None
         self.subprocess_cmd = list(subprocess_cmd) if subprocess_cmd else None
         self.http_endpoint = http_endpoint
+        # 主 endpoint 在前；failover 策略下失败时依次切换到备用 endpoint，其余策略把它们视为对等副本
+        self.http_endpoints: List[str] = []
+        for endpoint in [http_endpoint, *(http_fallback_endpoints or [])]:
+            if endpoint and endpoint not in self.http_endpoints:
+                self.http_endpoints.append(endpoint)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_stats = RetryStats()
+        self._breakers: Dict[str, CircuitBreaker] = {
+            endpoint: CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout_s)
+            for endpoint in self.http_endpoints
+        }
+        self._balancer = LoadBalancer(
+            self.http_endpoints,
+            strategy=http_balance,
+            health_probe=self._probe_health,
+            health_interval_s=http_health_interval_s,
+            health_path=http_health_path,
+        )
         self.http_headers = http_headers or {}
         self.http_model = http_model
         self.http_timeout = http_timeout or 60.0
         self.http_schema = http_schema
+        self.http_pool_size = http_pool_size
+        self.http_keep_alive = http_keep_alive
+        # 指定 stop_at 时改走流式请求，产物完整后客户端主动断开，适用于不认识 stop_at 的服务端
+        self.http_stream = http_stream
+        # stop_at="json" 的 HTTP 请求附带的 response_format（结构化输出），见 structured_output.py
+        self.json_response_format = json_response_format
+        self.connection_stats = ConnectionStats()
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self.max_concurrency = max(int(max_concurrency), 1)
+        # 同步与异步调用共用的并发额度：每次真正发往模型的调用都占用一个名额，
+        # 批量任务中在执行线程里发起的修复调用也受 max_concurrency 限制
+        self._call_slots: Optional[threading.BoundedSemaphore] = None
+        self._call_slots_size = 0
+        self._call_slots_lock = threading.Lock()
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.response_cache = response_cache
+        self._worker: Optional[PersistentWorker] = None
+        self.early_stops = 0
+
+    def generate_code(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        on_delta: Optional[Callable[[str], None]] = None,
+        stop_at: Optional[str] = None,
+    ) -> str:
+        """
+        生成完整回答。传入 on_delta 时改走流式路径，每收到一个片段就回调一次，
+        便于界面在生成过程中增量展示。
 
-    def generate_code(self, system_prompt: str, user_prompt: str) -> str:
+        stop_at 声明调用方需要的产物（"code_block" / "json"），产物完整后即停止生成，
+        见 stop_detection.StopDetector。
+        """
+        if on_delta is not None or (stop_at and self.mode == "http" and self.http_stream):
+            chunks: List[str] = []
+            for chunk in self.stream_code(system_prompt, user_prompt, stop_at=stop_at):
+                chunks.append(chunk)
+                if on_delta is not None:
+                    on_delta(chunk)
+            return "".join(chunks).strip()
+
+        key = self._cache_key(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        with self._call_slot():
+            response = self._generate_uncached(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            self.response_cache.put(key, response)
+        return response
+
+    def _generate_uncached(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
         if self.mode == "mock":
             return self._from_mock()
         if self.mode == "subprocess":
-            return self._from_subprocess(system_prompt, user_prompt)
+            return self._from_subprocess(system_prompt, user_prompt, stop_at)
+        if self.mode == "persistent":
+            return self._from_worker(system_prompt, user_prompt, stop_at)
         if self.mode == "http":
-            return self._from_http(system_prompt, user_prompt)
+            return self._from_http(system_prompt, user_prompt, stop_at)
         raise ValueError(f"未知模式: {self.mode}")
 
+    async def agenerate_code(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        """
+        generate_code 的异步版本，可在同一事件循环中并发发起多个调用。
+        并发数受 max_concurrency 限制，避免压垮推理端。
+        """
+        key = self._cache_key(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        response = await self._agenerate_uncached(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            self.response_cache.put(key, response)
+        return response
+
+    async def _agenerate_uncached(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        async with self._get_async_semaphore(), self._acall_slot():
+            if self.mode == "mock":
+                return self._from_mock()
+            if self.mode == "subprocess":
+                return await self._afrom_subprocess(system_prompt, user_prompt, stop_at)
+            if self.mode == "persistent":
+                # worker 串行处理请求，这里只是避免阻塞事件循环
+                return await asyncio.to_thread(self._from_worker, system_prompt, user_prompt, stop_at)
+            if self.mode == "http":
+                # 复用同步路径的连接池与响应解析，阻塞 IO 放到线程中执行
+                if stop_at and self.http_stream:
+                    return await asyncio.to_thread(self._collect_stream, system_prompt, user_prompt, stop_at)
+                return await asyncio.to_thread(self._from_http, system_prompt, user_prompt, stop_at)
+        raise ValueError(f"未知模式: {self.mode}")
+
+    async def arun_bounded(self, func: Callable[..., T], *args: object) -> T:
+        """
+        在线程中执行一段同步的模型调用流程（例如带重试的测试套件生成），
+        与 agenerate_code 共用 max_concurrency 的并发额度。
+        func 内的每次模型调用另外占用调用名额（见 _call_slot），流程中的非模型步骤不占名额。
+        """
+        async with self._get_async_semaphore():
+            return await asyncio.to_thread(func, *args)
+
+    def _get_async_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._async_semaphore is None or self._async_loop is not loop:
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._async_loop = loop
+        return self._async_semaphore
+
+    # --- 调用名额 ---------------------------------------------------------
+    def _get_call_slots(self) -> threading.BoundedSemaphore:
+        # max_concurrency 可能在构造后才由命令行参数设置（见 pipeline.build_client），按需重建
+        with self._call_slots_lock:
+            if self._call_slots is None or self._call_slots_size != self.max_concurrency:
+                self._call_slots = threading.BoundedSemaphore(self.max_concurrency)
+                self._call_slots_size = self.max_concurrency
+            return self._call_slots
+
+    @contextmanager
+    def _call_slot(self) -> Iterator[None]:
+        """同步调用占用一个模型调用名额，名额用尽时阻塞当前线程。"""
+        slots = self._get_call_slots()
+        slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+
+    @asynccontextmanager
+    async def _acall_slot(self) -> AsyncIterator[None]:
+        """异步调用占用一个模型调用名额；需要等待时在线程中阻塞，不占用事件循环。"""
+        slots = self._get_call_slots()
+        if not slots.acquire(blocking=False):
+            waiter = asyncio.ensure_future(asyncio.to_thread(slots.acquire))
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # 取消时线程仍会拿到名额，拿到后立即归还
+                waiter.add_done_callback(lambda _: slots.release())
+                raise
+        try:
+            yield
+        finally:
+            slots.release()
+
+    # --- response cache -------------------------------------------------
+    def _cache_identity(self, stop_at: Optional[str] = None) -> dict:
+        """参与缓存键计算的模型身份信息。"""
+        if self.mode == "http":
+            identity = {
+                "mode": self.mode,
+                "endpoint": self.http_endpoint,
+                "model": self.http_model,
+                "schema": self.http_schema,
+            }
+        else:
+            identity = {"mode": self.mode, "cmd": self.subprocess_cmd}
+        # 提前终止的输出是截断后的文本，与完整输出分开缓存
+        if stop_at:
+            identity["stop_at"] = stop_at
+        response_format = self._response_format(stop_at)
+        if response_format:
+            identity["response_format"] = response_format
+        return identity
+
+    def _response_format(self, stop_at: Optional[str]) -> Optional[dict]:
+        if self.mode != "http" or stop_at != STOP_AT_JSON:
+            return None
+        return self.json_response_format
+
+    def model_identity(self) -> Dict[str, object]:
+        """模型身份（不区分 stop_at），供增量再生成判断脚本是否出自同一模型。"""
+        identity: Dict[str, object] = dict(self._cache_identity())
+        if self.mode == "mock":
+            identity["mock_response"] = str(self.mock_response_path) if self.mock_response_path else None
+        return identity
+
+    def _cache_key(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> Optional[str]:
+        # mock 模式本身即读取文件，无需缓存
+        if self.response_cache is None or self.mode == "mock":
+            return None
+        return make_cache_key(self._cache_identity(stop_at), system_prompt, user_prompt)
+
+    def invalidate_cached(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> None:
+        """丢弃某次调用的缓存结果，例如输出无法解析时避免下次原样重放。"""
+        key = self._cache_key(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            self.response_cache.invalidate(key)
+
+    def get_stats(self) -> Dict[str, object]:
+        """汇总客户端统计信息，供流水线与 runner 摘要输出。"""
+        stats: Dict[str, object] = {"mode": self.mode}
+        if self.response_cache is not None:
+            stats["cache"] = self.response_cache.stats()
+        if self.mode == "http":
+            stats["connections"] = self.get_connection_stats()
+            retry_stats = self.retry_stats.as_dict()
+            if retry_stats["retries"] or retry_stats["failed_calls"]:
+                retry_stats["circuits"] = {endpoint: breaker.state for endpoint, breaker in self._breakers.items()}
+                stats["retries"] = retry_stats
+            if len(self.http_endpoints) > 1:
+                stats["endpoints"] = {"balance": self._balancer.strategy, **self._balancer.stats()}
+        if self._worker is not None:
+            stats["worker"] = self._worker.stats()
+        if self.early_stops:
+            stats["early_stops"] = self.early_stops
+        return stats
+
+    # --- connection management -----------------------------------------
+    def _get_session(self) -> requests.Session:
+        """惰性创建并复用 HTTP 会话，同一客户端的所有调用共享连接池。"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = build_session(
+                        self.connection_stats,
+                        pool_size=self.http_pool_size,
+                        keep_alive=self.http_keep_alive,
+                    )
+        return self._session
+
+    def get_connection_stats(self) -> Dict[str, int]:
+        """返回 HTTP 请求数、新建连接数与复用连接数。"""
+        return self.connection_stats.as_dict()
+
+    def close(self) -> None:
+        """释放连接池中的空闲连接，停止副本健康检查，并结束常驻 worker。"""
+        self._balancer.close()
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
+
     # --- mode handlers -------------------------------------------------
     def _from_mock(self) -> str:
         if not self.mock_response_path:
             raise RuntimeError("mock 模式需要提供 mock_response_path")
         return self.mock_response_path.read_text(encoding="utf-8")
 
-    def _from_subprocess(self, system_prompt: str, user_prompt: str) -> str:
+    def _subprocess_payload(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> bytes:
         if not self.subprocess_cmd:
             raise RuntimeError("subprocess 模式需要提供 subprocess_cmd")
+        payload = {
+            "system": system_prompt,
+            "user": user_prompt,
+        }
+        if stop_at:
+            payload["stop_at"] = stop_at
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
 
-        payload = json.dumps(
-            {
-                "system": system_prompt,
-                "user": user_prompt,
-            },
-            ensure_ascii=False,
-        )
+    @staticmethod
+    def _check_subprocess_result(returncode: int, stdout: bytes, stderr: bytes) -> str:
+        if returncode != 0:
+            raise RuntimeError(
+                f"子进程调用失败，退出码 {returncode}，stderr={stderr.decode('utf-8', errors='ignore')}"
+            )
+        return stdout.decode("utf-8")
+
+    def _from_subprocess(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        payload = self._subprocess_payload(system_prompt, user_prompt, stop_at)
         proc = subprocess.run(
             list(self.subprocess_cmd),
-            input=payload.encode("utf-8"),
+            input=payload,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=False,
         )
-        if proc.returncode != 0:
-            raise RuntimeError(
-                f"子进程调用失败，退出码 {proc.returncode}，stderr={proc.stderr.decode('utf-8', errors='ignore')}"
-            )
-        return proc.stdout.decode("utf-8")
+        return self._check_subprocess_result(proc.returncode, proc.stdout, proc.stderr)
 
-    def _from_http(self, system_prompt: str, user_prompt: str) -> str:
+    def _get_worker(self) -> PersistentWorker:
+        if not self.subprocess_cmd:
+            raise RuntimeError("persistent 模式需要提供 subprocess_cmd")
+        with self._session_lock:
+            if self._worker is None:
+                self._worker = PersistentWorker(self.subprocess_cmd)
+        return self._worker
+
+    def _from_worker(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        return self._get_worker().generate(system_prompt, user_prompt, stop_at=stop_at)
+
+    async def _afrom_subprocess(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        payload = self._subprocess_payload(system_prompt, user_prompt, stop_at)
+        proc = await asyncio.create_subprocess_exec(
+            *self.subprocess_cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate(payload)
+        return self._check_subprocess_result(proc.returncode or 0, stdout, stderr)
+
+    def _build_http_request(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        stream: bool = False,
+        stop_at: Optional[str] = None,
+    ) -> tuple[dict, dict]:
         if not self.http_endpoint:
             raise RuntimeError("HTTP 模式需要提供 http_endpoint")
 
@@ -98,64 +417,223 @@ class LLMClient:
             }
             if self.http_model:
                 payload["model"] = self.http_model
+            if stop_at:
+                # deepseek_server 在服务端检测产物完整并提前结束生成
+                payload["stop_at"] = stop_at
         else:
             payload = {"messages": messages}
             if self.http_model:
                 payload["model"] = self.http_model
+        response_format = self._response_format(stop_at)
+        if response_format:
+            payload["response_format"] = response_format
+        if stream:
+            payload["stream"] = True
+            headers.setdefault("Accept", "text/event-stream")
+        return headers, payload
 
+    def _post(self, endpoint: str, headers: dict, payload: dict, stream: bool = False) -> requests.Response:
+        """向单个 endpoint 发出一次请求；连接错误、超时与可重试的状态码转换为 TransientHTTPError。"""
         try:
-            response = requests.post(
-                self.http_endpoint,
+            response = self._get_session().post(
+                endpoint,
                 json=payload,
                 headers=headers,
                 timeout=self.http_timeout,
+                stream=stream,
             )
         except RequestException as exc:
-            raise RuntimeError(f"HTTP 调用失败: {exc}") from exc
+            raise TransientHTTPError(f"HTTP 调用失败 ({endpoint}): {exc}") from exc
 
         if response.status_code >= 400:
-            raise RuntimeError(
-                f"HTTP 调用返回错误码 {response.status_code}: {response.text}"
-            )
+            with response:
+                message = f"HTTP 调用返回错误码 {response.status_code} ({endpoint}): {response.text}"
+            if response.status_code in self.retry_policy.retry_statuses:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                raise TransientHTTPError(message, response.status_code, retry_after)
+            raise RuntimeError(message)
+        return response
 
+    def _call_endpoints(self, func: Callable[[str], T]) -> T:
+        """按负载均衡给出的顺序与重试策略在各 endpoint 间调用 func，见 resilience.call_with_retry。"""
+
+        def _tracked(endpoint: str) -> T:
+            with self._balancer.track(endpoint):
+                try:
+                    return func(endpoint)
+                except TransientHTTPError as exc:
+                    if exc.status is None:
+                        self._balancer.mark_unhealthy(endpoint)
+                    raise
+
+        return call_with_retry(self._balancer.order(), _tracked, self.retry_policy, self._breakers, self.retry_stats)
+
+    def _probe_health(self, url: str) -> bool:
+        """
+        副本健康检查：能连上且未返回 5xx 即视为可用（OpenAI 兼容网关的 / 可能是 404）。
+        与模型调用共用连接池，探测建立的连接可被后续请求复用，并计入 connection_stats。
+        """
         try:
-            data = response.json()
-        except ValueError as exc:
-            raise RuntimeError(
-                f"无法解析模型响应为 JSON: {response.text}"
-            ) from exc
-
-        # 尝试兼容常见的 OpenAI/通义 API 返回格式
-        if isinstance(data, dict):
-            choices = data.get("choices")
-            if isinstance(choices, list) and choices:
-                first = choices[0]
-                if isinstance(first, dict):
-                    message = first.get("message")
-                    if isinstance(message, dict):
-                        content = message.get("content")
-                        if content:
-                            return content.strip()
-                    content = first.get("text")
-                    if isinstance(content, str):
+            response = self._get_session().get(url, headers=self.http_headers, timeout=min(self.http_timeout, 5.0))
+        except RequestException:
+            return False
+        with response:
+            return response.status_code < 500
+
+    def _from_http(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        headers, payload = self._build_http_request(system_prompt, user_prompt, stop_at=stop_at)
+
+        def _request(endpoint: str) -> str:
+            response = self._post(endpoint, headers, payload)
+            try:
+                data = response.json()
+            except ValueError as exc:
+                raise RuntimeError(
+                    f"无法解析模型响应为 JSON: {response.text}"
+                ) from exc
+            return _extract_response_text(data)
+
+        return self._call_endpoints(_request)
+
+    # --- streaming -------------------------------------------------------
+    def stream_code(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> Iterator[str]:
+        """
+        以增量片段的形式返回模型输出。
+        HTTP 模式请求 SSE 流（OpenAI `stream: true` 或 deepseek_server 的 simple 协议）；
+        其余模式或服务端不支持流式时，整段结果作为单个片段返回。
+        指定 stop_at 时，产物完整后立即断开流，之后的输出不再读取。
+        """
+        key = self._cache_key(system_prompt, user_prompt, stop_at)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        if self.mode != "http":
+            with self._call_slot():
+                text = self._generate_uncached(system_prompt, user_prompt, stop_at)
+            if key is not None:
+                self.response_cache.put(key, text)
+            yield text
+            return
+
+        chunks: List[str] = []
+        with self._call_slot():
+            for chunk in self._stream_http(system_prompt, user_prompt, stop_at):
+                chunks.append(chunk)
+                yield chunk
+        if key is not None:
+            self.response_cache.put(key, "".join(chunks).strip())
+
+    def _collect_stream(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        return "".join(self._stream_http(system_prompt, user_prompt, stop_at)).strip()
+
+    def _stream_http(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> Iterator[str]:
+        detector = StopDetector(stop_at)
+        with closing(self._iter_http_deltas(system_prompt, user_prompt, stop_at)) as deltas:
+            if not detector.active:
+                yield from deltas
+                return
+            yield from clip_stream(deltas, detector)
+            if detector.complete:
+                # 提前结束：关闭内层生成器即关闭响应连接，服务端随之停止生成
+                self.early_stops += 1
+
+    def _iter_http_deltas(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> Iterator[str]:
+        headers, payload = self._build_http_request(system_prompt, user_prompt, stream=True, stop_at=stop_at)
+        # 只在建立连接阶段重试；已开始输出增量后的中断不重试，避免调用方收到重复片段
+        endpoint, response = self._call_endpoints(
+            lambda endpoint: (endpoint, self._post(endpoint, headers, payload, stream=True))
+        )
+
+        # 读取流的整个过程都计入该副本的在途请求数，延迟 EWMA 只统计到响应头返回
+        with self._balancer.hold(endpoint), response:
+            content_type = response.headers.get("Content-Type", "")
+            if "text/event-stream" not in content_type:
+                # 服务端忽略了 stream 参数，按普通 JSON 响应处理
+                try:
+                    data = response.json()
+                except ValueError as exc:
+                    raise RuntimeError(f"无法解析模型响应为 JSON: {response.text}") from exc
+                yield _extract_response_text(data)
+                return
+
+            try:
+                # 按字节切行再解码：str.splitlines 会把 \u2028 等字符当作换行拆坏事件
+                for raw_line in response.iter_lines():
+                    line = raw_line.decode("utf-8", errors="replace") if raw_line else ""
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data_text = line[len("data:"):].strip()
+                    if data_text == "[DONE]":
+                        break
+                    try:
+                        event = json.loads(data_text)
+                    except ValueError:
+                        continue
+                    if isinstance(event, dict) and event.get("error"):
+                        raise RuntimeError(f"流式生成出错: {event['error']}")
+                    delta = _extract_stream_delta(event)
+                    if delta:
+                        yield delta
+            except RequestException as exc:
+                raise RuntimeError(f"HTTP 流式读取失败: {exc}") from exc
+
+
+def _extract_stream_delta(event: object) -> str:
+    """从单个 SSE 事件中取出增量文本，兼容 OpenAI 与 simple 两种格式。"""
+    if not isinstance(event, dict):
+        return ""
+    choices = event.get("choices")
+    if isinstance(choices, list) and choices:
+        first = choices[0]
+        if isinstance(first, dict):
+            delta = first.get("delta")
+            if isinstance(delta, dict) and isinstance(delta.get("content"), str):
+                return delta["content"]
+            if isinstance(first.get("text"), str):
+                return first["text"]
+        return ""
+    for key in ("delta", "token", "text"):
+        value = event.get(key)
+        if isinstance(value, str):
+            return value
+    return ""
+
+
+def _extract_response_text(data: object) -> str:
+    """从非流式响应 JSON 中取出完整文本。"""
+    # 尝试兼容常见的 OpenAI/通义 API 返回格式
+    if isinstance(data, dict):
+        choices = data.get("choices")
+        if isinstance(choices, list) and choices:
+            first = choices[0]
+            if isinstance(first, dict):
+                message = first.get("message")
+                if isinstance(message, dict):
+                    content = message.get("content")
+                    if content:
                         return content.strip()
-            # 备用字段，例如部分 API 使用 output_text 或 data 字段
-            for key in ("output_text", "data", "result"):
-                value = data.get(key)
-                if isinstance(value, str):
-                    return value.strip()
-                if isinstance(value, list) and value and isinstance(value[0], str):
-                    return value[0].strip()
-            if "output" in data:
-                value = data["output"]
-                if isinstance(value, str):
-                    return value.strip()
-                if isinstance(value, dict):
-                    text = value.get("text")
-                    if isinstance(text, str):
-                        return text.strip()
-
-        raise RuntimeError(f"未能在响应中找到文本内容: {data}")
+                content = first.get("text")
+                if isinstance(content, str):
+                    return content.strip()
+        # 备用字段，例如部分 API 使用 output_text 或 data 字段
+        for key in ("output_text", "data", "result"):
+            value = data.get(key)
+            if isinstance(value, str):
+                return value.strip()
+            if isinstance(value, list) and value and isinstance(value[0], str):
+                return value[0].strip()
+        if "output" in data:
+            value = data["output"]
+            if isinstance(value, str):
+                return value.strip()
+            if isinstance(value, dict):
+                text = value.get("text")
+                if isinstance(text, str):
+                    return text.strip()
+
+    raise RuntimeError(f"未能在响应中找到文本内容: {data}")
 
 
 def load_local_qwen_client(model_path: Path | str) -> LLMClient:
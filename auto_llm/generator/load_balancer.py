@@ -0,0 +1,233 @@
+"""
+HTTP 模式的多副本负载均衡：为每次请求给出 endpoint 的优先顺序，交给 resilience.call_with_retry 依次尝试。
+
+策略：
+- failover：按配置顺序，主 endpoint 优先，失败后才切换（默认，与单 endpoint 行为一致）；
+- least-outstanding：优先选择当前在途请求最少的副本；
+- ewma：按“延迟 EWMA × (在途请求数 + 1)”打分，同时考虑副本快慢与排队情况。
+得分相同时轮转，避免所有请求涌向同一副本。
+
+健康检查：后台线程按间隔 GET 各副本的健康检查路径（deepseek_server.py 的 "/"），
+连接失败、超时或 5xx 的副本被排到最后（仍可作为兜底），恢复后自动回到正常顺序。
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+BALANCE_FAILOVER = "failover"
+BALANCE_LEAST_OUTSTANDING = "least-outstanding"
+BALANCE_EWMA = "ewma"
+BALANCE_STRATEGIES = (BALANCE_FAILOVER, BALANCE_LEAST_OUTSTANDING, BALANCE_EWMA)
+
+DEFAULT_HEALTH_INTERVAL_S = 10.0
+DEFAULT_HEALTH_PATH = "/"
+EWMA_ALPHA = 0.3
+
+# 健康检查函数：传入完整 URL，返回副本是否可用
+HealthProbe = Callable[[str], bool]
+
+
+@dataclass
+class EndpointState:
+    url: str
+    outstanding: int = 0
+    ewma_latency_s: Optional[float] = None
+    healthy: bool = True
+    requests: int = 0
+    failures: int = 0
+    health_checks: int = 0
+
+
+def health_url(endpoint: str, path: str = DEFAULT_HEALTH_PATH) -> str:
+    """由推理 API 地址推出同一服务的健康检查地址，例如 http://h:8000/generate -> http://h:8000/。"""
+    parts = urlsplit(endpoint)
+    return urlunsplit((parts.scheme, parts.netloc, path or "/", "", ""))
+
+
+class LoadBalancer:
+    """线程安全的副本选择器；health_probe 为 None 或 interval<=0 时不做健康检查。"""
+
+    def __init__(
+        self,
+        endpoints: List[str],
+        strategy: str = BALANCE_FAILOVER,
+        health_probe: Optional[HealthProbe] = None,
+        health_interval_s: float = DEFAULT_HEALTH_INTERVAL_S,
+        health_path: str = DEFAULT_HEALTH_PATH,
+    ) -> None:
+        if strategy not in BALANCE_STRATEGIES:
+            raise ValueError(f"不支持的负载均衡策略: {strategy}")
+        self.strategy = strategy
+        self._states: Dict[str, EndpointState] = {url: EndpointState(url) for url in endpoints}
+        self._order = list(endpoints)
+        self._lock = threading.Lock()
+        self._rotation = 0
+        self._health_probe = health_probe
+        self._health_interval_s = health_interval_s
+        self._health_path = health_path
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- 选择 ------------------------------------------------------------
+    def _score(self, state: EndpointState) -> float:
+        if self.strategy == BALANCE_LEAST_OUTSTANDING:
+            return float(state.outstanding)
+        # 尚无延迟样本的副本按 0 计，保证新副本会被尝试
+        return (state.ewma_latency_s or 0.0) * (state.outstanding + 1)
+
+    def order(self) -> List[str]:
+        """本次请求的 endpoint 尝试顺序：健康的在前，按策略排序。"""
+        self._ensure_health_thread()
+        with self._lock:
+            count = len(self._order)
+            if self.strategy == BALANCE_FAILOVER or count <= 1:
+                ranked = list(self._order)
+            else:
+                self._rotation = (self._rotation + 1) % count
+                ranked = sorted(
+                    self._order,
+                    key=lambda url: (
+                        self._score(self._states[url]),
+                        (self._order.index(url) - self._rotation) % count,
+                    ),
+                )
+            healthy = [url for url in ranked if self._states[url].healthy]
+            return healthy + [url for url in ranked if not self._states[url].healthy]
+
+    # --- 请求跟踪 --------------------------------------------------------
+    @contextlib.contextmanager
+    def track(self, endpoint: str, record_latency: bool = True) -> Iterator[None]:
+        """统计一次请求：期间计入在途请求数，成功结束时更新延迟 EWMA，抛出异常时记为失败。"""
+        state = self._states[endpoint]
+        with self._lock:
+            state.outstanding += 1
+            state.requests += 1
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                state.outstanding -= 1
+                if not ok:
+                    state.failures += 1
+                elif record_latency:
+                    previous = state.ewma_latency_s
+                    state.ewma_latency_s = elapsed if previous is None else (
+                        EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * previous
+                    )
+
+    @contextlib.contextmanager
+    def hold(self, endpoint: str) -> Iterator[None]:
+        """流式响应读取期间继续占用在途请求数（不计入请求数与延迟）。"""
+        state = self._states[endpoint]
+        with self._lock:
+            state.outstanding += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                state.outstanding -= 1
+
+    # --- 健康检查 --------------------------------------------------------
+    def mark_unhealthy(self, endpoint: str) -> None:
+        """请求连接失败时立即降级该副本，不必等下一轮健康检查；恢复由健康检查负责。"""
+        if self._health_probe is None or self._health_interval_s <= 0:
+            return
+        with self._lock:
+            state = self._states[endpoint]
+            if state.healthy:
+                print(f"[llm_client] 副本 {endpoint} 连接失败，降为兜底")
+            state.healthy = False
+
+    def check_health(self) -> None:
+        """立即检查所有副本一次。"""
+        if self._health_probe is None:
+            return
+        for url in list(self._order):
+            try:
+                healthy = bool(self._health_probe(health_url(url, self._health_path)))
+            except Exception:  # noqa: BLE001
+                healthy = False
+            with self._lock:
+                state = self._states[url]
+                state.health_checks += 1
+                if state.healthy != healthy:
+                    print(f"[llm_client] 副本 {url} {'恢复健康' if healthy else '健康检查失败，降为兜底'}")
+                state.healthy = healthy
+
+    def _ensure_health_thread(self) -> None:
+        if (
+            self._health_probe is None
+            or self._health_interval_s <= 0
+            or len(self._order) <= 1
+            or self._health_thread is not None
+        ):
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="llm-health-check", daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self._health_interval_s)
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                url: {
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "outstanding": state.outstanding,
+                    "ewma_latency_ms": round(state.ewma_latency_s * 1000, 1) if state.ewma_latency_s is not None else None,
+                    "healthy": state.healthy,
+                }
+                for url, state in self._states.items()
+            }
+
+
+def add_http_balance_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 与 generator/main 的命令行添加多副本负载均衡参数。"""
+    parser.add_argument(
+        "--http-balance",
+        choices=list(BALANCE_STRATEGIES),
+        default=BALANCE_FAILOVER,
+        help=(
+            "--http-endpoint 与 --http-fallback-endpoint 组成副本池时的路由策略："
+            "failover 主备切换（默认）；least-outstanding 最少在途请求；ewma 延迟 EWMA 加权"
+        ),
+    )
+    parser.add_argument(
+        "--http-health-interval",
+        type=float,
+        default=DEFAULT_HEALTH_INTERVAL_S,
+        help=f"副本健康检查间隔（秒），<=0 关闭，默认 {DEFAULT_HEALTH_INTERVAL_S:g}",
+    )
+    parser.add_argument(
+        "--http-health-path",
+        default=DEFAULT_HEALTH_PATH,
+        help="健康检查路径，默认 /（deepseek_server.py 的状态接口）",
+    )
+
+
+def http_balance_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    """把上述命令行参数转换为 LLMClient 的构造参数；缺省字段使用默认值。"""
+    return {
+        "http_balance": getattr(args, "http_balance", BALANCE_FAILOVER) or BALANCE_FAILOVER,
+        "http_health_interval_s": float(getattr(args, "http_health_interval", DEFAULT_HEALTH_INTERVAL_S)),
+        "http_health_path": getattr(args, "http_health_path", DEFAULT_HEALTH_PATH) or DEFAULT_HEALTH_PATH,
+    }
@@ -13,8 +13,14 @@ import sys
 from pathlib import Path
 from typing import Any, Dict
 
+from .http_session import DEFAULT_POOL_SIZE
+from .load_balancer import add_http_balance_arguments, http_balance_kwargs
+from .resilience import add_http_resilience_arguments, http_resilience_kwargs
+from .token_budget import add_prompt_budget_arguments, budget_from_args
 from .llm_client import LLMClient, load_local_qwen_client
-from .prompt_builder import PromptBuilder
+from .prompt_builder import PromptBuilder, add_prompt_layout_arguments, prompt_layout_from_args
+from .response_cache import add_cache_arguments, response_cache_from_args
+from .stop_detection import STOP_AT_CODE_BLOCK
 from .tooling import WorkspaceManager, extract_code_block
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -34,9 +40,9 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "--mode",
-        choices=["mock", "subprocess", "http"],
+        choices=["mock", "subprocess", "persistent", "http"],
         default="mock",
-        help="LLM 调用模式",
+        help="LLM 调用模式；persistent 以 --worker 常驻运行本地模型脚本，模型只加载一次",
     )
     parser.add_argument(
         "--mock-response",
@@ -84,6 +90,27 @@ def parse_args() -> argparse.Namespace:
         default=60.0,
         help="HTTP 请求超时时间（秒），默认 60",
     )
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help=f"HTTP 连接池大小（单个 endpoint 的最大并发连接数），默认 {DEFAULT_POOL_SIZE}",
+    )
+    parser.add_argument(
+        "--http-no-keep-alive",
+        action="store_true",
+        help="禁用 HTTP keep-alive，每次请求后关闭连接（仅用于对比排查）",
+    )
+    parser.add_argument(
+        "--http-stream",
+        action="store_true",
+        help="以流式请求调用 HTTP 接口，代码块完整后客户端立即断开（适用于不支持 stop_at 的服务端）",
+    )
+    add_http_resilience_arguments(parser)
+    add_http_balance_arguments(parser)
+    add_prompt_budget_arguments(parser)
+    add_prompt_layout_arguments(parser)
+    add_cache_arguments(parser)
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -134,6 +161,9 @@ def build_client(args: argparse.Namespace) -> LLMClient:
     if args.mode == "subprocess":
         cmd = _normalize_subprocess_cmd(args.subprocess_cmd)
         return LLMClient(mode="subprocess", subprocess_cmd=cmd)
+    if args.mode == "persistent":
+        cmd = _normalize_subprocess_cmd(args.subprocess_cmd)
+        return LLMClient(mode="persistent", subprocess_cmd=cmd)
     if args.mode == "http":
         if not args.http_endpoint:
             raise ValueError("HTTP 模式需要提供 --http-endpoint")
@@ -144,6 +174,11 @@ def build_client(args: argparse.Namespace) -> LLMClient:
             http_headers=headers,
             http_model=args.http_model,
             http_timeout=args.http_timeout,
+            http_pool_size=getattr(args, "http_pool_size", DEFAULT_POOL_SIZE),
+            http_keep_alive=not getattr(args, "http_no_keep_alive", False),
+            http_stream=getattr(args, "http_stream", False),
+            **http_resilience_kwargs(args),
+            **http_balance_kwargs(args),
         )
     raise ValueError(f"不支持的模式: {args.mode}")
 
@@ -161,13 +196,20 @@ def main() -> None:
     if args.system_guide:
         guide_text = Path(args.system_guide).read_text(encoding="utf-8")
 
-    builder = PromptBuilder(script_guide=guide_text)
+    builder = PromptBuilder(
+        script_guide=guide_text,
+        token_budget=budget_from_args(args),
+        layout=prompt_layout_from_args(args),
+    )
     system_prompt = builder.build_system_prompt()
     user_prompt = builder.build_user_prompt(suite)
+    if builder.last_report is not None and builder.last_report.max_tokens is not None:
+        print(f"[generator] 提示词预算: {builder.last_report.describe()}")
 
     client = build_client(args)
+    client.response_cache = response_cache_from_args(args)
 
-    response_text = client.generate_code(system_prompt, user_prompt)
+    response_text = client.generate_code(system_prompt, user_prompt, stop_at=STOP_AT_CODE_BLOCK)
     code_text = extract_code_block(response_text)
 
     if args.dry_run:
@@ -0,0 +1,46 @@
+"""
+生成脚本的顶层语句工具：按行号取出语句原文、识别绑定名称与测试定义。
+
+分片合并（sharding）、定向修复（targeted_fix）与增量再生成（regen_manifest）都按顶层定义
+切分与拼接生成的 pytest 模块，共用这里的定位规则，保证三者对“一个定义”的边界理解一致。
+"""
+from __future__ import annotations
+
+import ast
+from typing import List, Optional, Tuple
+
+
+def node_span(lines: List[str], node: ast.stmt) -> Tuple[int, int]:
+    """语句所占的行号区间 [start, end]（1 起始，含装饰器与紧邻的前置注释）。"""
+    start = node.lineno
+    for decorator in getattr(node, "decorator_list", []):
+        start = min(start, decorator.lineno)
+    while start > 1 and lines[start - 2].lstrip().startswith("#"):
+        start -= 1
+    return start, node.end_lineno or node.lineno
+
+
+def node_source(lines: List[str], node: ast.stmt) -> str:
+    """取出语句原文，保留生成代码里的注释与格式。"""
+    start, end = node_span(lines, node)
+    return "\n".join(lines[start - 1 : end]).rstrip()
+
+
+def binding_name(node: ast.stmt) -> Optional[str]:
+    """顶层定义或赋值绑定的名称；其他语句返回 None。"""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, ast.Assign):
+        return ", ".join(ast.unparse(target) for target in node.targets)
+    if isinstance(node, ast.AnnAssign):
+        return ast.unparse(node.target)
+    return None
+
+
+def is_test_definition(node: ast.stmt) -> bool:
+    """pytest 会收集的测试函数（test*）或测试类（Test*）。"""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return node.name.startswith("test")
+    if isinstance(node, ast.ClassDef):
+        return node.name.startswith("Test")
+    return False
@@ -1,10 +1,18 @@
 """
 提示词构建模块：根据标准化测试用例生成给 LLM 的系统提示与用户提示。
+
+layout="stable" 时按内容的稳定程度排列段落：所有调用都相同的说明在前，同一套件内不变的信息居中，
+每次执行都会变化的失败摘要、日志与当前代码在最后，失败摘要以规范 JSON（键排序）序列化，
+使 OpenAI 兼容网关与本地推理服务的前缀缓存尽可能命中。
 """
 from __future__ import annotations
 
+import argparse
+import json
 import textwrap
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+from .token_budget import TRIM_HEAD, TRIM_TAIL, BudgetReport, PromptSection, TokenBudget
 
 
 DEFAULT_SCRIPT_GUIDE = textwrap.dedent(
@@ -41,7 +49,7 @@ DEFAULT_SCRIPT_GUIDE = textwrap.dedent(
     - 被测函数（如 add/sub/mul/div）若在环境中不存在，必须在 **同一脚本内完整定义**
     - 直接调用本地函数并断言返回值/异常
     【通用约束（两种模式都必须遵守）】
-    1) 仅使用 Python + pytest；每个测试函数以 test_ 开头
+    1) 仅使用 Python + pytest；每个测试函数以 test_ 开头，函数名包含对应的用例 ID（例如 test_tc001_add_positive）
     2) 入口文件名严格使用 entry_point 字段；脚本可直接运行：pytest -q {entry_point}
     3) 输出必须是纯 Python 源码，禁止使用 Markdown 代码块（```、```python 等）
     4) 不得保留 TODO / pass 占位；逻辑必须可执行
@@ -104,25 +112,146 @@ DEFAULT_CI_TEMPLATE = textwrap.dedent(
 ).strip()
 
 
+# 修复提示词中各类日志的 (相关性, 截断方式)：pytest 输出最直接，覆盖率与基准数据几乎无助于修复，
+# 预算不足时最先整段丢弃（截取其中一段没有意义）
+LOG_SECTIONS = {
+    "pytest_stdout": (70, TRIM_TAIL),
+    "pytest_stderr": (65, TRIM_TAIL),
+    "junit_xml": (45, TRIM_TAIL),
+    "pytest_log": (40, TRIM_TAIL),
+    "bench_json": (10, None),
+    "coverage_xml": (5, None),
+}
+# 未设 token 预算时每段日志保留的尾部字符数
+LEGACY_LOG_TAIL_CHARS = 4000
+
+LAYOUT_DEFAULT = "default"
+LAYOUT_STABLE = "stable"
+PROMPT_LAYOUTS = (LAYOUT_DEFAULT, LAYOUT_STABLE)
+
+# stable 布局下段落的稳定程度：越小越靠前；未列出的段落（含 log:*）视为每次都变化
+VOLATILITY_STATIC = 0  # 所有调用都相同
+VOLATILITY_SUITE = 1  # 同一套件内不变
+VOLATILITY_RUN = 2  # 每次生成 / 执行都可能变化
+SECTION_VOLATILITY = {
+    "output_requirements": VOLATILITY_STATIC,
+    "instruction": VOLATILITY_STATIC,
+    "suite_header": VOLATILITY_SUITE,
+    "fixtures": VOLATILITY_SUITE,
+    "test_cases": VOLATILITY_SUITE,
+    "origin_story": VOLATILITY_SUITE,
+    "entry_point": VOLATILITY_SUITE,
+    "output_target": VOLATILITY_SUITE,
+    "shard_note": VOLATILITY_SUITE,
+}
+# 失败摘要中每次执行必然不同、对修复没有帮助的顶层字段（pytest-json-report 的时间戳与耗时）
+VOLATILE_SUMMARY_KEYS = ("created", "duration")
+
+
 class PromptBuilder:
-    """根据测试套件信息生成提示词文本。"""
+    """
+    根据测试套件信息生成提示词文本。
+    提示词按段落（PromptSection）组装：设置 token_budget 时超出预算的次要段落会被截断或丢弃，
+    每次组装的 token 统计保存在 last_report 中；layout 见模块说明。
+    """
 
-    def __init__(self, script_guide: str | None = None) -> None:
+    def __init__(
+        self,
+        script_guide: str | None = None,
+        token_budget: Optional[TokenBudget] = None,
+        layout: str = LAYOUT_DEFAULT,
+    ) -> None:
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"不支持的提示词布局: {layout}")
         self.script_guide = script_guide or DEFAULT_SCRIPT_GUIDE
+        self.token_budget = token_budget or TokenBudget()
+        self.layout = layout
+        self.last_report: Optional[BudgetReport] = None
+
+    @property
+    def stable(self) -> bool:
+        return self.layout == LAYOUT_STABLE
+
+    @property
+    def _context_ref(self) -> str:
+        """说明性段落引用上下文的措辞：stable 布局下说明在前、信息在后。"""
+        return "下述" if self.stable else "上述"
 
     def build_system_prompt(self) -> str:
         return self.script_guide
 
-    def build_user_prompt(self, suite: Dict[str, Any]) -> str:
-        sections: List[str] = []
-        sections.append(self._render_suite_header(suite))
-        sections.append(self._render_fixtures(suite.get("fixtures", [])))
-        sections.append(self._render_test_cases(suite.get("test_cases", [])))
+    def _assemble(self, sections: List[PromptSection], system_prompt: str) -> str:
+        if self.stable:
+            sections = sorted(
+                sections,
+                key=lambda section: SECTION_VOLATILITY.get(section.name, VOLATILITY_RUN),
+            )
+        text, self.last_report = self.token_budget.assemble(sections, reserved=system_prompt)
+        return text
+
+    def _render_summary(self, summary_json: Dict[str, Any]) -> str:
+        if not self.stable:
+            return textwrap.dedent(textwrap.fill(str(summary_json), width=120))
+        canonical = {key: value for key, value in summary_json.items() if key not in VOLATILE_SUMMARY_KEYS}
+        return json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+    def _user_prompt_sections(self, suite: Dict[str, Any]) -> List[PromptSection]:
+        sections = [
+            PromptSection("suite_header", self._render_suite_header(suite), priority=90, required=True),
+            PromptSection("fixtures", self._render_fixtures(suite.get("fixtures", [])), priority=60, trim=TRIM_HEAD),
+            PromptSection("test_cases", self._render_test_cases(suite.get("test_cases", [])), required=True),
+        ]
         origin_story = suite.get("context", {}).get("origin_story")
         if origin_story:
-            sections.append("原始用户故事 / 需求文档:\n" + origin_story)
-        sections.append(self._render_output_requirements(suite))
-        return "\n\n".join([part for part in sections if part])
+            sections.append(
+                PromptSection("origin_story", "原始用户故事 / 需求文档:\n" + origin_story, priority=30, trim=TRIM_HEAD)
+            )
+        if self.stable:
+            # 通用要求与本套件的输出路径拆开，前者在所有调用间保持逐字节一致
+            sections.append(PromptSection("output_requirements", self._render_generic_requirements(), required=True))
+            sections.append(PromptSection("output_target", self._render_output_target(suite), required=True))
+        else:
+            sections.append(
+                PromptSection("output_requirements", self._render_output_requirements(suite), required=True)
+            )
+        return sections
+
+    def build_user_prompt(self, suite: Dict[str, Any]) -> str:
+        return self._assemble(self._user_prompt_sections(suite), self.build_system_prompt())
+
+    def build_shard_user_prompt(self, suite: Dict[str, Any], shard_index: int, shard_count: int) -> str:
+        """
+        分片生成时使用：suite 中只包含本分片的 test_cases。
+        各分片并行生成后按 AST 合并到同一个入口文件，因此要求分片自包含且测试函数名唯一。
+        """
+        case_ids = ", ".join(str(case.get("id", "TC")) for case in suite.get("test_cases", []))
+        note = (
+            f"【分片说明】完整套件被拆分为 {shard_count} 个分片并行生成，本次为第 {shard_index}/{shard_count} 个分片，"
+            f"只需实现以下用例: {case_ids}。"
+            "\n- 各分片的输出会自动合并到同一个入口文件，请保持脚本自包含：本分片用到的 import、fixture 与辅助函数都要在本分片内定义。"
+            "\n- 与其他分片同名的 fixture / 辅助函数必须实现一致；测试函数名请包含用例 ID，避免与其他分片冲突。"
+        )
+        sections = self._user_prompt_sections(suite)
+        sections.append(PromptSection("shard_note", note, required=True))
+        return self._assemble(sections, self.build_system_prompt())
+
+    def build_incremental_user_prompt(self, suite: Dict[str, Any], existing_code: str) -> str:
+        """
+        增量再生成时使用：suite 中只包含新增或内容变化的 test_cases，existing_code 为删除过期用例后的现有脚本。
+        输出会按 AST 合并回现有脚本，因此只需给出这些用例的测试函数及确需新增的依赖。
+        """
+        case_ids = ", ".join(str(case.get("id", "TC")) for case in suite.get("test_cases", []))
+        note = (
+            f"【增量生成】现有脚本已实现套件中的其余用例，本次只需实现以下用例: {case_ids}。"
+            "\n- 直接复用现有脚本中的 import、fixture 与辅助函数，不要修改或重复输出它们；确需新增的依赖请一并给出。"
+            "\n- 测试函数名请包含用例 ID（例如 test_<用例ID>_xxx），输出会自动合并到现有脚本。"
+        )
+        sections = self._user_prompt_sections(suite)
+        sections.append(PromptSection("incremental_note", note, required=True))
+        sections.append(
+            PromptSection("existing_code", f"现有脚本:\n```python\n{existing_code.rstrip()}\n```", required=True)
+        )
+        return self._assemble(sections, self.build_system_prompt())
 
     def _render_suite_header(self, suite: Dict[str, Any]) -> str:
 
@@ -150,7 +279,8 @@ class PromptBuilder:
             details = fixture.get("details")
             if isinstance(details, dict):
                 detail_lines.append("  详细配置:")
-                for key, value in details.items():
+                items = sorted(details.items()) if self.stable else details.items()
+                for key, value in items:
                     detail_lines.append(f"    {key}: {value}")
             lines.extend(detail_lines)
         return "\n".join(lines)
@@ -177,20 +307,31 @@ class PromptBuilder:
             blocks.append(block)
         return "\n\n".join(blocks)
 
-    def _render_output_requirements(self, suite: Dict[str, Any]) -> str:
-        context = suite.get("context", {})
-        entry_point = context.get("entry_point", "tests/test_generated.py")
-        target = context.get("target")
-        target_note = ""
+    def _target_note(self, suite: Dict[str, Any]) -> str:
+        target = suite.get("context", {}).get("target")
         if not target or str(target).strip().lower() in {"", "未知", "n/a", "-", "none"} or "placeholder" in str(target).lower():
-            target_note = "\n注意：当前目标地址为空或为占位值，请使用本地自包含逻辑，不要发送 HTTP 请求。"
+            return "\n注意：当前目标地址为空或为占位值，请使用本地自包含逻辑，不要发送 HTTP 请求。"
+        return ""
+
+    def _render_output_requirements(self, suite: Dict[str, Any]) -> str:
+        entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
         return (
             "请基于上述信息生成完整的测试脚本。"
             f"\n输出文件路径: {entry_point}"
             "\n确保所有用例均被实现，并在适当位置添加注释或日志。"
-            f"{target_note}"
+            f"{self._target_note(suite)}"
         )
 
+    def _render_generic_requirements(self) -> str:
+        return (
+            f"请基于{self._context_ref}信息生成完整的测试脚本。"
+            "\n确保所有用例均被实现，并在适当位置添加注释或日志。"
+        )
+
+    def _render_output_target(self, suite: Dict[str, Any]) -> str:
+        entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
+        return f"输出文件路径: {entry_point}{self._target_note(suite)}".strip()
+
     def _render_missing_module_hint(self, code: str) -> str:
         allowed_modules = {
             "pytest",
@@ -241,9 +382,11 @@ class PromptBuilder:
         current_code: str,
         summary_json: Dict[str, Any] | None,
         logs: Dict[str, str],
+        failure_digest: Optional[str] = None,
     ) -> tuple[str, str]:
         """
         基于失败摘要与日志构建“修复测试脚本”的提示词。
+        failure_digest 为 runner/digest.py 提炼的去重失败摘要，提供时调用方通常不再传入完整报告与日志。
 
         返回 (system_prompt, user_prompt)。
         """
@@ -300,33 +443,120 @@ class PromptBuilder:
             """
         ).strip()
 
-        sections: List[str] = []
-        sections.append(self._render_suite_header(suite))
+        sections: List[PromptSection] = [
+            PromptSection("suite_header", self._render_suite_header(suite), priority=90, required=True),
+        ]
         origin_story = suite.get("context", {}).get("origin_story")
         if origin_story:
-            sections.append("原始用户故事 / 需求文档:\n" + origin_story)
-        sections.append("当前入口文件: " + entry_point)
+            sections.append(
+                PromptSection("origin_story", "原始用户故事 / 需求文档:\n" + origin_story, priority=30, trim=TRIM_HEAD)
+            )
+        sections.append(PromptSection("entry_point", "当前入口文件: " + entry_point, required=True))
         if summary_json:
-            sections.append("失败摘要(JSON):\n" + textwrap.dedent(textwrap.fill(str(summary_json), width=120)))
+            sections.append(
+                PromptSection(
+                    "summary",
+                    "失败摘要(JSON):\n" + self._render_summary(summary_json),
+                    priority=75,
+                    trim=TRIM_HEAD,
+                )
+            )
+        if failure_digest:
+            sections.append(
+                PromptSection("failure_digest", "失败摘要（已按错误类型去重）:\n" + failure_digest, priority=85, trim=TRIM_HEAD)
+            )
         if logs:
+            # 未设预算时沿用固定的尾部长度；设置预算时由预算按相关性分配，这里只防止读入超长日志
+            max_tokens = self.token_budget.max_tokens
+            tail_chars = max_tokens * 8 if max_tokens else LEGACY_LOG_TAIL_CHARS
             for name, content in logs.items():
                 if not content:
                     continue
-                # 限制每段日志长度以控制上下文大小
-                snippet = content[-4000:]
-                sections.append(f"日志[{name}] 片段(尾部截断):\n" + snippet)
+                priority, trim = LOG_SECTIONS.get(name, (30, TRIM_TAIL))
+                sections.append(
+                    PromptSection(
+                        f"log:{name}",
+                        f"日志[{name}] 片段(尾部截断):\n" + content[-tail_chars:],
+                        priority=priority,
+                        trim=trim,
+                    )
+                )
 
         missing_hint = self._render_missing_module_hint(current_code)
         if missing_hint:
-            sections.append(missing_hint)
+            sections.append(PromptSection("missing_module_hint", missing_hint, priority=80))
 
-        sections.append("当前测试代码:\n" + current_code)
+        sections.append(PromptSection("current_code", "当前测试代码:\n" + current_code, required=True))
         sections.append(
-            "请基于上述信息，直接输出修复后的完整 Python 测试文件源码。禁止使用 Markdown 代码块或附加说明。"
+            PromptSection(
+                "instruction",
+                f"请基于{self._context_ref}信息，直接输出修复后的完整 Python 测试文件源码。禁止使用 Markdown 代码块或附加说明。",
+                required=True,
+            )
         )
+        return repair_guide, self._assemble(sections, repair_guide)
+
+    def build_targeted_repair_prompts(
+        self,
+        suite: Dict[str, Any],
+        imports: str,
+        definitions_code: str,
+        failures: List[Dict[str, str]],
+    ) -> tuple[str, str]:
+        """
+        定向修复提示词：只包含失败的测试函数及其依赖的辅助定义，模型只需返回这些定义，
+        由调用方按名称拼回原文件。failures 为 [{"nodeid": ..., "detail": ...}]。
+        """
+        entry_point = suite.get("context", {}).get("entry_point", "tests/test_generated.py")
 
-        user_prompt = "\n\n".join([part for part in sections if part])
-        return repair_guide, user_prompt
+        repair_guide = textwrap.dedent(
+            """
+            你是一名资深测试开发工程师与代码修复专家。下面给出的是一个 pytest 测试文件中“失败的测试函数及其依赖的辅助定义”，
+            文件的其余部分运行正常且不会展示给你。请对这些定义做最小代价修复，使失败用例通过。
+            【拼接规则】
+            - 你的输出会按顶层定义名替换回原文件：同名函数/类/常量被替换，新名称的定义会插入到失败测试之前
+            - 只输出需要修改或新增的顶层定义（以及新增的 import），不要输出未改动的其他内容
+            - 不得修改测试函数名，不得删除测试函数或断言来回避失败
+            - 保持原有模式：HTTP 模式继续使用 requests 并设置超时；本地模式禁止 HTTP，被测函数需在脚本内实现
+            【输出规范】
+            - 仅输出 Python 源码（无解释文字、无 Markdown 包裹）
+            """
+        ).strip()
+
+        sections: List[PromptSection] = [
+            PromptSection("suite_header", self._render_suite_header(suite), priority=90, required=True),
+            PromptSection("entry_point", "当前入口文件: " + entry_point, required=True),
+        ]
+        failure_lines = []
+        for failure in failures:
+            failure_lines.append(f"- {failure.get('nodeid')}")
+            detail = failure.get("detail")
+            if detail:
+                failure_lines.append(textwrap.indent(detail, "    "))
+        if failure_lines:
+            sections.append(
+                PromptSection(
+                    "failures", "失败用例与错误信息:\n" + "\n".join(failure_lines), priority=85, trim=TRIM_HEAD
+                )
+            )
+        if imports:
+            sections.append(
+                PromptSection(
+                    "imports", "文件现有的 import（仅供参考，无需重复输出）:\n" + imports, priority=60, trim=TRIM_HEAD
+                )
+            )
+        missing_hint = self._render_missing_module_hint(imports)
+        if missing_hint:
+            sections.append(PromptSection("missing_module_hint", missing_hint, priority=80))
+        sections.append(PromptSection("definitions", "需要修复的定义:\n" + definitions_code, required=True))
+        sections.append(
+            PromptSection(
+                "instruction",
+                f"请直接输出修复后的{self._context_ref}定义源码。禁止使用 Markdown 代码块或附加说明。",
+                required=True,
+            )
+        )
+        return repair_guide, self._assemble(sections, repair_guide)
 
     def build_ci_prompts(
         self,
@@ -363,3 +593,18 @@ class PromptBuilder:
 
         user_prompt = "\n".join([part for part in (guidance, "\n".join(lines)) if part])
         return DEFAULT_CI_GUIDE, user_prompt
+
+
+def add_prompt_layout_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 与 generator/main 的命令行添加提示词布局参数。"""
+    parser.add_argument(
+        "--prompt-layout",
+        choices=list(PROMPT_LAYOUTS),
+        default=LAYOUT_DEFAULT,
+        help="用户提示词的段落顺序：default 保持原有顺序；stable 固定说明在前、易变内容在后，提高服务端前缀缓存命中率",
+    )
+
+
+def prompt_layout_from_args(args: argparse.Namespace) -> str:
+    """读取 --prompt-layout；缺省字段使用默认布局。"""
+    return getattr(args, "prompt_layout", LAYOUT_DEFAULT) or LAYOUT_DEFAULT
@@ -0,0 +1,195 @@
+"""
+增量再生成清单：记录每个入口文件（entry_point）上次执行成功时的生成输入指纹，
+输入未变化时跳过模型调用，只有部分用例变化时只重新生成这些用例。
+
+指纹由三部分组成：
+- inputs：套件中除 test_cases 以外的字段 + 系统提示词 + 模型身份；
+- cases：按用例 ID 记录每条用例内容的哈希（缺少 ID 或 ID 重复时为 None，只能整体再生成）；
+- suite：以上全部内容的哈希。
+
+清单位于脚本输出根目录下的 .regen_manifest.json，只在测试执行通过后更新（commit），
+同时记录当时脚本内容的哈希：脚本被手工改动或删除后不再跳过，回退为完整生成。
+"""
+from __future__ import annotations
+
+import ast
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .module_ast import is_test_definition, node_span
+
+MANIFEST_NAME = ".regen_manifest.json"
+MANIFEST_VERSION = 1
+
+REGEN_SKIP = "skip"
+REGEN_PARTIAL = "partial"
+REGEN_FULL = "full"
+
+
+def _content_hash(value: Any) -> str:
+    canonical = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def suite_fingerprint(suite: Dict[str, Any], guide_text: Optional[str], identity: Dict[str, Any]) -> Dict[str, Any]:
+    """计算套件的生成输入指纹，见模块说明。"""
+    base = {key: value for key, value in suite.items() if key != "test_cases"}
+    inputs = _content_hash({"suite": base, "guide": guide_text or "", "model": identity})
+    test_cases = suite.get("test_cases") or []
+    case_ids = [str(case.get("id") or "") for case in test_cases]
+    cases: Optional[Dict[str, str]] = None
+    if all(case_ids) and len(set(case_ids)) == len(case_ids):
+        cases = {case_id: _content_hash(case) for case_id, case in zip(case_ids, test_cases)}
+    return {
+        "inputs": inputs,
+        "cases": cases,
+        "suite": _content_hash({"inputs": inputs, "test_cases": test_cases}),
+    }
+
+
+def _case_token(case_id: str) -> str:
+    return re.sub(r"\W+", "_", case_id).strip("_").lower()
+
+
+def drop_case_tests(code: str, case_ids: List[str]) -> Optional[str]:
+    """
+    删除名称中包含指定用例 ID 的顶层测试函数 / 测试类（如 API_1_TC001 -> test_api_1_tc001_xxx）。
+    任一用例找不到对应的测试定义时返回 None，由调用方回退为完整生成。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    lines = code.splitlines()
+    spans = []
+    for case_id in case_ids:
+        pattern = re.compile(rf"(^|_){re.escape(_case_token(case_id))}(_|$)")
+        matched = [
+            node for node in tree.body if is_test_definition(node) and pattern.search(node.name.lower())
+        ]
+        if not matched:
+            return None
+        spans.extend(node_span(lines, node) for node in matched)
+    drop = {line for start, end in spans for line in range(start, end + 1)}
+    kept = [line for number, line in enumerate(lines, start=1) if number not in drop]
+    # 删除定义后留下的多余空行收拢为最多两行
+    return re.sub(r"\n{4,}", "\n\n\n", "\n".join(kept)).strip() + "\n"
+
+
+@dataclass
+class RegenPlan:
+    """action 为 skip / partial / full；partial 时 base_code 为删除过期用例后的现有脚本。"""
+
+    action: str
+    reason: str
+    changed_cases: List[Dict[str, Any]] = field(default_factory=list)
+    removed_ids: List[str] = field(default_factory=list)
+    base_code: Optional[str] = None
+
+
+class RegenManifest:
+    """按 entry_point 记录生成输入指纹的清单文件（线程安全）。force=True 时始终完整生成，但成功后照常记录。"""
+
+    def __init__(self, output_root: Path | str, force: bool = False) -> None:
+        self.path = Path(output_root) / MANIFEST_NAME
+        self.force = force
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return {}
+        return data.get("entries") or {}
+
+    def plan(
+        self,
+        entry_point: str,
+        suite: Dict[str, Any],
+        fingerprint: Dict[str, Any],
+        script_path: Path,
+    ) -> RegenPlan:
+        """对比上次成功执行时的记录，决定跳过、只再生成变化的用例，还是完整生成。"""
+        with self._lock:
+            self._pending[entry_point] = fingerprint
+            record = self._load().get(entry_point)
+        if self.force:
+            return RegenPlan(REGEN_FULL, "已指定强制完整生成")
+        if not record:
+            return RegenPlan(REGEN_FULL, "清单中没有该入口文件的记录")
+        try:
+            code = script_path.read_text(encoding="utf-8")
+        except OSError:
+            return RegenPlan(REGEN_FULL, "脚本文件不存在")
+        if _text_hash(code) != record.get("script_sha256"):
+            return RegenPlan(REGEN_FULL, "脚本在上次记录后被修改")
+        previous = record.get("fingerprint") or {}
+        if previous.get("suite") == fingerprint["suite"]:
+            return RegenPlan(REGEN_SKIP, "套件、系统提示词与模型均未变化")
+        if previous.get("inputs") != fingerprint["inputs"]:
+            return RegenPlan(REGEN_FULL, "套件公共字段、系统提示词或模型发生变化")
+        old_cases, new_cases = previous.get("cases"), fingerprint.get("cases")
+        if not old_cases or not new_cases:
+            return RegenPlan(REGEN_FULL, "用例缺少唯一 ID，无法按用例增量生成")
+
+        changed_ids = [case_id for case_id, digest in new_cases.items() if old_cases.get(case_id) != digest]
+        removed_ids = [case_id for case_id in old_cases if case_id not in new_cases]
+        # 新增用例在现有脚本中没有测试，只需删除修改过的与被删除的用例
+        stale_ids = [case_id for case_id in changed_ids if case_id in old_cases] + removed_ids
+        base_code = drop_case_tests(code, stale_ids) if stale_ids else code
+        if base_code is None:
+            return RegenPlan(REGEN_FULL, "现有脚本中找不到变化用例对应的测试函数")
+        changed = set(changed_ids)
+        return RegenPlan(
+            REGEN_PARTIAL,
+            f"{len(changed_ids)} 条用例新增或变化，{len(removed_ids)} 条用例被删除",
+            changed_cases=[case for case in suite.get("test_cases") or [] if str(case.get("id")) in changed],
+            removed_ids=removed_ids,
+            base_code=base_code,
+        )
+
+    def commit(self, entry_point: str, script_path: Path) -> bool:
+        """测试执行通过后调用：把本次 plan 时的指纹与当前脚本哈希写入清单。"""
+        with self._lock:
+            fingerprint = self._pending.pop(entry_point, None)
+            if fingerprint is None:
+                return False
+            try:
+                script_sha256 = _text_hash(script_path.read_text(encoding="utf-8"))
+            except OSError:
+                return False
+            # 重新读取后合并，尽量保留其他进程写入的记录
+            entries = self._load()
+            entries[entry_point] = {
+                "fingerprint": fingerprint,
+                "script_sha256": script_sha256,
+                "recorded_at": time.time(),
+            }
+            self._write({"version": MANIFEST_VERSION, "entries": entries})
+        return True
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                json.dump(data, tmp, ensure_ascii=False, indent=2)
+            os.replace(tmp_name, self.path)
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
@@ -0,0 +1,289 @@
+"""
+LLM HTTP 调用的容错层：重试退避、按 endpoint 熔断与多 endpoint 故障转移。
+
+- RetryPolicy：指数退避 + 全抖动（full jitter），响应带 Retry-After 时以其为准；
+  只对连接错误、超时与 408/425/429/5xx 重试，其余 4xx 直接失败；
+- CircuitBreaker：某个 endpoint 连续失败达到阈值后熔断，冷却期内的请求直接跳过该 endpoint，
+  冷却结束后放行一个探测请求（半开），成功即恢复；
+- call_with_retry：每次失败后切换到下一个未熔断的 endpoint 再试；全部熔断时若冷却剩余时间不超过
+  max_retry_after_s 且仍有尝试次数则等待后探测，否则快速失败；所有尝试用尽后抛出最后一次的错误。
+
+RetryStats 记录重试次数、故障转移次数、熔断次数以及因失败与退避损失的时间，写入流水线摘要的 llm.retries 字段。
+"""
+from __future__ import annotations
+
+import argparse
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class TransientHTTPError(RuntimeError):
+    """可重试的 HTTP 调用失败（连接错误、超时或可重试的状态码）；retry_after 为服务端建议的等待秒数。"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RuntimeError):
+    """所有 endpoint 均处于熔断状态。"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头：秒数或 HTTP 日期，无法解析时返回 None。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+@dataclass
+class RetryPolicy:
+    """max_attempts 为总尝试次数（含首次）；退避上限 max_delay_s，Retry-After 最多等待 max_retry_after_s。"""
+
+    max_attempts: int = 4
+    base_delay_s: float = 0.5
+    max_delay_s: float = 30.0
+    multiplier: float = 2.0
+    max_retry_after_s: float = 60.0
+    retry_statuses: FrozenSet[int] = RETRYABLE_STATUSES
+
+    def delay(self, retry_index: int, retry_after: Optional[float] = None) -> float:
+        """第 retry_index 次重试（1 起始）前的等待时间。"""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after_s)
+        ceiling = min(self.max_delay_s, self.base_delay_s * self.multiplier ** (retry_index - 1))
+        return random.uniform(0.0, ceiling)
+
+
+class CircuitBreaker:
+    """单个 endpoint 的熔断器（线程安全）。"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0) -> None:
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self.state = CIRCUIT_HALF_OPEN
+                self._probing = False
+            if self.state == CIRCUIT_HALF_OPEN and not self._probing:
+                # 半开状态只放行一个探测请求
+                self._probing = True
+                return True
+            return False
+
+    def remaining_s(self) -> float:
+        """距离放行探测请求还需等待的秒数，未熔断时为 0。"""
+        with self._lock:
+            if self.state != CIRCUIT_OPEN:
+                return 0.0
+            return max(self.reset_timeout_s - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回本次是否触发熔断。"""
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                tripped = self.state != CIRCUIT_OPEN
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+                if tripped:
+                    self.opens += 1
+                return tripped
+            return False
+
+
+@dataclass
+class RetryStats:
+    """重试统计（线程安全）：time_lost_s 为失败请求耗时与退避等待时间之和。"""
+
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    failovers: int = 0
+    circuit_opens: int = 0
+    short_circuited: int = 0
+    failed_calls: int = 0
+    time_lost_s: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, **deltas: float) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failovers": self.failovers,
+                "circuit_opens": self.circuit_opens,
+                "short_circuited": self.short_circuited,
+                "failed_calls": self.failed_calls,
+                "time_lost_s": round(self.time_lost_s, 3),
+            }
+
+
+def call_with_retry(
+    endpoints: Sequence[str],
+    func: Callable[[str], T],
+    policy: RetryPolicy,
+    breakers: Dict[str, CircuitBreaker],
+    stats: RetryStats,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """
+    依次在 endpoints 上调用 func(endpoint)：TransientHTTPError 按策略退避后切换到下一个可用 endpoint 重试，
+    其他异常直接抛出。熔断中的 endpoint 被跳过；全部熔断且无法等到冷却结束时抛出 CircuitOpenError。
+    """
+    stats.add(calls=1)
+    order: List[str] = list(endpoints)
+    last_error: Optional[Exception] = None
+    index = 0
+    for attempt in range(1, max(policy.max_attempts, 1) + 1):
+        endpoint = None
+        for _ in range(2):
+            for offset in range(len(order)):
+                candidate = order[(index + offset) % len(order)]
+                if breakers[candidate].allow():
+                    endpoint = candidate
+                    index = (index + offset) % len(order)
+                    break
+            if endpoint is not None or attempt >= policy.max_attempts:
+                break
+            # 全部熔断：冷却很快结束时等待后探测，而不是让整条流水线失败
+            wait = min(breakers[candidate].remaining_s() for candidate in order)
+            if wait > policy.max_retry_after_s:
+                break
+            stats.add(time_lost_s=wait)
+            sleep(wait)
+        if endpoint is None:
+            stats.add(short_circuited=1, failed_calls=1)
+            message = f"所有 LLM endpoint 均处于熔断状态: {', '.join(order)}"
+            if last_error is not None:
+                raise CircuitOpenError(f"{message}；最后一次错误: {last_error}") from last_error
+            raise CircuitOpenError(message)
+
+        stats.add(attempts=1)
+        start = time.monotonic()
+        try:
+            result = func(endpoint)
+        except TransientHTTPError as exc:
+            stats.add(time_lost_s=time.monotonic() - start)
+            if breakers[endpoint].record_failure():
+                stats.add(circuit_opens=1)
+            last_error = exc
+            if attempt >= policy.max_attempts:
+                break
+            wait = policy.delay(attempt, exc.retry_after)
+            if len(order) > 1:
+                index = (index + 1) % len(order)
+                stats.add(failovers=1)
+            stats.add(retries=1, time_lost_s=wait)
+            sleep(wait)
+            continue
+        except Exception:
+            breakers[endpoint].record_success()  # 非传输层错误不代表 endpoint 不可用
+            raise
+        breakers[endpoint].record_success()
+        return result
+
+    stats.add(failed_calls=1)
+    assert last_error is not None
+    raise last_error
+
+
+def add_http_resilience_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 与 generator/main 的命令行添加 HTTP 重试 / 熔断 / 故障转移参数。"""
+    parser.add_argument(
+        "--http-fallback-endpoint",
+        action="append",
+        default=[],
+        help="备用推理 API 地址，可重复；主 endpoint 失败或熔断时依次切换",
+    )
+    parser.add_argument(
+        "--http-max-retries",
+        type=int,
+        default=3,
+        help="HTTP 调用失败（连接错误、超时、408/429/5xx）后的最大重试次数，默认 3；0 表示不重试",
+    )
+    parser.add_argument(
+        "--http-backoff-base",
+        type=float,
+        default=0.5,
+        help="重试退避的初始上限（秒），每次翻倍并加随机抖动，默认 0.5；响应带 Retry-After 时以其为准",
+    )
+    parser.add_argument(
+        "--http-backoff-max",
+        type=float,
+        default=30.0,
+        help="单次重试退避的最长等待（秒），默认 30",
+    )
+    parser.add_argument(
+        "--http-breaker-threshold",
+        type=int,
+        default=5,
+        help="同一 endpoint 连续失败多少次后熔断，默认 5",
+    )
+    parser.add_argument(
+        "--http-breaker-reset",
+        type=float,
+        default=30.0,
+        help="熔断后多少秒放行探测请求，默认 30",
+    )
+
+
+def http_resilience_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    """把上述命令行参数转换为 LLMClient 的构造参数；缺省字段使用默认值（供 Gradio 等非命令行入口）。"""
+    return {
+        "http_fallback_endpoints": list(getattr(args, "http_fallback_endpoint", None) or []),
+        "retry_policy": RetryPolicy(
+            max_attempts=max(int(getattr(args, "http_max_retries", 3)), 0) + 1,
+            base_delay_s=float(getattr(args, "http_backoff_base", 0.5)),
+            max_delay_s=float(getattr(args, "http_backoff_max", 30.0)),
+        ),
+        "breaker_failure_threshold": int(getattr(args, "http_breaker_threshold", 5)),
+        "breaker_reset_timeout_s": float(getattr(args, "http_breaker_reset", 30.0)),
+    }
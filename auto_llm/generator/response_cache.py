@@ -0,0 +1,170 @@
+"""
+LLM 响应缓存：以 (模型身份, system_prompt, user_prompt) 的内容哈希为键，将模型输出落盘。
+
+- 每条记录是缓存目录下的一个 <sha256>.json 文件；
+- 命中时刷新文件 mtime，总大小超过上限时按 mtime 由旧到新淘汰（LRU）；
+- 超过 TTL 的记录视为失效并删除。
+
+同一套件在 CI 中重复执行时，相同提示词的调用可直接复用上次的输出。
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parents[1] / ".llm_cache"
+DEFAULT_CACHE_TTL_S = 7 * 24 * 3600
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def make_cache_key(identity: Dict[str, Any], system_prompt: str, user_prompt: str) -> str:
+    """对模型身份与提示词做规范化 JSON 序列化后取 sha256。"""
+    canonical = json.dumps(
+        {"identity": identity, "system": system_prompt, "user": user_prompt},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """基于文件系统的 LRU + TTL 响应缓存（线程安全）。"""
+
+    def __init__(
+        self,
+        cache_dir: Path | str,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        ttl_s: Optional[float] = DEFAULT_CACHE_TTL_S,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max(int(max_bytes), 0)
+        self.ttl_s = ttl_s if ttl_s and ttl_s > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._entry_path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        created = float(entry.get("created", 0))
+        if self.ttl_s is not None and time.time() - created > self.ttl_s:
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self.expired += 1
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry.get("response")
+
+    def put(self, key: str, response: str) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        payload = json.dumps(
+            {"created": time.time(), "response": response},
+            ensure_ascii=False,
+        )
+        # 先写临时文件再原子替换，避免并发读到半截内容
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                tmp.write(payload)
+            os.replace(tmp_name, self._entry_path(key))
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._evict()
+
+    def invalidate(self, key: str) -> None:
+        self._entry_path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda item: item[0])
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 与 generator.main 的命令行添加响应缓存参数。"""
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="禁用 LLM 响应缓存，每次调用都请求模型",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=str(DEFAULT_CACHE_DIR),
+        help="LLM 响应缓存目录，默认 auto_llm/.llm_cache",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL_S,
+        help="缓存有效期（秒），<=0 表示永不过期，默认 7 天",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=DEFAULT_CACHE_MAX_BYTES / (1024 * 1024),
+        help="缓存目录容量上限（MB），超出后按最近最少使用淘汰，默认 64",
+    )
+
+
+def response_cache_from_args(args: argparse.Namespace) -> Optional[ResponseCache]:
+    """按命令行参数创建响应缓存；指定 --no-cache 时返回 None。"""
+    if getattr(args, "no_cache", False):
+        return None
+    max_mb = float(getattr(args, "cache_max_mb", DEFAULT_CACHE_MAX_BYTES / (1024 * 1024)))
+    return ResponseCache(
+        cache_dir=getattr(args, "cache_dir", None) or DEFAULT_CACHE_DIR,
+        max_bytes=int(max_mb * 1024 * 1024),
+        ttl_s=getattr(args, "cache_ttl", DEFAULT_CACHE_TTL_S),
+    )
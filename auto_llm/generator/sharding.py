@@ -0,0 +1,257 @@
+"""
+大套件分片生成：把 test_cases 按数量与体积切成若干分片，各分片独立生成脚本后再合并为一个模块。
+
+合并基于 AST：
+- import 按别名去重，__future__ 导入置顶；
+- 同名且语义相同的 fixture / 辅助函数 / 常量只保留一份；
+- 与之前分片同名但实现不同的定义（测试、fixture、辅助函数、常量）按分片序号重命名（如 base_shard2），
+  并改写该分片内对它的引用（变量名、fixture 参数、usefixtures / getfixturevalue 中的名称），
+  各分片仍使用自己的实现；无法安全重命名的冲突抛出 ValueError，由上层重新生成。
+"""
+from __future__ import annotations
+
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from .module_ast import binding_name, is_test_definition, node_source
+
+DEFAULT_SHARD_MAX_CHARS = 6000
+# 以字符串形式引用 fixture 的调用：@pytest.mark.usefixtures("x") / request.getfixturevalue("x")
+FIXTURE_NAME_CALLS = {"usefixtures", "getfixturevalue"}
+DEFINITION_NAME_PATTERN = re.compile(r"^(\s*(?:async\s+)?(?:def|class)\s+)(\w+)")
+
+
+def shard_test_cases(
+    test_cases: Sequence[Dict[str, Any]],
+    max_cases: int,
+    max_chars: int = DEFAULT_SHARD_MAX_CHARS,
+) -> List[List[Dict[str, Any]]]:
+    """按原有顺序贪心装箱：每个分片不超过 max_cases 条用例，序列化体积不超过 max_chars。"""
+    shards: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_chars = 0
+    for case in test_cases:
+        size = len(json.dumps(case, ensure_ascii=False))
+        if current and (len(current) >= max_cases or (max_chars > 0 and current_chars + size > max_chars)):
+            shards.append(current)
+            current, current_chars = [], 0
+        current.append(case)
+        current_chars += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def shard_suite(
+    suite: Dict[str, Any],
+    max_cases: int,
+    max_chars: int = DEFAULT_SHARD_MAX_CHARS,
+) -> List[Dict[str, Any]]:
+    """
+    返回分片后的套件列表，每个分片只保留自己的 test_cases，其余字段与原套件一致。
+    max_cases <= 0 或用例数不足以分片时返回只含原套件的列表。
+    """
+    test_cases = suite.get("test_cases") or []
+    if max_cases <= 0 or len(test_cases) <= 1:
+        return [suite]
+    groups = shard_test_cases(test_cases, max_cases, max_chars)
+    if len(groups) <= 1:
+        return [suite]
+    return [dict(suite, test_cases=group) for group in groups]
+
+
+@dataclass
+class MergedModule:
+    """
+    合并结果：code 为最终源码，duplicates 为去重的定义名，renamed 为 (原名, 新名)，
+    conflicts 为实现不一致而被重命名的非测试定义（fixture、辅助函数、常量），供上层告警。
+    """
+
+    code: str
+    duplicates: List[str] = field(default_factory=list)
+    renamed: List[Tuple[str, str]] = field(default_factory=list)
+    conflicts: List[str] = field(default_factory=list)
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def _is_main_guard(node: ast.stmt) -> bool:
+    return isinstance(node, ast.If) and ast.unparse(node.test).replace("'", '"') == '__name__ == "__main__"'
+
+
+def _is_renamable(node: ast.stmt) -> bool:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return True
+    if isinstance(node, ast.Assign):
+        return len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+    return isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name)
+
+
+def _char_col(line: str, byte_col: int) -> int:
+    # ast 的 col_offset 是 UTF-8 字节偏移，生成代码里常有中文
+    return len(line.encode("utf-8")[:byte_col].decode("utf-8", errors="ignore"))
+
+
+def rename_identifiers(source: str, renames: Dict[str, str]) -> str:
+    """
+    把模块中对 renames 各名称的引用改为新名称，只改动名称本身，保留原有格式与注释：
+    变量名、函数参数（即 fixture 参数）、def / class 定义名，以及 usefixtures / getfixturevalue 中的字符串。
+    属性访问与关键字参数名不改写。
+    """
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    edits: Set[Tuple[int, int, str]] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in renames:
+            edits.add((node.lineno, _char_col(lines[node.lineno - 1], node.col_offset), node.id))
+        elif isinstance(node, ast.arg) and node.arg in renames:
+            edits.add((node.lineno, _char_col(lines[node.lineno - 1], node.col_offset), node.arg))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name in renames:
+            match = DEFINITION_NAME_PATTERN.match(lines[node.lineno - 1])
+            if match is None or match.group(2) != node.name:
+                raise ValueError(f"无法定位定义 {node.name} 的名称")
+            edits.add((node.lineno, match.start(2), node.name))
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in FIXTURE_NAME_CALLS
+        ):
+            for arg in node.args:
+                if isinstance(arg, ast.Constant) and arg.value in renames and arg.lineno == arg.end_lineno:
+                    line = lines[arg.lineno - 1]
+                    start = _char_col(line, arg.col_offset)
+                    end = _char_col(line, arg.end_col_offset or arg.col_offset)
+                    # 跳过引号（及可能的字符串前缀），定位到名称本身
+                    edits.add((arg.lineno, start + line[start:end].index(arg.value), arg.value))
+    # 从后往前替换，前面的列号不受影响
+    for lineno, col, name in sorted(edits, reverse=True):
+        line = lines[lineno - 1]
+        lines[lineno - 1] = line[:col] + renames[name] + line[col + len(name) :]
+    return "".join(lines)
+
+
+def _rename_conflicts(
+    source: str,
+    index: int,
+    seen_bindings: Dict[str, str],
+    result: MergedModule,
+) -> Tuple[str, ast.Module]:
+    """
+    把分片中与之前分片同名但实现不同的顶层定义重命名为 <name>_shard<index>，并改写分片内的引用。
+    改写后依赖这些定义的其他定义也会变得与之前分片不同，因此重复直到没有新的冲突。
+    """
+    tree = ast.parse(source)
+    taken = set(seen_bindings)
+    taken.update(binding_name(node) or "" for node in tree.body)
+    while True:
+        renames: Dict[str, str] = {}
+        for node in tree.body:
+            name = binding_name(node)
+            if name is None or name not in seen_bindings or seen_bindings[name] == ast.dump(node):
+                continue
+            if not _is_renamable(node):
+                raise ValueError(f"第 {index} 个分片中的 {name} 与之前分片的实现不一致，且无法自动重命名")
+            new_name = f"{name}_shard{index}"
+            while new_name in taken:
+                new_name += "_"
+            taken.add(new_name)
+            renames[name] = new_name
+            result.renamed.append((name, new_name))
+            if not is_test_definition(node):
+                result.conflicts.append(name)
+        if not renames:
+            return source, tree
+        source = rename_identifiers(source, renames)
+        tree = ast.parse(source)
+
+
+def merge_test_modules(sources: Sequence[str]) -> MergedModule:
+    """把多个分片生成的 pytest 模块合并为一个模块；任一分片存在语法错误时抛出 ValueError。"""
+    docstring: str | None = None
+    future_names: List[str] = []
+    plain_imports: List[str] = []
+    from_imports: Dict[Tuple[str, int], List[str]] = {}
+    body: List[str] = []
+    trailer: List[str] = []
+    seen_bindings: Dict[str, str] = {}
+    seen_statements: set[str] = set()
+    result = MergedModule(code="")
+
+    for index, source in enumerate(sources, start=1):
+        try:
+            source, tree = _rename_conflicts(source, index, seen_bindings, result)
+        except SyntaxError as exc:
+            raise ValueError(f"第 {index} 个分片脚本存在语法错误: {exc}") from exc
+        lines = source.splitlines()
+        statements = list(tree.body)
+        if statements and _is_docstring(statements[0]):
+            if docstring is None:
+                docstring = node_source(lines, statements[0])
+            statements = statements[1:]
+
+        for node in statements:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    text = f"import {alias.name}" + (f" as {alias.asname}" if alias.asname else "")
+                    if text not in plain_imports:
+                        plain_imports.append(text)
+                continue
+            if isinstance(node, ast.ImportFrom):
+                names = [alias.name + (f" as {alias.asname}" if alias.asname else "") for alias in node.names]
+                if node.module == "__future__":
+                    future_names.extend(name for name in names if name not in future_names)
+                    continue
+                bucket = from_imports.setdefault((node.module or "", node.level), [])
+                bucket.extend(name for name in names if name not in bucket)
+                continue
+
+            fingerprint = ast.dump(node)
+            name = binding_name(node)
+            text = node_source(lines, node)
+            if name is None:
+                # 普通语句完全相同才去重；if __name__ == "__main__" 统一放到模块末尾
+                if fingerprint not in seen_statements:
+                    seen_statements.add(fingerprint)
+                    (trailer if _is_main_guard(node) else body).append(text)
+                continue
+            if name not in seen_bindings:
+                seen_bindings[name] = fingerprint
+                body.append(text)
+                continue
+            if seen_bindings[name] == fingerprint:
+                result.duplicates.append(name)
+                continue
+            # 与之前分片的冲突已在 _rename_conflicts 中处理，这里只剩同一分片内的重复定义
+            if is_test_definition(node):
+                new_name = f"{node.name}_shard{index}"
+                while new_name in seen_bindings:
+                    new_name += "_"
+                seen_bindings[new_name] = fingerprint
+                body.append(rename_identifiers(text, {node.name: new_name}))
+                result.renamed.append((node.name, new_name))
+                continue
+            raise ValueError(f"第 {index} 个分片重复定义了 {name} 且实现不一致")
+
+    header: List[str] = []
+    if docstring:
+        header.append(docstring)
+    if future_names:
+        header.append(f"from __future__ import {', '.join(future_names)}")
+    import_lines = list(plain_imports)
+    for (module, level), names in from_imports.items():
+        import_lines.append(f"from {'.' * level}{module} import {', '.join(names)}")
+    if import_lines:
+        header.append("\n".join(import_lines))
+
+    parts = ["\n\n".join(header)] if header else []
+    if body or trailer:
+        parts.append("\n\n\n".join(body + trailer))
+    result.code = "\n\n\n".join(parts).strip() + "\n"
+    # 合并结果必须仍是合法模块
+    ast.parse(result.code)
+    return result
@@ -0,0 +1,178 @@
+"""
+生成提前终止检测：判断模型输出中的可用产物（代码块 / JSON 对象）是否已经完整。
+
+extract_code_block 只取第一个 ``` 代码块，_extract_json 只取最外层的 {...}，
+因此一旦产物闭合，后续生成的内容都会被丢弃。StopDetector 以增量方式扫描输出，
+供流式客户端与本地推理脚本在产物完整后立即停止生成。
+
+该模块不依赖第三方库，scripts/ 下的推理脚本也会直接复用。
+"""
+from __future__ import annotations
+
+from typing import Iterable, Iterator, List, Optional
+
+STOP_AT_CODE_BLOCK = "code_block"
+STOP_AT_JSON = "json"
+STOP_AT_CHOICES = (STOP_AT_CODE_BLOCK, STOP_AT_JSON)
+
+CODE_FENCE = "```"
+
+
+class StopDetector:
+    """
+    增量检测产物是否完整。
+
+    - stop_at="code_block"：出现第一对 ``` 围栏后视为完整，结果保留到闭合围栏为止；
+    - stop_at="json"：第一个 { 对应的 } 出现后视为完整（忽略字符串内的括号）；
+    - stop_sequences：任一序列出现即停止，结果不包含该序列（与 OpenAI stop 参数一致）。
+    """
+
+    def __init__(self, stop_at: Optional[str] = None, stop_sequences: Optional[Iterable[str]] = None) -> None:
+        if stop_at is not None and stop_at not in STOP_AT_CHOICES:
+            raise ValueError(f"未知的 stop_at: {stop_at}")
+        self.stop_at = stop_at
+        self.stop_sequences: List[str] = [seq for seq in (stop_sequences or []) if seq]
+        self.text = ""
+        self.end: Optional[int] = None
+        # JSON 扫描状态
+        self._json_pos = 0
+        self._json_depth = 0
+        self._json_started = False
+        self._in_string = False
+        self._escaped = False
+        # 代码块扫描状态
+        self._fence_pos = 0
+        self._fence_open: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return self.stop_at is not None or bool(self.stop_sequences)
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def result(self) -> str:
+        """返回截断到产物结束位置的文本；尚未完整时返回全部文本。"""
+        return self.text if self.end is None else self.text[: self.end]
+
+    def stable_length(self) -> int:
+        """
+        可以安全输出给下游的文本长度：产物完整时为截断位置；
+        否则扣除末尾可能是停止序列前缀的部分，避免流式输出中漏出半个停止序列。
+        """
+        if self.end is not None:
+            return self.end
+        held = 0
+        for seq in self.stop_sequences:
+            for size in range(min(len(seq) - 1, len(self.text)), held, -1):
+                if self.text.endswith(seq[:size]):
+                    held = size
+                    break
+        return len(self.text) - held
+
+    def feed(self, delta: str) -> bool:
+        """追加一段新输出，返回产物是否已完整。"""
+        if self.end is not None or not delta:
+            return self.end is not None
+        start = len(self.text)
+        self.text += delta
+        candidates = [
+            pos
+            for pos in (
+                self._scan_stop_sequences(start),
+                self._scan_json() if self.stop_at == STOP_AT_JSON else None,
+                self._scan_code_block() if self.stop_at == STOP_AT_CODE_BLOCK else None,
+            )
+            if pos is not None
+        ]
+        if candidates:
+            self.end = min(candidates)
+        return self.end is not None
+
+    def sync(self, full_text: str) -> bool:
+        """
+        以“当前完整输出”更新状态，适用于每步重新解码全部 token 的场景。
+        若新文本不是旧文本的延续（分词器合并字符导致），则从头重新扫描。
+        """
+        if self.end is not None:
+            return True
+        if not full_text.startswith(self.text):
+            self.__init__(self.stop_at, self.stop_sequences)  # type: ignore[misc]
+        return self.feed(full_text[len(self.text):])
+
+    # --- scanners --------------------------------------------------------
+    def _scan_stop_sequences(self, start: int) -> Optional[int]:
+        found: Optional[int] = None
+        for seq in self.stop_sequences:
+            idx = self.text.find(seq, max(start - len(seq) + 1, 0))
+            if idx != -1 and (found is None or idx < found):
+                found = idx
+        return found
+
+    def _scan_json(self) -> Optional[int]:
+        text = self.text
+        for idx in range(self._json_pos, len(text)):
+            ch = text[idx]
+            if not self._json_started:
+                if ch == "{":
+                    self._json_started = True
+                    self._json_depth = 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._json_depth += 1
+            elif ch == "}":
+                self._json_depth -= 1
+                if self._json_depth == 0:
+                    self._json_pos = idx + 1
+                    return idx + 1
+        self._json_pos = len(text)
+        return None
+
+    def _scan_code_block(self) -> Optional[int]:
+        text = self.text
+        if self._fence_open is None:
+            idx = text.find(CODE_FENCE, self._fence_pos)
+            if idx == -1:
+                # 保留末尾两个字符，防止围栏被拆在两段输出之间
+                self._fence_pos = max(len(text) - len(CODE_FENCE) + 1, 0)
+                return None
+            self._fence_open = idx
+            self._fence_pos = idx + len(CODE_FENCE)
+        idx = text.find(CODE_FENCE, self._fence_pos)
+        if idx == -1:
+            self._fence_pos = max(len(text) - len(CODE_FENCE) + 1, self._fence_open + len(CODE_FENCE))
+            return None
+        return idx + len(CODE_FENCE)
+
+
+def clip_stream(chunks: Iterable[str], detector: "StopDetector") -> Iterator[str]:
+    """按检测结果裁剪流式片段：产物完整后停止读取，输出不含截断点之后的内容。"""
+    emitted = 0
+    for delta in chunks:
+        done = detector.feed(delta)
+        limit = detector.stable_length()
+        if limit > emitted:
+            yield detector.text[emitted:limit]
+            emitted = limit
+        if done:
+            return
+    if len(detector.text) > emitted:
+        yield detector.text[emitted:]
+
+
+def truncate_artifact(text: str, stop_at: Optional[str], stop_sequences: Optional[Iterable[str]] = None) -> str:
+    """对完整输出做一次性截断，与流式检测结果一致。"""
+    detector = StopDetector(stop_at, stop_sequences)
+    detector.feed(text)
+    return detector.result()
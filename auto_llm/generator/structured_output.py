@@ -0,0 +1,64 @@
+"""
+结构化输出：由 JSON 模板推导 JSON Schema，并组装 OpenAI 兼容接口的 response_format。
+
+- OpenAI / vLLM 等兼容服务按 json_schema 约束解码，输出保证是可解析的 JSON；
+- deepseek_server.py（simple 协议）收到 response_format 后以 JSON 语法约束 logits（scripts/json_grammar.py），
+  schema 仅用于确定根节点类型；
+- 约束解码不保证满足模板之外的业务规则，调用方仍保留解析失败时的修复流程作为兜底。
+"""
+from __future__ import annotations
+
+import argparse
+from typing import Any, Dict
+
+RESPONSE_FORMAT_JSON_SCHEMA = "json_schema"
+
+
+def schema_from_template(template: Any) -> Dict[str, Any]:
+    """
+    按示例值推导 JSON Schema：对象的所有键均为必需（允许额外字段），
+    数组以首个元素作为元素模板，空数组不限制元素类型。
+    """
+    if isinstance(template, dict):
+        return {
+            "type": "object",
+            "properties": {key: schema_from_template(value) for key, value in template.items()},
+            "required": list(template),
+        }
+    if isinstance(template, list):
+        schema: Dict[str, Any] = {"type": "array"}
+        if template:
+            schema["items"] = schema_from_template(template[0])
+        return schema
+    if isinstance(template, bool):
+        return {"type": "boolean"}
+    if isinstance(template, int):
+        return {"type": "integer"}
+    if isinstance(template, float):
+        return {"type": "number"}
+    if template is None:
+        return {"type": "null"}
+    return {"type": "string"}
+
+
+def json_schema_response_format(name: str, schema: Dict[str, Any], strict: bool = False) -> Dict[str, Any]:
+    """
+    OpenAI chat/completions 的 response_format。strict 模式要求 additionalProperties=false 且所有字段必需，
+    模板中 details 等字段是开放结构，因此默认关闭。
+    """
+    return {
+        "type": RESPONSE_FORMAT_JSON_SCHEMA,
+        "json_schema": {"name": name, "schema": schema, "strict": strict},
+    }
+
+
+def add_structured_output_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 的命令行添加结构化输出参数。"""
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help=(
+            "HTTP 模式生成测试套件时附带由套件模板推导的 JSON Schema（response_format），"
+            "由服务端约束解码输出合法 JSON，解析失败后的修复调用只作为兜底"
+        ),
+    )
@@ -0,0 +1,221 @@
+"""
+定向修复：只把失败的测试函数（及其依赖的辅助定义）交给模型修复，再按 AST 拼回原文件。
+
+流程：
+1. failing_targets 从 pytest-json-report 的 report.json 中取出属于入口文件的失败 nodeid；
+2. extract_repair_unit 找到对应的顶层定义，并沿名称引用（含 fixture 参数名）收集辅助函数、fixture 与常量；
+3. splice_definitions 把模型返回的定义按名称替换回原文件，新增的定义插入到首个失败测试之前，
+   新增的 import 追加到原有 import 之后。
+
+无法定位失败函数（例如收集阶段报错、语法错误）时由调用方回退到整文件修复。
+"""
+from __future__ import annotations
+
+import ast
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .module_ast import binding_name, node_source, node_span
+
+FAILED_OUTCOMES = {"failed", "error"}
+MAX_FAILURE_DETAIL_CHARS = 1500
+
+
+@dataclass
+class FailingTest:
+    nodeid: str
+    target: str
+    detail: str = ""
+
+
+@dataclass
+class RepairUnit:
+    """送给模型的修复片段：imports 只读参考，definitions 为需要修复或可能需要修改的顶层定义。"""
+
+    imports: str
+    definitions: Dict[str, str]
+    targets: List[str]
+    failures: List[FailingTest] = field(default_factory=list)
+
+    def render_code(self) -> str:
+        return "\n\n\n".join(self.definitions.values())
+
+
+def _failure_detail(case: Dict[str, Any]) -> str:
+    for stage in ("call", "setup", "teardown"):
+        info = case.get(stage)
+        if not isinstance(info, dict) or info.get("outcome") not in FAILED_OUTCOMES:
+            continue
+        longrepr = info.get("longrepr") or info.get("crash") or ""
+        text = longrepr if isinstance(longrepr, str) else str(longrepr)
+        return f"[{stage}] " + text[-MAX_FAILURE_DETAIL_CHARS:]
+    return ""
+
+
+def failing_targets(report: Dict[str, Any], entry_point: str) -> List[FailingTest]:
+    """
+    返回入口文件中失败用例对应的顶层定义名：
+    tests/test_x.py::test_a[1] -> test_a，tests/test_x.py::TestCls::test_m -> TestCls。
+    """
+    entry_name = PurePosixPath(entry_point.replace("\\", "/")).name
+    failures: List[FailingTest] = []
+    for case in report.get("tests", []) or []:
+        if case.get("outcome") not in FAILED_OUTCOMES:
+            continue
+        nodeid = str(case.get("nodeid") or "")
+        parts = nodeid.split("::")
+        if len(parts) < 2 or PurePosixPath(parts[0]).name != entry_name:
+            continue
+        target = parts[1].split("[", 1)[0]
+        failures.append(FailingTest(nodeid=nodeid, target=target, detail=_failure_detail(case)))
+    return failures
+
+
+def _referenced_names(node: ast.AST) -> Set[str]:
+    names: Set[str] = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(child.id)
+        elif isinstance(child, ast.arg):
+            # pytest 按参数名注入 fixture
+            names.add(child.arg)
+    return names
+
+
+def _top_level_definitions(tree: ast.Module) -> Dict[str, ast.stmt]:
+    definitions: Dict[str, ast.stmt] = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for child in ast.walk(target):
+                    if isinstance(child, ast.Name):
+                        definitions[child.id] = node
+    return definitions
+
+
+def extract_repair_unit(code: str, failures: List[FailingTest]) -> Optional[RepairUnit]:
+    """从完整源码中提取失败测试及其依赖；任一失败目标找不到对应定义时返回 None。"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    lines = code.splitlines()
+    definitions = _top_level_definitions(tree)
+    targets: List[str] = []
+    for failure in failures:
+        if failure.target not in definitions:
+            return None
+        if failure.target not in targets:
+            targets.append(failure.target)
+    if not targets:
+        return None
+
+    # 沿名称引用做闭包，收集失败测试用到的辅助定义（不包含其他测试）
+    selected: Set[int] = set()
+    pending = [definitions[name] for name in targets]
+    while pending:
+        node = pending.pop()
+        if id(node) in selected:
+            continue
+        selected.add(id(node))
+        for name in _referenced_names(node):
+            dep = definitions.get(name)
+            if dep is None or id(dep) in selected:
+                continue
+            if isinstance(dep, (ast.FunctionDef, ast.AsyncFunctionDef)) and dep.name.startswith("test"):
+                continue
+            pending.append(dep)
+
+    units: Dict[str, str] = {}
+    imports: List[str] = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(node_source(lines, node))
+        elif id(node) in selected:
+            units[binding_name(node) or str(node.lineno)] = node_source(lines, node)
+    return RepairUnit(imports="\n".join(imports), definitions=units, targets=targets, failures=failures)
+
+
+def _import_keys(node: ast.stmt) -> List[Tuple[str, str]]:
+    if isinstance(node, ast.Import):
+        return [("import", ast.unparse(ast.Import(names=[alias]))) for alias in node.names]
+    if isinstance(node, ast.ImportFrom):
+        return [
+            ("from", ast.unparse(ast.ImportFrom(module=node.module, names=[alias], level=node.level)))
+            for alias in node.names
+        ]
+    return []
+
+
+def splice_definitions(code: str, repaired: str, anchor: Optional[str] = None) -> Tuple[str, List[str]]:
+    """
+    把 repaired 中的顶层定义按名称替换进 code，返回 (新源码, 被替换或新增的定义名)。
+    anchor 为新增定义的插入位置（该定义之前）；缺省时追加到文件末尾。
+    """
+    try:
+        original_tree = ast.parse(code)
+    except SyntaxError as exc:
+        raise ValueError(f"原脚本无法解析，不能定向拼接: {exc}") from exc
+    try:
+        repaired_tree = ast.parse(repaired)
+    except SyntaxError as exc:
+        raise ValueError(f"模型返回的修复片段存在语法错误: {exc}") from exc
+
+    lines = code.splitlines()
+    repaired_lines = repaired.splitlines()
+    spans: Dict[str, Tuple[int, int]] = {}
+    existing_imports: Set[Tuple[str, str]] = set()
+    last_import_line = 0
+    for node in original_tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            existing_imports.update(_import_keys(node))
+            last_import_line = node.end_lineno or node.lineno
+            continue
+        name = binding_name(node)
+        if name is not None and name not in spans:
+            spans[name] = node_span(lines, node)
+
+    replacements: Dict[Tuple[int, int], str] = {}
+    additions: List[str] = []
+    new_imports: List[str] = []
+    touched: List[str] = []
+    for node in repaired_tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for key in _import_keys(node):
+                if key not in existing_imports:
+                    existing_imports.add(key)
+                    new_imports.append(key[1])
+            continue
+        name = binding_name(node)
+        if name is None:
+            continue
+        text = node_source(repaired_lines, node)
+        if name in spans:
+            replacements[spans[name]] = text
+        else:
+            additions.append(text)
+        touched.append(name)
+
+    if anchor is not None and anchor in spans and additions:
+        start, end = spans[anchor]
+        original = replacements.get((start, end), "\n".join(lines[start - 1 : end]))
+        replacements[(start, end)] = "\n\n\n".join(additions + [original])
+        additions = []
+
+    # 从后往前替换，保证前面的行号不受影响
+    for (start, end), text in sorted(replacements.items(), reverse=True):
+        lines[start - 1 : end] = text.splitlines()
+    if new_imports:
+        lines[last_import_line:last_import_line] = new_imports
+    merged = "\n".join(lines).rstrip() + "\n"
+    if additions:
+        merged += "\n\n" + "\n\n\n".join(additions) + "\n"
+    try:
+        ast.parse(merged)
+    except SyntaxError as exc:
+        raise ValueError(f"拼接后的脚本存在语法错误: {exc}") from exc
+    return merged, touched
@@ -0,0 +1,227 @@
+"""
+提示词 token 预算：把提示词拆成带优先级的段落（PromptSection），总量超出预算时
+按相关性（优先级）裁剪次要段落，并报告每段最终的 token 数。
+
+- 分词器可插拔：默认按字符估算（CJK 字符约 1 token，其余约 4 字符 1 token），
+  也可使用 tiktoken 编码或本地模型目录下的 HuggingFace 分词器（均为可选依赖，缺失时回退估算）；
+- required 段落（套件头、用例、当前代码、输出要求等）始终完整保留，其余段落按优先级分配剩余预算，
+  放不下时标记了 trim 的截断，否则丢弃；
+- trim="head" 保留开头（需求文档、失败摘要），trim="tail" 保留结尾（日志）。
+"""
+from __future__ import annotations
+
+import argparse
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+TRIM_HEAD = "head"
+TRIM_TAIL = "tail"
+SECTION_SEPARATOR = "\n\n"
+# 截断后至少保留的 token 数，更少时直接丢弃整段
+MIN_TRIMMED_TOKENS = 64
+
+_CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖分词器的粗略估算：CJK 字符按 1 token，其余字符按 4 个 1 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def load_tokenizer(spec: Optional[str]) -> TokenCounter:
+    """
+    根据命令行参数创建 token 计数函数：
+    - None / "chars"：字符估算；
+    - "tiktoken:<encoding>"：例如 tiktoken:cl100k_base；
+    - "hf:<模型目录或名称>"：transformers.AutoTokenizer，与本地 deepseek/qwen 服务使用同一分词器。
+    可选依赖缺失或加载失败时打印提示并回退为字符估算。
+    """
+    if not spec or spec == "chars":
+        return estimate_tokens
+    kind, _, name = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(name or "cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        if kind == "hf":
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as exc:  # noqa: BLE001
+        print(f"[prompt] 无法加载分词器 {spec}（{exc}），改用字符估算")
+        return estimate_tokens
+    raise ValueError(f"不支持的分词器: {spec}（可选 chars、tiktoken:<encoding>、hf:<模型路径>）")
+
+
+@dataclass
+class PromptSection:
+    """提示词中的一段；priority 越大越重要，预算不足时优先截断 / 丢弃 priority 小的段落。"""
+
+    name: str
+    text: str
+    priority: int = 50
+    required: bool = False
+    trim: Optional[str] = None
+
+
+@dataclass
+class SectionUsage:
+    name: str
+    tokens: int
+    original_tokens: int
+    status: str = "kept"  # kept / trimmed / dropped
+
+
+@dataclass
+class BudgetReport:
+    """一次提示词组装的结果：max_tokens 为 None 表示未设预算，只统计不裁剪。"""
+
+    max_tokens: Optional[int]
+    reserved_tokens: int
+    total_tokens: int
+    sections: List[SectionUsage] = field(default_factory=list)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.max_tokens is not None and self.total_tokens > self.max_tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "max_tokens": self.max_tokens,
+            "reserved_tokens": self.reserved_tokens,
+            "total_tokens": self.total_tokens,
+            "sections": {
+                usage.name: {"tokens": usage.tokens, "original_tokens": usage.original_tokens, "status": usage.status}
+                for usage in self.sections
+            },
+        }
+
+    def describe(self) -> str:
+        budget = f"/{self.max_tokens}" if self.max_tokens is not None else ""
+        parts = []
+        for usage in self.sections:
+            if usage.status == "kept":
+                parts.append(f"{usage.name}={usage.tokens}")
+            elif usage.status == "trimmed":
+                parts.append(f"{usage.name}={usage.tokens}(截断自 {usage.original_tokens})")
+            else:
+                parts.append(f"{usage.name}=丢弃({usage.original_tokens})")
+        return (
+            f"总计 {self.total_tokens}{budget} tokens（系统提示词 {self.reserved_tokens}）: " + ", ".join(parts)
+        )
+
+
+class TokenBudget:
+    """按 token 预算组装提示词；max_tokens 为 None 或 <=0 时不裁剪。"""
+
+    def __init__(self, max_tokens: Optional[int] = None, counter: Optional[TokenCounter] = None) -> None:
+        self.max_tokens = max_tokens if max_tokens and max_tokens > 0 else None
+        self.count = counter or estimate_tokens
+
+    def assemble(self, sections: List[PromptSection], reserved: str = "") -> tuple[str, BudgetReport]:
+        """
+        组装提示词并返回 (文本, 报告)。reserved 为同一请求中不可裁剪的其他文本（通常是系统提示词），
+        只计入总量。必需段落本身已超出预算时照常返回，由调用方根据 report.over_budget 提示。
+        """
+        sections = [section for section in sections if section.text]
+        reserved_tokens = self.count(reserved) if reserved else 0
+        separator_tokens = self.count(SECTION_SEPARATOR)
+        texts = [section.text for section in sections]
+        tokens = [self.count(text) for text in texts]
+        usages = [SectionUsage(section.name, count, count) for section, count in zip(sections, tokens)]
+
+        def total() -> int:
+            kept = [count for usage, count in zip(usages, tokens) if usage.status != "dropped"]
+            return reserved_tokens + sum(kept) + separator_tokens * max(len(kept) - 1, 0)
+
+        if self.max_tokens is not None and total() > self.max_tokens:
+            # 必需段落全部保留，剩余预算按优先级从高到低分配给其他段落（同优先级时靠前的优先）；
+            # 放不下的段落可截断时截断，否则丢弃
+            required = [index for index, section in enumerate(sections) if section.required]
+            remaining = (
+                self.max_tokens
+                - reserved_tokens
+                - sum(tokens[index] for index in required)
+                - separator_tokens * max(len(required) - 1, 0)
+            )
+            optional = sorted(
+                (index for index, section in enumerate(sections) if not section.required),
+                key=lambda index: (-sections[index].priority, index),
+            )
+            for position, index in enumerate(optional):
+                available = remaining - separator_tokens
+                section = sections[index]
+                if tokens[index] <= available:
+                    remaining = available - tokens[index]
+                    continue
+                # 后面还有段落时最多截断到剩余预算的一半，避免一段长日志占满全部预算
+                share = available // 2 if position < len(optional) - 1 else available
+                share = max(share, MIN_TRIMMED_TOKENS)
+                if section.trim and available >= MIN_TRIMMED_TOKENS:
+                    texts[index] = self._trim(texts[index], share, section.trim)
+                    tokens[index] = self.count(texts[index])
+                    usages[index].status = "trimmed"
+                    remaining = available - tokens[index]
+                else:
+                    usages[index].status = "dropped"
+
+        for usage, count in zip(usages, tokens):
+            usage.tokens = 0 if usage.status == "dropped" else count
+        text = SECTION_SEPARATOR.join(
+            body for body, usage in zip(texts, usages) if usage.status != "dropped"
+        )
+        return text, BudgetReport(self.max_tokens, reserved_tokens, total(), usages)
+
+    def _trim(self, text: str, max_tokens: int, mode: str) -> str:
+        """二分查找不超过 max_tokens 的最长前缀 / 后缀，尽量在换行处截断，并标注截断位置。"""
+        marker = "…（已截断）"
+        budget = max(max_tokens - self.count(marker) - 1, 0)
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            piece = text[:mid] if mode == TRIM_HEAD else text[len(text) - mid:]
+            if self.count(piece) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        if mode == TRIM_HEAD:
+            piece = text[:low]
+            cut = piece.rfind("\n")
+            if cut > low * 0.8:
+                piece = piece[:cut]
+            return piece + "\n" + marker
+        piece = text[len(text) - low:]
+        cut = piece.find("\n")
+        if 0 <= cut < low * 0.2:
+            piece = piece[cut + 1:]
+        return marker + "\n" + piece
+
+
+def add_prompt_budget_arguments(parser: argparse.ArgumentParser) -> None:
+    """为 pipeline 与 generator/main 的命令行添加提示词 token 预算参数。"""
+    parser.add_argument(
+        "--prompt-token-budget",
+        type=int,
+        default=0,
+        help="单次 LLM 请求（系统提示词 + 用户提示词）的 token 上限，超出时按相关性截断或丢弃次要段落；默认 0 不限制",
+    )
+    parser.add_argument(
+        "--prompt-tokenizer",
+        default="chars",
+        help="计算 token 的分词器：chars（按字符估算，默认）、tiktoken:<encoding> 或 hf:<模型路径>",
+    )
+
+
+def budget_from_args(args: argparse.Namespace) -> TokenBudget:
+    """根据命令行参数创建 TokenBudget；缺省字段使用默认值。"""
+    max_tokens = int(getattr(args, "prompt_token_budget", 0) or 0)
+    return TokenBudget(max_tokens, load_tokenizer(getattr(args, "prompt_tokenizer", None)))
@@ -0,0 +1,201 @@
+"""
+常驻模型 worker 管理：与 scripts/qwen_cli.py、scripts/deepseek_cli.py 的 --worker 模式配合使用。
+
+worker 启动后只加载一次模型，之后通过 stdin/stdout 按行交换 JSON：
+    启动完成: {"event": "ready"}
+    请求:     {"id": 1, "system": "...", "user": "..."}  ->  {"id": 1, "output": "..."}
+              （可选字段 "stop_at"，含义同 stop_detection.StopDetector）
+    健康检查: {"id": 2, "op": "ping"}                   ->  {"id": 2, "status": "ok"}
+
+PersistentWorker 负责惰性启动、健康检查，以及 worker 异常退出后的自动重启。
+"""
+from __future__ import annotations
+
+import json
+import queue
+import subprocess
+import threading
+import weakref
+from typing import Any, Dict, Iterable, List, Optional
+
+WORKER_FLAG = "--worker"
+DEFAULT_STARTUP_TIMEOUT_S = 600.0
+DEFAULT_REQUEST_TIMEOUT_S = 600.0
+DEFAULT_PING_TIMEOUT_S = 10.0
+
+
+class WorkerCrashed(RuntimeError):
+    """worker 进程退出或协议流中断。"""
+
+
+def _terminate(proc: subprocess.Popen) -> None:
+    if proc.poll() is not None:
+        return
+    try:
+        if proc.stdin:
+            proc.stdin.close()
+        proc.wait(timeout=5)
+    except Exception:  # noqa: BLE001
+        proc.kill()
+
+
+class PersistentWorker:
+    """单个常驻 worker 进程的封装；请求串行执行（线程安全）。"""
+
+    def __init__(
+        self,
+        cmd: Iterable[str],
+        startup_timeout: float = DEFAULT_STARTUP_TIMEOUT_S,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT_S,
+        max_restarts: int = 2,
+    ) -> None:
+        command = list(cmd)
+        if WORKER_FLAG not in command:
+            command.append(WORKER_FLAG)
+        self.cmd: List[str] = command
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.max_restarts = max_restarts
+        self.starts = 0
+        self.restarts = 0
+        self.requests = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stderr_tail: List[str] = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._finalizer: Optional[weakref.finalize] = None
+
+    # --- lifecycle -------------------------------------------------------
+    def _pump(self, stream, sink: "queue.Queue[Optional[str]]") -> None:
+        for line in iter(stream.readline, ""):
+            sink.put(line)
+        sink.put(None)
+
+    def _pump_stderr(self, stream) -> None:
+        for line in iter(stream.readline, ""):
+            self._stderr_tail.append(line)
+            del self._stderr_tail[:-50]
+
+    def _start(self) -> None:
+        self._lines = queue.Queue()
+        self._stderr_tail = []
+        proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        threading.Thread(target=self._pump, args=(proc.stdout, self._lines), daemon=True).start()
+        threading.Thread(target=self._pump_stderr, args=(proc.stderr,), daemon=True).start()
+        self._proc = proc
+        self.starts += 1
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        # 客户端被回收或解释器退出时自动结束 worker
+        self._finalizer = weakref.finalize(self, _terminate, proc)
+
+        message = self._read_message(self.startup_timeout)
+        if message.get("event") != "ready":
+            raise WorkerCrashed(f"worker 启动握手异常: {message}")
+
+    def _ensure_running(self) -> None:
+        if self._proc is None or self._proc.poll() is not None:
+            if self._proc is not None:
+                self.restarts += 1
+            self._start()
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self._proc = None
+
+    # --- protocol --------------------------------------------------------
+    def _read_message(self, timeout: float) -> Dict[str, Any]:
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty as exc:
+                if self._proc is not None:
+                    self._proc.kill()
+                raise WorkerCrashed(f"等待 worker 响应超时（{timeout}s）") from exc
+            if line is None:
+                stderr = "".join(self._stderr_tail[-10:])
+                raise WorkerCrashed(f"worker 已退出，stderr 尾部:\n{stderr}")
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                # 非协议输出（例如第三方库打印的日志）直接忽略
+                continue
+
+    def _roundtrip(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        self._next_id += 1
+        request_id = self._next_id
+        payload = dict(message, id=request_id)
+        try:
+            assert self._proc is not None and self._proc.stdin is not None
+            self._proc.stdin.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as exc:
+            raise WorkerCrashed(f"写入 worker 失败: {exc}") from exc
+        while True:
+            reply = self._read_message(timeout)
+            if reply.get("id") == request_id:
+                return reply
+
+    def _call(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        last_error: Optional[Exception] = None
+        for _ in range(self.max_restarts + 1):
+            try:
+                self._ensure_running()
+                return self._roundtrip(message, timeout)
+            except WorkerCrashed as exc:
+                last_error = exc
+                if self._proc is not None and self._proc.poll() is None:
+                    self._proc.kill()
+                    self._proc.wait()
+        raise RuntimeError(f"常驻 worker 调用失败（已重启 {self.max_restarts} 次）: {last_error}")
+
+    def ping(self, timeout: float = DEFAULT_PING_TIMEOUT_S) -> bool:
+        """健康检查：worker 存活且能在超时内响应 ping。"""
+        with self._lock:
+            if not self.is_alive():
+                return False
+            try:
+                reply = self._roundtrip({"op": "ping"}, timeout)
+            except WorkerCrashed:
+                return False
+            return reply.get("status") == "ok"
+
+    def generate(self, system_prompt: str, user_prompt: str, stop_at: Optional[str] = None) -> str:
+        with self._lock:
+            # 长时间空闲后先做一次健康检查，卡死的 worker 直接重启
+            if self.is_alive() and self.requests:
+                try:
+                    self._roundtrip({"op": "ping"}, DEFAULT_PING_TIMEOUT_S)
+                except WorkerCrashed:
+                    if self._proc is not None:
+                        self._proc.kill()
+                        self._proc.wait()
+            message: Dict[str, Any] = {"system": system_prompt, "user": user_prompt}
+            if stop_at:
+                message["stop_at"] = stop_at
+            reply = self._call(message, self.request_timeout)
+            self.requests += 1
+        if "error" in reply:
+            raise RuntimeError(f"worker 生成失败: {reply['error']}")
+        return str(reply.get("output", ""))
+
+    def stats(self) -> Dict[str, int]:
+        return {"starts": self.starts, "restarts": self.restarts, "requests": self.requests}
@@ -3,17 +3,50 @@
 采集 pytest 产物并输出结构化总结
 """
 import json
+import os
 import pathlib
+import re
+import shutil
 import sys
 import time
 import zipfile
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from xml.etree import ElementTree
+
+try:  # 可选依赖：安装后使用 C 后端的增量解析
+    import ijson  # type: ignore
+except ImportError:  # pragma: no cover - 未安装时使用内置的分块解析
+    ijson = None
 
 BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
+# 各次执行的产物位于 <产物根目录>/<run_id>/ 下，默认根目录为 auto_llm/artifacts
 ARTIFACTS_DIR = BASE_DIR / "artifacts"
-PYTEST_STDOUT = ARTIFACTS_DIR / "pytest_stdout.log"
-PYTEST_STDERR = ARTIFACTS_DIR / "pytest_stderr.log"
-PYTEST_LOG = ARTIFACTS_DIR / "pytest.log"
+ARTIFACT_FILES = {
+    "junit_xml": "junit.xml",
+    "json_report": "report.json",
+    "coverage_xml": "coverage.xml",
+    "bench_json": "bench.json",
+    "pytest_stdout": "pytest_stdout.log",
+    "pytest_stderr": "pytest_stderr.log",
+    "pytest_log": "pytest.log",
+}
+
+# 已压缩格式再做 deflate 几乎没有收益，直接存储
+COMPRESSED_SUFFIXES = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".whl", ".jar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp4", ".webm", ".pdf",
+}
+# 过小的文件压缩后可能反而变大
+MIN_DEFLATE_BYTES = 512
+COPY_CHUNK_BYTES = 1024 * 1024
+# 默认只保留最近 50 次执行（打包与对应的 <run_id>/ 目录）；执行请求的 "retention" 可覆盖：
+# {"max_bundles": 50, "max_age_days": 7, "max_total_mb": 500, "prune_run_dirs": true}
+DEFAULT_RETENTION: Dict[str, Any] = {"max_bundles": 50, "prune_run_dirs": True}
+# 没有打包的 <run_id>/ 目录（执行中途退出或旧版本遗留）在最近修改超过该时长后才参与清理，避免删除正在执行的目录
+ORPHAN_RUN_DIR_GRACE_S = 3600
+# 流式读取 report.json 的分块大小；摘要中最多保留的失败明细条数（计数不受影响）
+REPORT_CHUNK_CHARS = 1024 * 1024
+MAX_SUMMARY_FAILURES = 200
 
 
 def read_json(path: pathlib.Path) -> Dict[str, Any]:
@@ -24,42 +57,245 @@ def read_json(path: pathlib.Path) -> Dict[str, Any]:
         return {}
 
 
-def summarize(duration_s: float, exit_code: int, run_id: Optional[str]) -> Dict[str, Any]:
-    report = read_json(ARTIFACTS_DIR / "report.json")
-    tests = report.get("tests", [])
+class _ChunkedJsonReader:
+    """
+    按块读取 JSON 文本的最小增量解析器：只在需要时解码单个值，跳过的值不构造对象。
+    内存占用与分块大小及单个被解码的值相关，与文件总大小无关。
+    """
+
+    _WS = re.compile(r"[ \t\r\n]*")
+    # 跳过值时只关心字符串边界与括号
+    _STRUCT = re.compile(r'["{}\[\]]')
+    _STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+    _SCALAR_END = re.compile(r"[,}\]\s]")
+
+    def __init__(self, stream: TextIO, chunk_chars: int = REPORT_CHUNK_CHARS) -> None:
+        self._stream = stream
+        self._chunk = chunk_chars
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._stream.read(self._chunk)
+        if not data:
+            self._eof = True
+            return False
+        # 丢弃已消费的前缀，缓冲区只保留未解析部分
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self._pos = self._WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"report.json 格式错误：位置 {self._pos} 处期望 {char!r}")
+        self._pos += 1
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字可能恰好被分块截断，确认其后已有分隔符
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip(self) -> None:
+        """跳过一个值（对象 / 数组 / 字符串 / 标量），不构造 Python 对象。"""
+        char = self.peek()
+        if char not in '{["':
+            while True:
+                match = self._SCALAR_END.search(self._buf, self._pos)
+                if match:
+                    self._pos = match.start()
+                    return
+                if not self._fill():
+                    self._pos = len(self._buf)
+                    return
+        depth = 0
+        while True:
+            match = self._STRUCT.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise ValueError("report.json 在值结束前被截断")
+                continue
+            token = match.group()
+            if token == '"':
+                end = self._STRING_END.match(self._buf, match.end())
+                if end is None:
+                    # 字符串跨块：从引号处补齐后重新扫描
+                    self._pos = match.start()
+                    if not self._fill():
+                        raise ValueError("report.json 在字符串结束前被截断")
+                    continue
+                self._pos = end.end()
+                if depth == 0:
+                    return
+                continue
+            self._pos = match.end()
+            depth += 1 if token in "{[" else -1
+            if depth == 0:
+                return
+
+    def iter_array_items(self, key: str) -> Iterator[Any]:
+        """逐个产出顶层对象中 key 对应数组的元素，其余顶层字段直接跳过。"""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            name = self.decode()
+            self.expect(":")
+            if name == key and self.peek() == "[":
+                self._pos += 1
+                if self.peek() != "]":
+                    while True:
+                        yield self.decode()
+                        if self.peek() != ",":
+                            break
+                        self._pos += 1
+                self.expect("]")
+            else:
+                self.skip()
+            if self.peek() != ",":
+                break
+            self._pos += 1
+        self.expect("}")
 
+
+def iter_report_tests(path: pathlib.Path) -> Iterator[Dict[str, Any]]:
+    """逐条读取 pytest-json-report 的 tests 数组，不把整个 report.json 载入内存。"""
+    if ijson is not None:
+        with path.open("rb") as f:
+            yield from ijson.items(f, "tests.item", use_float=True)
+        return
+    with path.open("r", encoding="utf-8") as f:
+        yield from _ChunkedJsonReader(f).iter_array_items("tests")
+
+
+def iter_junit_tests(path: pathlib.Path) -> Iterator[Dict[str, Any]]:
+    """
+    report.json 缺失时的回退：用 iterparse 逐个读取 junit.xml 的 testcase，
+    转换为与 report.json 的 tests 相同的结构，处理完的元素立即清理。
+    """
+    for _, elem in ElementTree.iterparse(str(path), events=("end",)):
+        if elem.tag != "testcase":
+            continue
+        classname = elem.get("classname") or ""
+        name = elem.get("name") or ""
+        outcome = "passed"
+        longrepr = None
+        captured: Dict[str, str] = {}
+        for child in elem:
+            if child.tag in ("failure", "error") and outcome == "passed":
+                outcome = "failed" if child.tag == "failure" else "error"
+                longrepr = (child.text or child.get("message") or "").strip() or None
+            elif child.tag == "skipped" and outcome == "passed":
+                outcome = "skipped"
+                longrepr = child.get("message")
+            elif child.tag in ("system-out", "system-err") and child.text:
+                captured["stdout" if child.tag == "system-out" else "stderr"] = child.text
+        try:
+            duration = float(elem.get("time") or 0.0)
+        except ValueError:
+            duration = None
+        lineno = elem.get("line")
+        module = classname.replace(".", "/")
+        yield {
+            "nodeid": f"{module}::{name}" if module else name,
+            "lineno": int(lineno) if lineno and lineno.isdigit() else None,
+            "outcome": outcome,
+            "call": {"duration": duration, "longrepr": longrepr, **captured},
+        }
+        elem.clear()
+
+
+def _tally(tests: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, int], List[Dict[str, Any]], int]:
+    """单次遍历统计总数与各结果数量，并收集最多 MAX_SUMMARY_FAILURES 条失败明细。"""
+    totals = {"total": 0, "passed": 0, "failed": 0, "skipped": 0}
     failures: List[Dict[str, Any]] = []
+    omitted = 0
     for case in tests:
-        if case.get("outcome") == "failed":
-            failure_info: Dict[str, Any] = {
-                "nodeid": case.get("nodeid"),
-                "outcome": case.get("outcome"),
-                "line": case.get("lineno"),
-            }
-            call_info = case.get("call") or {}
-            if isinstance(call_info, dict):
-                failure_info["duration"] = call_info.get("duration")
-                longrepr = call_info.get("longrepr") or call_info.get("crash")
-                if longrepr:
-                    failure_info["longrepr"] = longrepr
-            failures.append(failure_info)
-
-    totals = {
-        "total": len(tests),
-        "passed": sum(1 for item in tests if item.get("outcome") == "passed"),
-        "failed": sum(1 for item in tests if item.get("outcome") == "failed"),
-        "skipped": sum(1 for item in tests if item.get("outcome") == "skipped"),
-    }
+        totals["total"] += 1
+        outcome = case.get("outcome")
+        if outcome in totals:
+            totals[outcome] += 1
+        if outcome != "failed":
+            continue
+        if len(failures) >= MAX_SUMMARY_FAILURES:
+            omitted += 1
+            continue
+        failure_info: Dict[str, Any] = {
+            "nodeid": case.get("nodeid"),
+            "outcome": outcome,
+            "line": case.get("lineno"),
+        }
+        call_info = case.get("call") or {}
+        if isinstance(call_info, dict):
+            failure_info["duration"] = call_info.get("duration")
+            longrepr = call_info.get("longrepr") or call_info.get("crash")
+            if longrepr:
+                failure_info["longrepr"] = longrepr
+        failures.append(failure_info)
+    return totals, failures, omitted
 
-    artifact_candidates = {
-        "junit_xml": ARTIFACTS_DIR / "junit.xml",
-        "json_report": ARTIFACTS_DIR / "report.json",
-        "coverage_xml": ARTIFACTS_DIR / "coverage.xml",
-        "bench_json": ARTIFACTS_DIR / "bench.json",
-        "pytest_stdout": PYTEST_STDOUT,
-        "pytest_stderr": PYTEST_STDERR,
-        "pytest_log": PYTEST_LOG,
-    }
+
+def _tally_artifacts(artifacts_dir: pathlib.Path) -> Tuple[Dict[str, int], List[Dict[str, Any]], int, Optional[str]]:
+    """优先流式读取 report.json；缺失或损坏时回退到 junit.xml。返回值末项为结果来源。"""
+    sources = (
+        ("json_report", iter_report_tests),
+        ("junit_xml", iter_junit_tests),
+    )
+    for name, reader in sources:
+        path = artifacts_dir / ARTIFACT_FILES[name]
+        if not path.exists():
+            continue
+        try:
+            totals, failures, omitted = _tally(reader(path))
+        except (ValueError, OSError, ElementTree.ParseError) as exc:
+            print(f"[collect] 解析 {path} 失败，尝试下一个来源: {exc}", file=sys.stderr)
+            continue
+        return totals, failures, omitted, name
+    totals, failures, omitted = _tally([])
+    return totals, failures, omitted, None
+
+
+def summarize(
+    duration_s: float,
+    exit_code: int,
+    run_id: Optional[str],
+    llm_stats: Optional[Dict[str, Any]] = None,
+    tests: Optional[List[Dict[str, Any]]] = None,
+    artifacts_dir: pathlib.Path = ARTIFACTS_DIR,
+) -> Dict[str, Any]:
+    """
+    汇总本次执行结果。tests 由进程内执行引擎的结果收集插件直接提供（结构与 report.json 的 tests 一致），
+    未提供时流式读取本次执行产物目录 artifacts_dir 中的 report.json，缺失时回退到 junit.xml。
+    """
+    if tests is None:
+        totals, failures, omitted, source = _tally_artifacts(artifacts_dir)
+    else:
+        totals, failures, omitted = _tally(tests)
+        source = "plugin"
+
+    artifact_candidates = {name: artifacts_dir / filename for name, filename in ARTIFACT_FILES.items()}
     artifacts: Dict[str, str] = {
         name: str(path)
         for name, path in artifact_candidates.items()
@@ -68,43 +304,207 @@ def summarize(duration_s: float, exit_code: int, run_id: Optional[str]) -> Dict[
 
     summary = {
         "run_id": run_id or f"{int(time.time())}",
+        "artifacts_dir": str(artifacts_dir),
         "duration_s": float(duration_s),
         "exit_code": int(exit_code),
         "totals": totals,
+        "results_source": source,
         "artifacts": artifacts,
     }
 
     if failures:
         summary["failures"] = failures
+    if omitted:
+        summary["failures_omitted"] = omitted
 
-    if PYTEST_STDOUT.exists() or PYTEST_STDERR.exists():
+    if llm_stats:
+        summary["llm"] = llm_stats
+
+    if "pytest_stdout" in artifacts or "pytest_stderr" in artifacts:
         summary["logs"] = {
-            "stdout": str(PYTEST_STDOUT) if PYTEST_STDOUT.exists() else None,
-            "stderr": str(PYTEST_STDERR) if PYTEST_STDERR.exists() else None,
-            "pytest_log": str(PYTEST_LOG) if PYTEST_LOG.exists() else None,
+            "stdout": artifacts.get("pytest_stdout"),
+            "stderr": artifacts.get("pytest_stderr"),
+            "pytest_log": artifacts.get("pytest_log"),
         }
     return summary
 
 
-def pack_artifacts(out_zip: pathlib.Path) -> None:
-    with zipfile.ZipFile(out_zip, "w", zipfile.ZIP_DEFLATED) as bundle:
-        for file_path in ARTIFACTS_DIR.rglob("*"):
-            if file_path.is_file():
-                bundle.write(file_path, file_path.relative_to(ARTIFACTS_DIR))
+def _compress_type(path: pathlib.Path, size: int) -> int:
+    if path.suffix.lower() in COMPRESSED_SUFFIXES or size < MIN_DEFLATE_BYTES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def pack_artifacts(out_zip: pathlib.Path, artifacts_dir: pathlib.Path = ARTIFACTS_DIR) -> Dict[str, Any]:
+    """
+    把本次执行的产物目录打包为 out_zip，返回打包统计。
+    - 只打包 artifacts_dir 内的文件（不含其他执行的目录与历史打包）；
+    - 已压缩格式与小文件直接存储，其余 deflate；
+    - 逐块流式写入，先写临时文件再原子替换，中途失败不会留下残缺的打包；
+    - 打包已存在且比目录中所有文件都新时跳过（重复调用 finalize 不重复打包）。
+    """
+    files = [
+        path
+        for path in sorted(artifacts_dir.rglob("*"))
+        if path.is_file() and path != out_zip and not path.name.startswith(out_zip.name)
+    ]
+    stats: Dict[str, Any] = {"files": len(files), "stored": 0, "deflated": 0, "input_bytes": 0, "skipped": False}
+    if out_zip.exists() and all(path.stat().st_mtime <= out_zip.stat().st_mtime for path in files):
+        stats["skipped"] = True
+        stats["bytes"] = out_zip.stat().st_size
+        return stats
+
+    tmp_zip = out_zip.with_name(out_zip.name + ".tmp")
+    try:
+        with zipfile.ZipFile(tmp_zip, "w", allowZip64=True) as bundle:
+            for path in files:
+                info = zipfile.ZipInfo.from_file(path, path.relative_to(artifacts_dir).as_posix())
+                info.compress_type = _compress_type(path, info.file_size)
+                with path.open("rb") as src, bundle.open(info, "w", force_zip64=True) as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+                stats["input_bytes"] += info.file_size
+                stats["stored" if info.compress_type == zipfile.ZIP_STORED else "deflated"] += 1
+        os.replace(tmp_zip, out_zip)
+    finally:
+        if tmp_zip.exists():
+            tmp_zip.unlink()
+    stats["bytes"] = out_zip.stat().st_size
+    return stats
+
+
+def prune_bundles(
+    root: pathlib.Path,
+    retention: Optional[Dict[str, Any]] = None,
+    keep: Optional[pathlib.Path] = None,
+) -> List[str]:
+    """
+    按保留策略清理产物根目录下的历史打包（bundle_*.zip），返回被删除的路径。
+    策略依次生效：最多保留 max_bundles 个、删除早于 max_age_days 的、总大小超过 max_total_mb 时从最旧的开始删除；
+    prune_run_dirs（默认开启，可显式设为 false）为真时同时删除对应的 <run_id>/ 目录，
+    没有打包的 <run_id>/ 目录按同一策略参与计数与清理。keep（本次打包）永不删除。
+    """
+    policy = dict(DEFAULT_RETENTION if retention is None else retention)
+    max_bundles = policy.get("max_bundles")
+    max_age_days = policy.get("max_age_days")
+    max_total_mb = policy.get("max_total_mb")
+    prune_run_dirs = policy.get("prune_run_dirs", True)
+    now = time.time()
+
+    bundles = []
+    for path in root.glob("bundle_*.zip"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # 并发执行可能已删除
+            continue
+        bundles.append((stat.st_mtime, stat.st_size, path))
+    if prune_run_dirs:
+        bundles.extend(_orphan_run_dirs(root, now))
+    bundles.sort(key=lambda item: item[0], reverse=True)  # 最新的在前
+
+    doomed: List[pathlib.Path] = []
+    total_bytes = 0
+    kept = 0
+    for mtime, size, path in bundles:
+        if keep is not None and path == keep:
+            kept += 1
+            total_bytes += size
+            continue
+        too_many = max_bundles is not None and kept >= int(max_bundles)
+        too_old = max_age_days is not None and now - mtime > float(max_age_days) * 86400
+        too_big = max_total_mb is not None and total_bytes + size > float(max_total_mb) * 1024 * 1024
+        if too_many or too_old or too_big:
+            doomed.append(path)
+            continue
+        kept += 1
+        total_bytes += size
+
+    removed: List[str] = []
+    for path in doomed:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(str(path))
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        removed.append(str(path))
+        if prune_run_dirs:
+            run_dir = root / path.stem[len("bundle_"):]
+            if run_dir.is_dir():
+                shutil.rmtree(run_dir, ignore_errors=True)
+    return removed
+
+
+def _orphan_run_dirs(root: pathlib.Path, now: float) -> List[Tuple[float, int, pathlib.Path]]:
+    """产物根目录下没有对应打包的 <run_id>/ 目录（以包含 pytest 产物文件识别），返回 (mtime, 大小, 路径)。"""
+    orphans = []
+    for path in root.iterdir():
+        if not path.is_dir() or (root / f"bundle_{path.name}.zip").exists():
+            continue
+        if not any((path / name).is_file() for name in ARTIFACT_FILES.values()):
+            continue
+        try:
+            mtime = path.stat().st_mtime
+            if now - mtime < ORPHAN_RUN_DIR_GRACE_S:
+                continue
+            size = sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+        except FileNotFoundError:
+            continue
+        orphans.append((mtime, size, path))
+    return orphans
+
+
+def finalize(
+    duration_s: float,
+    exit_code: int,
+    run_id: Optional[str],
+    llm_stats: Optional[Dict[str, Any]] = None,
+    tests: Optional[List[Dict[str, Any]]] = None,
+    artifacts_dir: pathlib.Path = ARTIFACTS_DIR,
+    retention: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    生成摘要并把本次执行的产物目录打包到其上级目录（产物根目录），
+    再按 retention 清理历史打包，返回最终的结构化摘要。
+    """
+    summary = summarize(duration_s, exit_code, run_id, llm_stats, tests, artifacts_dir)
+    bundle_zip = artifacts_dir.parent / f"bundle_{summary['run_id']}.zip"
+    start = time.time()
+    bundle_stats = pack_artifacts(bundle_zip, artifacts_dir)
+    bundle_stats["duration_s"] = round(time.time() - start, 4)
+    pruned = prune_bundles(artifacts_dir.parent, retention, keep=bundle_zip)
+    if pruned:
+        bundle_stats["pruned"] = pruned
+    summary["artifacts"]["bundle_zip"] = str(bundle_zip)
+    summary["bundle"] = bundle_stats
+    return summary
 
 
 def main() -> None:
     if len(sys.argv) < 3:
-        raise SystemExit("usage: collect.py <duration_s> <exit_code> [run_id]")
+        raise SystemExit(
+            "usage: collect.py <duration_s> <exit_code> [run_id] [llm_stats_json] [artifacts_dir] [retention_json]"
+        )
 
     duration_s = float(sys.argv[1])
     exit_code = int(sys.argv[2])
     run_id = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else None
+    llm_stats: Optional[Dict[str, Any]] = None
+    if len(sys.argv) > 4 and sys.argv[4]:
+        try:
+            llm_stats = json.loads(sys.argv[4])
+        except json.JSONDecodeError:
+            llm_stats = None
+    artifacts_dir = pathlib.Path(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5] else ARTIFACTS_DIR
+    retention: Optional[Dict[str, Any]] = None
+    if len(sys.argv) > 6 and sys.argv[6]:
+        try:
+            retention = json.loads(sys.argv[6])
+        except json.JSONDecodeError:
+            retention = None
 
-    summary = summarize(duration_s, exit_code, run_id)
-    bundle_zip = ARTIFACTS_DIR / f"bundle_{summary['run_id']}.zip"
-    pack_artifacts(bundle_zip)
-    summary["artifacts"]["bundle_zip"] = str(bundle_zip)
+    summary = finalize(duration_s, exit_code, run_id, llm_stats, artifacts_dir=artifacts_dir, retention=retention)
     print(json.dumps(summary, ensure_ascii=False, indent=2))
 
 
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+失败日志提炼：从 report.json（缺失时 junit.xml）中只提取修复所需的信息，生成紧凑的失败摘要。
+
+对每个失败 / 出错的用例提取：
+- 失败阶段（setup / call / teardown）、异常类型与断言 / 异常信息；
+- 位于生成脚本中的 traceback 帧（文件:行号、所在函数、出错的源码行）；
+- 该用例捕获的 stdout / stderr / 日志（只保留尾部）。
+异常类型、规范化后的信息（数字、引号内容归一）与出错位置相同的失败合并为一组，只展示一次并列出涉及的用例。
+报告为流式读取（见 collect.iter_report_tests），内存只与失败分组数有关；
+没有失败用例但存在收集错误（语法错误、导入失败等）时，提取 collectors 中的错误。
+"""
+import argparse
+import json
+import pathlib
+import re
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+RUNNER_DIR = pathlib.Path(__file__).resolve().parent
+if str(RUNNER_DIR) not in sys.path:
+    sys.path.insert(0, str(RUNNER_DIR))
+
+import collect  # noqa: E402
+
+FAILED_OUTCOMES = {"failed", "error"}
+# collect 为 collectors 中的收集错误（见 _iter_collection_errors），其余为用例的三个阶段
+STAGES = ("collect", "setup", "call", "teardown")
+MAX_GROUPS = 20
+MAX_GROUP_NODEIDS = 10
+MAX_MESSAGE_LINES = 8
+MAX_FRAMES = 3
+MAX_CAPTURED_CHARS = 800
+
+# pytest 长格式 traceback 中每个条目结尾的位置行：path:lineno: in func / path:lineno: ExcType
+_LOCATION_RE = re.compile(r"^(?P<path>[^\s:][^:]*):(?P<lineno>\d+): (?P<where>.+)$")
+_EXC_PREFIX_RE = re.compile(r"^(?P<type>[A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Warning|Failed|Skipped)):")
+_NORMALIZE_RE = re.compile(r"0x[0-9a-fA-F]+|\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"")
+
+
+def _tail(text: str, limit: int) -> str:
+    text = text.strip()
+    return text if len(text) <= limit else "…" + text[-limit:]
+
+
+def _is_script_frame(path: str, entry_name: Optional[str]) -> bool:
+    normalized = path.replace("\\", "/")
+    if entry_name:
+        return normalized.rsplit("/", 1)[-1] == entry_name
+    return "site-packages" not in normalized and not normalized.startswith(("<", "/usr/lib"))
+
+
+def parse_longrepr(longrepr: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """把 pytest 长格式 traceback 拆成帧列表（path / lineno / where / source）与 E 开头的错误信息行。"""
+    frames: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    source: Optional[str] = None
+    for line in longrepr.splitlines():
+        if line.startswith(">"):
+            source = line[1:].strip()
+            continue
+        if line.startswith("E "):
+            errors.append(line[1:].strip())
+            continue
+        match = _LOCATION_RE.match(line.strip())
+        if match:
+            frames.append({
+                "path": match.group("path"),
+                "lineno": int(match.group("lineno")),
+                "where": match.group("where").strip(),
+                "source": source,
+            })
+            source = None
+    return frames, errors
+
+
+def _failed_stage(case: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    for stage in STAGES:
+        info = case.get(stage)
+        if isinstance(info, dict) and info.get("outcome") in FAILED_OUTCOMES:
+            return stage, info
+    # junit 回退的结构只有 call，且不带阶段结果
+    info = case.get("call")
+    return "call", info if isinstance(info, dict) else {}
+
+
+def distill_case(case: Dict[str, Any], entry_name: Optional[str] = None) -> Dict[str, Any]:
+    """提取单个失败用例的关键信息。"""
+    stage, info = _failed_stage(case)
+    longrepr = info.get("longrepr") or ""
+    if not isinstance(longrepr, str):
+        longrepr = str(longrepr)
+    frames, error_lines = parse_longrepr(longrepr)
+    crash = info.get("crash") if isinstance(info.get("crash"), dict) else {}
+
+    exc_type = None
+    if frames and not frames[-1]["where"].startswith("in "):
+        exc_type = frames[-1]["where"]
+    traceback_entries = info.get("traceback") or []
+    if not exc_type and traceback_entries and isinstance(traceback_entries[-1], dict):
+        exc_type = traceback_entries[-1].get("message") or None
+    message = (crash.get("message") or "\n".join(error_lines)).strip()
+    if not message and longrepr.strip():
+        message = longrepr.strip().splitlines()[-1]
+    match = _EXC_PREFIX_RE.match(message)
+    if match:
+        exc_type = exc_type or match.group("type")
+        message = message[match.end():].strip()
+    for line in reversed(error_lines):
+        match = _EXC_PREFIX_RE.match(line) if not exc_type else None
+        if match:
+            exc_type = match.group("type")
+    if not exc_type:
+        exc_type = "AssertionError" if message.startswith("assert") else "Error"
+
+    script_frames = [frame for frame in frames if _is_script_frame(frame["path"], entry_name)]
+    if not script_frames and crash.get("path") and _is_script_frame(str(crash["path"]), entry_name):
+        script_frames = [{"path": crash["path"], "lineno": crash.get("lineno"), "where": exc_type, "source": None}]
+
+    captured = {}
+    for key in ("stdout", "stderr", "log"):
+        text = info.get(key)
+        if isinstance(text, str) and text.strip():
+            captured[key] = _tail(text, MAX_CAPTURED_CHARS)
+
+    message_lines = message.splitlines()
+    if len(message_lines) > MAX_MESSAGE_LINES:
+        message_lines = message_lines[:MAX_MESSAGE_LINES] + ["…"]
+    return {
+        "nodeid": case.get("nodeid"),
+        "outcome": case.get("outcome"),
+        "stage": stage,
+        "exception": exc_type,
+        "message": "\n".join(message_lines),
+        "frames": script_frames[-MAX_FRAMES:],
+        "captured": captured,
+    }
+
+
+def _signature(detail: Dict[str, Any]) -> str:
+    first_line = (detail["message"].splitlines() or [""])[0]
+    frame = detail["frames"][-1] if detail["frames"] else {}
+    location = f"{frame.get('path')}:{frame.get('lineno')}" if frame else ""
+    return "|".join((detail["stage"], detail["exception"], _NORMALIZE_RE.sub("_", first_line), location))
+
+
+def _slim_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留失败用例的 nodeid、结果与失败阶段的 longrepr（定向修复与重跑失败用例所需），丢弃捕获输出等大字段。"""
+    slim: Dict[str, Any] = {"nodeid": case.get("nodeid"), "outcome": case.get("outcome")}
+    for stage in STAGES:
+        info = case.get(stage)
+        if isinstance(info, dict) and info.get("outcome") in FAILED_OUTCOMES:
+            slim[stage] = {key: info.get(key) for key in ("outcome", "longrepr", "crash") if info.get(key)}
+    return slim
+
+
+def build_digest(
+    tests: Iterable[Dict[str, Any]],
+    entry_name: Optional[str] = None,
+    keep_failed_tests: bool = False,
+) -> Dict[str, Any]:
+    """遍历用例结果，统计总数并按错误签名合并失败用例；keep_failed_tests=True 时附带精简后的失败用例列表。"""
+    totals = {"total": 0, "passed": 0, "failed": 0, "error": 0, "skipped": 0}
+    groups: Dict[str, Dict[str, Any]] = {}
+    failed_tests: List[Dict[str, Any]] = []
+    omitted = 0
+    for case in tests:
+        totals["total"] += 1
+        outcome = case.get("outcome")
+        if outcome in totals:
+            totals[outcome] += 1
+        if outcome not in FAILED_OUTCOMES:
+            continue
+        if keep_failed_tests:
+            failed_tests.append(_slim_case(case))
+        detail = distill_case(case, entry_name)
+        signature = _signature(detail)
+        group = groups.get(signature)
+        if group is None:
+            if len(groups) >= MAX_GROUPS:
+                omitted += 1
+                continue
+            group = groups[signature] = dict(detail, count=0, nodeids=[])
+            del group["nodeid"]
+        group["count"] += 1
+        if len(group["nodeids"]) < MAX_GROUP_NODEIDS:
+            group["nodeids"].append(detail["nodeid"])
+    digest: Dict[str, Any] = {"totals": totals, "groups": list(groups.values()), "omitted": omitted}
+    if keep_failed_tests:
+        digest["failed_tests"] = failed_tests
+    return digest
+
+
+def _failed_collectors(items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for item in items:
+        if item.get("outcome") not in FAILED_OUTCOMES:
+            continue
+        yield {
+            "nodeid": item.get("nodeid") or "<collection>",
+            "outcome": "error",
+            "collect": {"outcome": "failed", "longrepr": item.get("longrepr") or ""},
+        }
+
+
+def _iter_collection_errors(path: pathlib.Path) -> Iterator[Dict[str, Any]]:
+    """流式读取 report.json 中失败的 collectors，转换为用例结构，便于复用 build_digest。"""
+    if collect.ijson is not None:
+        with path.open("rb") as f:
+            yield from _failed_collectors(collect.ijson.items(f, "collectors.item", use_float=True))
+        return
+    with path.open("r", encoding="utf-8") as f:
+        yield from _failed_collectors(collect._ChunkedJsonReader(f).iter_array_items("collectors"))
+
+
+def distill_failures(
+    artifacts_dir: pathlib.Path,
+    entry_point: Optional[str] = None,
+    keep_failed_tests: bool = False,
+) -> Dict[str, Any]:
+    """
+    读取执行产物目录并生成失败摘要：优先 report.json，缺失或损坏时回退到 junit.xml。
+    entry_point 为生成脚本的路径（只用文件名），用于筛选属于生成脚本的 traceback 帧；
+    keep_failed_tests=True 时结果带 failed_tests（与 report.json 的 tests 结构相同，只含失败用例）。
+    """
+    entry_name = pathlib.PurePosixPath(entry_point.replace("\\", "/")).name if entry_point else None
+    sources = (
+        ("json_report", collect.iter_report_tests),
+        ("junit_xml", collect.iter_junit_tests),
+    )
+    for name, reader in sources:
+        path = artifacts_dir / collect.ARTIFACT_FILES[name]
+        if not path.exists():
+            continue
+        try:
+            digest = build_digest(reader(path), entry_name, keep_failed_tests)
+            if name == "json_report" and not digest["groups"]:
+                errors = build_digest(_iter_collection_errors(path), entry_name)
+                if errors["groups"]:
+                    digest["groups"] = errors["groups"]
+                    digest["collection_errors"] = errors["totals"]["error"]
+        except Exception as exc:  # noqa: BLE001
+            print(f"[digest] 解析 {path} 失败，尝试下一个来源: {exc}", file=sys.stderr)
+            continue
+        digest["source"] = name
+        return digest
+    return {"totals": {}, "groups": [], "omitted": 0, "source": None, "failed_tests": []}
+
+
+def render_digest(digest: Dict[str, Any]) -> str:
+    """把失败摘要渲染为修复提示词使用的紧凑文本。"""
+    totals = digest.get("totals") or {}
+    groups = digest.get("groups") or []
+    source = {"json_report": "report.json", "junit_xml": "junit.xml"}.get(digest.get("source"), "无")
+    lines = [
+        f"失败摘要（来源 {source}）：共 {totals.get('total', 0)} 个用例，失败 {totals.get('failed', 0)} 个，"
+        f"错误 {totals.get('error', 0)} 个；去重后 {len(groups)} 类错误"
+    ]
+    if digest.get("collection_errors"):
+        lines.append(f"注意：没有用例被执行，收集阶段出错 {digest['collection_errors']} 处（语法错误或导入失败等）")
+    for index, group in enumerate(groups, start=1):
+        lines.append("")
+        lines.append(f"[{index}] {group['exception']}（{group['stage']} 阶段，{group['count']} 个用例）")
+        nodeids = ", ".join(str(nodeid) for nodeid in group["nodeids"])
+        if group["count"] > len(group["nodeids"]):
+            nodeids += f" 等 {group['count']} 个"
+        lines.append(f"    用例: {nodeids}")
+        if group["message"]:
+            message_lines = group["message"].splitlines()
+            lines.append(f"    信息: {message_lines[0]}")
+            lines.extend(f"          {line}" for line in message_lines[1:])
+        for frame in group["frames"]:
+            lines.append(f"    位置: {frame['path']}:{frame['lineno']} {frame['where']}")
+            if frame.get("source"):
+                lines.append(f"          > {frame['source']}")
+        for key, text in (group.get("captured") or {}).items():
+            lines.append(f"    捕获输出[{key}]:")
+            lines.extend(f"      {line}" for line in text.splitlines())
+    if digest.get("omitted"):
+        lines.append("")
+        lines.append(f"另有 {digest['omitted']} 个失败用例属于其他错误类型，已省略")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="从 pytest 产物中提炼失败摘要")
+    parser.add_argument("artifacts_dir", help="某次执行的产物目录（<产物根目录>/<run_id>/）")
+    parser.add_argument("--entry-point", help="生成脚本的路径，用于筛选 traceback 帧")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是文本摘要")
+    args = parser.parse_args()
+    digest = distill_failures(pathlib.Path(args.artifacts_dir), args.entry_point)
+    if args.json:
+        print(json.dumps(digest, ensure_ascii=False, indent=2))
+    else:
+        print(render_digest(digest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""
+常驻 pytest worker 池：省去每次执行时解释器启动与 pytest 插件导入的开销。
+
+结构：
+- 池进程（zygote）启动后预先导入 pytest 及其插件（cov / benchmark / json-report / xdist /
+  rerunfailures / timeout）与 requests，并在空目录上做一次仅收集的 pytest 预热；
+- 池进程预先 fork 出 size 个空闲 worker，每个 worker 只执行一次请求（复用 run.execute 的进程内引擎），
+  结束后退出，池进程立即补 fork 一个新的 worker，保证每次执行都从“干净的已预热进程”开始；
+- 调用方通过本地 Unix socket 发送一行 JSON 请求，收到一行 JSON 结果（退出码、摘要、stdout、stderr）。
+
+WarmPytestPool 为调用方使用的客户端：负责拉起池进程、发送请求，并对比冷启动路径
+（run.py 启动 pytest 子进程 + collect.py 子进程）统计每次执行节省的启动时间。
+池进程记录拉起它的进程 pid，父进程退出（包括被 SIGKILL、未来得及 close）后自行退出并删除 socket 目录。
+仅支持提供 fork 与 AF_UNIX 的平台。
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import pathlib
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+RUNNER_DIR = pathlib.Path(__file__).resolve().parent
+if str(RUNNER_DIR) not in sys.path:
+    sys.path.insert(0, str(RUNNER_DIR))
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_START_TIMEOUT_S = 60.0
+POOL_DIR_PREFIX = "pytest_pool_"
+PRELOAD_MODULES = (
+    "pytest",
+    "pytest_cov",
+    "coverage",
+    "pytest_benchmark",
+    "pytest_jsonreport",
+    "xdist",
+    "pytest_rerunfailures",
+    "pytest_timeout",
+    "requests",
+)
+
+
+def preload_modules() -> List[str]:
+    """导入执行所需的重量级模块，返回实际导入成功的模块名（未安装的插件跳过）。"""
+    loaded: List[str] = []
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        loaded.append(name)
+    return loaded
+
+
+def _warm_pytest() -> None:
+    """在空目录上执行一次仅收集，提前完成插件入口点扫描与 _pytest 内部模块的延迟导入。"""
+    import pytest
+
+    with tempfile.TemporaryDirectory() as empty:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            pytest.main(["--collect-only", "-q", "-p", "no:cacheprovider", empty])
+
+
+def measure_cold_startup() -> float:
+    """
+    估算 run.py 冷启动路径每次执行的固定开销：
+    pytest 子进程（解释器启动 + 插件导入与注册，空目录仅收集）+ run.py 与 collect.py 两次解释器启动。
+    """
+    with tempfile.TemporaryDirectory() as empty:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "pytest", "--collect-only", "-q", "-p", "no:cacheprovider", empty],
+            cwd=empty,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        pytest_s = time.perf_counter() - start
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import json, zipfile"], stdout=subprocess.DEVNULL)
+    bare_s = time.perf_counter() - start
+    return pytest_s + 2 * bare_s
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _serve_one(conn: socket.socket, runner: Any) -> None:
+    """worker 进程：读取一条请求，执行后回写结果。"""
+    line = conn.makefile("r", encoding="utf-8").readline()
+    if not line:
+        return
+    message = json.loads(line)
+    reply: Dict[str, Any] = {"id": message.get("id"), "pid": os.getpid()}
+    start = time.perf_counter()
+    try:
+        exit_code, summary, stdout_text, stderr_text = runner.execute(message["request"])
+        reply.update(exit_code=exit_code, summary=summary, stdout=stdout_text, stderr=stderr_text)
+    except Exception as exc:  # noqa: BLE001
+        reply["error"] = f"{type(exc).__name__}: {exc}"
+    reply["execute_s"] = time.perf_counter() - start
+    conn.sendall(_encode(reply))
+
+
+class _PoolServer:
+    """池进程：单线程 selector 循环，负责接收请求、分派给空闲 worker 并补充 worker。"""
+
+    def __init__(self, socket_path: str, size: int, parent_pid: Optional[int] = None) -> None:
+        self.socket_path = socket_path
+        self.size = max(1, size)
+        self.parent_pid = parent_pid
+        self.orphaned = False
+        self.selector = selectors.DefaultSelector()
+        self.listener: Optional[socket.socket] = None
+        self.runner: Any = None
+        self.workers: Dict[socket.socket, Dict[str, Any]] = {}
+        self.idle: List[socket.socket] = []
+        self.clients: Dict[socket.socket, bytearray] = {}
+        self.pending: List[Tuple[socket.socket, bytes]] = []
+        self.stopping = False
+
+    def _spawn_worker(self) -> None:
+        parent_sock, child_sock = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                parent_sock.close()
+                if self.listener is not None:
+                    self.listener.close()
+                for sock in list(self.workers) + list(self.clients):
+                    sock.close()
+                _serve_one(child_sock, self.runner)
+            except BaseException:  # noqa: BLE001
+                code = 1
+            finally:
+                os._exit(code)
+        child_sock.close()
+        self.workers[parent_sock] = {"pid": pid, "client": None, "buffer": bytearray()}
+        self.idle.append(parent_sock)
+        self.selector.register(parent_sock, selectors.EVENT_READ, "worker")
+
+    def _retire_worker(self, sock: socket.socket) -> Dict[str, Any]:
+        self.selector.unregister(sock)
+        sock.close()
+        if sock in self.idle:
+            self.idle.remove(sock)
+        worker = self.workers.pop(sock)
+        with contextlib.suppress(ChildProcessError):
+            os.waitpid(worker["pid"], 0)
+        if not self.stopping:
+            self._spawn_worker()
+        return worker
+
+    def _close_client(self, conn: socket.socket) -> None:
+        self.selector.unregister(conn)
+        self.clients.pop(conn, None)
+        self.pending = [(client, line) for client, line in self.pending if client is not conn]
+        conn.close()
+
+    def _reply(self, conn: Optional[socket.socket], payload: bytes) -> None:
+        if conn is None or conn not in self.clients:
+            return
+        try:
+            conn.sendall(payload)
+        except OSError:
+            self._close_client(conn)
+
+    def _on_client(self, conn: socket.socket) -> None:
+        data = conn.recv(65536)
+        if not data:
+            self._close_client(conn)
+            return
+        buffer = self.clients[conn]
+        buffer.extend(data)
+        while b"\n" in buffer:
+            line, _, rest = bytes(buffer).partition(b"\n")
+            buffer[:] = rest
+            if line.strip():
+                self.pending.append((conn, line + b"\n"))
+
+    def _on_worker(self, sock: socket.socket) -> None:
+        worker = self.workers[sock]
+        data = sock.recv(65536)
+        if data:
+            worker["buffer"].extend(data)
+            if not worker["buffer"].endswith(b"\n"):
+                return
+        payload = bytes(worker["buffer"])
+        client = worker["client"]
+        if sock in self.idle:
+            # 空闲 worker 异常退出：只需补充
+            self._retire_worker(sock)
+            return
+        self._retire_worker(sock)
+        if not payload:
+            payload = _encode({"error": f"worker {worker['pid']} 未返回结果即退出"})
+        self._reply(client, payload)
+
+    def _dispatch(self) -> None:
+        while self.pending and self.idle:
+            conn, line = self.pending.pop(0)
+            sock = self.idle.pop(0)
+            self.workers[sock]["client"] = conn
+            try:
+                sock.sendall(line)
+            except OSError:
+                self.pending.insert(0, (conn, line))
+                self._retire_worker(sock)
+
+    def serve(self) -> None:
+        import run  # noqa: PLC0415  runner 与其依赖在 fork 之前导入
+
+        self.runner = run
+        preload_start = time.perf_counter()
+        loaded = preload_modules()
+        _warm_pytest()
+        print(
+            f"[pool] 预加载 {', '.join(loaded)}，耗时 {time.perf_counter() - preload_start:.2f}s",
+            flush=True,
+        )
+
+        for _ in range(self.size):
+            self._spawn_worker()
+        # 预加载完成后才监听，客户端可连接即表示池已就绪
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen()
+        self.selector.register(self.listener, selectors.EVENT_READ, "listen")
+        print(f"[pool] 监听 {self.socket_path}，worker 数 {self.size}", flush=True)
+
+        while not self.stopping:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.data == "listen":
+                    conn, _ = self.listener.accept()
+                    self.clients[conn] = bytearray()
+                    self.selector.register(conn, selectors.EVENT_READ, "client")
+                elif key.data == "client":
+                    self._on_client(key.fileobj)  # type: ignore[arg-type]
+                elif key.fileobj in self.workers:
+                    self._on_worker(key.fileobj)  # type: ignore[arg-type]
+            self._dispatch()
+            self._check_parent()
+        self.shutdown()
+
+    def _check_parent(self) -> None:
+        # 父进程退出后本进程被重新挂到 init / subreaper 下，getppid 随之变化
+        if self.parent_pid is not None and os.getppid() != self.parent_pid:
+            print(f"[pool] 父进程 {self.parent_pid} 已退出，池进程随之退出", flush=True)
+            self.orphaned = True
+            self.stopping = True
+
+    def shutdown(self) -> None:
+        self.stopping = True
+        for sock in list(self.workers):
+            self._retire_worker(sock)
+        for conn in list(self.clients):
+            self._close_client(conn)
+        if self.listener is not None:
+            self.listener.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+        socket_dir = pathlib.Path(self.socket_path).parent
+        if self.orphaned and socket_dir.name.startswith(POOL_DIR_PREFIX):
+            # 正常关闭时由 WarmPytestPool.close 清理；父进程已不在时只能由池进程自己删除
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+class WarmPytestPool:
+    """池进程的客户端；线程安全，每次执行使用独立连接，可并发提交。"""
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        start_timeout_s: float = DEFAULT_START_TIMEOUT_S,
+        measure_cold: bool = True,
+    ) -> None:
+        self.size = max(1, size)
+        self.start_timeout_s = start_timeout_s
+        self.measure_cold = measure_cold
+        self.socket_path: Optional[str] = None
+        self.cold_startup_s: Optional[float] = None
+        self._tmpdir: Optional[tempfile.TemporaryDirectory] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._log_file: Optional[io.TextIOBase] = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats = {"runs": 0, "startup_s": 0.0, "startup_saved_s": 0.0}
+
+    @property
+    def log_path(self) -> Optional[pathlib.Path]:
+        return pathlib.Path(self._tmpdir.name) / "pool.log" if self._tmpdir else None
+
+    def start(self) -> "WarmPytestPool":
+        with self._start_lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+        return self
+
+    def _start(self) -> None:
+        if self.measure_cold and self.cold_startup_s is None:
+            self.cold_startup_s = measure_cold_startup()
+        self._tmpdir = tempfile.TemporaryDirectory(prefix=POOL_DIR_PREFIX)
+        self.socket_path = os.path.join(self._tmpdir.name, "pool.sock")
+        self._log_file = open(self.log_path, "w", encoding="utf-8")  # noqa: SIM115
+        self._proc = subprocess.Popen(
+            [
+                sys.executable,
+                str(pathlib.Path(__file__).resolve()),
+                "--socket",
+                self.socket_path,
+                "--size",
+                str(self.size),
+                "--parent-pid",
+                str(os.getpid()),
+            ],
+            stdout=self._log_file,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.start_timeout_s
+        while True:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"pytest worker 池启动失败，详见 {self.log_path}")
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise TimeoutError(f"pytest worker 池 {self.start_timeout_s}s 内未就绪")
+                time.sleep(0.05)
+        print(f"[pool] pytest worker 池已就绪（{self.size} 个 worker），socket: {self.socket_path}")
+        if self.cold_startup_s is not None:
+            print(f"[pool] 冷启动路径固定开销约 {self.cold_startup_s:.2f}s/次")
+
+    def execute(self, request: Dict[str, Any]) -> Tuple[int, Dict[str, Any], str, str]:
+        """提交一次执行请求，返回值与 run.execute 一致：(退出码, 结构化摘要, stdout, stderr)。"""
+        self.start()
+        start = time.perf_counter()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.socket_path)
+            conn.sendall(_encode({"id": request.get("run_id"), "request": request}))
+            line = conn.makefile("r", encoding="utf-8").readline()
+        roundtrip_s = time.perf_counter() - start
+        if not line:
+            raise RuntimeError(f"pytest worker 池连接中断，详见 {self.log_path}")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"pytest worker 执行失败: {reply['error']}")
+
+        # 热路径的启动开销 = 往返耗时 - worker 内执行耗时（分派 + 进程间传输）
+        startup_s = max(0.0, roundtrip_s - float(reply.get("execute_s", 0.0)))
+        pool_info: Dict[str, Any] = {"worker_pid": reply.get("pid"), "startup_s": round(startup_s, 4)}
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["startup_s"] += startup_s
+            if self.cold_startup_s is not None:
+                saved = self.cold_startup_s - startup_s
+                self._stats["startup_saved_s"] += saved
+                pool_info["cold_startup_s"] = round(self.cold_startup_s, 4)
+                pool_info["startup_saved_s"] = round(saved, 4)
+        summary = reply.get("summary") or {}
+        summary["pool"] = pool_info
+        return int(reply.get("exit_code", 1)), summary, reply.get("stdout", ""), reply.get("stderr", "")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = self.size
+        stats["cold_startup_s"] = self.cold_startup_s
+        stats["startup_s"] = round(stats["startup_s"], 4)
+        stats["startup_saved_s"] = round(stats["startup_saved_s"], 4)
+        return stats
+
+    def close(self) -> None:
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+                try:
+                    self._proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._proc.kill()
+                    self._proc.wait()
+            self._proc = None
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __enter__(self) -> "WarmPytestPool":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="常驻 pytest worker 池进程")
+    parser.add_argument("--socket", required=True, help="监听的 Unix socket 路径")
+    parser.add_argument("--size", type=int, default=DEFAULT_POOL_SIZE, help="预先 fork 的 worker 数")
+    parser.add_argument("--parent-pid", type=int, default=None, help="拉起池进程的进程 pid，该进程退出后池进程随之退出")
+    args = parser.parse_args()
+
+    server = _PoolServer(args.socket, args.size, args.parent_pid)
+
+    def _stop(signum, frame) -> None:  # noqa: ANN001
+        server.stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
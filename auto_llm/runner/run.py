@@ -5,21 +5,39 @@
 2. 构建 pytest 命令
 3. 执行并记录时长
 4. 调用 collect 汇总产物
+
+执行引擎由执行请求的 "engine" 字段选择：
+- subprocess（默认）：启动 python -m pytest 子进程，再启动 collect.py 汇总；
+- inprocess：在当前解释器内调用 pytest.main，由结果收集插件直接产出用例结果，
+  collect 也在进程内调用，免去两次解释器启动与插件导入。
+  pytest-timeout 只有在主线程中才能用信号中断用例，在其他线程中超时会直接结束整个进程，
+  因此非主线程（批量执行线程、Gradio 回调）中配置了 timeout_s 时改用子进程执行。
 """
+import contextlib
 import json
 import os
 import pathlib
+import re
 import subprocess
 import sys
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+RUNNER_DIR = pathlib.Path(__file__).resolve().parent
+if str(RUNNER_DIR) not in sys.path:
+    sys.path.insert(0, str(RUNNER_DIR))
+
+import collect  # noqa: E402
+from stream_capture import STDERR, STDOUT, LineCallback, LineTee, StreamResult, run_streaming  # noqa: E402
+
+ENGINE_SUBPROCESS = "subprocess"
+ENGINE_INPROCESS = "inprocess"
 
 BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
-ARTIFACTS_DIR = BASE_DIR / "artifacts"
-ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
-PYTEST_STDOUT = ARTIFACTS_DIR / "pytest_stdout.log"
-PYTEST_STDERR = ARTIFACTS_DIR / "pytest_stderr.log"
-PYTEST_LOG = ARTIFACTS_DIR / "pytest.log"
+# 产物根目录，可由执行请求的 "artifacts_root" 覆盖；每次执行写入 <根目录>/<run_id>/
+ARTIFACTS_DIR = collect.ARTIFACTS_DIR
 
 
 def load_request(path: pathlib.Path) -> Dict:
@@ -27,35 +45,85 @@ def load_request(path: pathlib.Path) -> Dict:
         return json.load(f)
 
 
-def build_pytest_cmd(req: Dict) -> List[str]:
+def resolve_artifacts_dir(req: Dict) -> pathlib.Path:
+    """
+    确定本次执行的产物目录并创建：
+    请求显式给出 "artifacts_dir" 时直接使用，否则为 <artifacts_root>/<run_id>；
+    未提供 run_id 时生成唯一的 run_id 并写回请求。相对路径以 auto_llm/ 为基准。
+    """
+    explicit = req.get("artifacts_dir")
+    if explicit:
+        path = pathlib.Path(explicit)
+    else:
+        if not req.get("run_id"):
+            req["run_id"] = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        # run_id 作为目录名，去掉路径分隔符等字符
+        safe_run_id = re.sub(r"[^\w.-]", "_", str(req["run_id"])).strip(".") or "run"
+        path = pathlib.Path(req.get("artifacts_root") or ARTIFACTS_DIR) / safe_run_id
+    if not path.is_absolute():
+        path = BASE_DIR / path
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _absolute_target(target: str, base_dir: pathlib.Path) -> str:
+    """把相对路径或 nodeid（path::name）按 base_dir 解析为绝对路径，nodeid 的 :: 部分保持不变。"""
+    path, sep, rest = target.partition("::")
+    resolved = pathlib.Path(path)
+    if not resolved.is_absolute():
+        resolved = base_dir / resolved
+    return f"{resolved}{sep}{rest}"
+
+
+def build_pytest_cmd(
+    req: Dict,
+    artifacts_dir: Optional[pathlib.Path] = None,
+    base_dir: Optional[pathlib.Path] = None,
+) -> List[str]:
+    """
+    子进程引擎在 BASE_DIR 下执行，直接使用相对路径；
+    给出 base_dir 时（进程内引擎不切换工作目录）相对路径与覆盖率目录按 base_dir 解析为绝对路径。
+    """
     suite = req.get("suite", {})
     framework = suite.get("framework", "pytest")
     if framework != "pytest":
         raise ValueError(f"暂不支持的测试框架: {framework}")
 
     paths = suite.get("paths") or ["tests/"]
+    # 显式指定 nodeid 时只执行这些用例（例如自动修复迭代中只重跑上次失败的用例）
+    nodeids = suite.get("nodeids") or []
     config = suite.get("config", {})
     reruns = config.get("reruns", 0)
     timeout_s = config.get("timeout_s")
     parallel = config.get("parallel", 0)
+    out_dir = artifacts_dir or resolve_artifacts_dir(req)
+    targets = nodeids or paths
+    if base_dir is not None:
+        targets = [_absolute_target(target, base_dir) for target in targets]
 
     cmd = [
         sys.executable,
         "-m",
         "pytest",
-        *paths,
+        *targets,
         "--log-file",
-        str(PYTEST_LOG),
+        str(out_dir / collect.ARTIFACT_FILES["pytest_log"]),
         "--log-file-level=INFO",
         "--json-report",
-        f"--json-report-file={ARTIFACTS_DIR / 'report.json'}",
-        f"--junitxml={ARTIFACTS_DIR / 'junit.xml'}",
-        "--cov=.",
-        f"--cov-report=xml:{ARTIFACTS_DIR / 'coverage.xml'}",
-        f"--benchmark-json={ARTIFACTS_DIR / 'bench.json'}",
+        f"--json-report-file={out_dir / collect.ARTIFACT_FILES['json_report']}",
+        f"--junitxml={out_dir / collect.ARTIFACT_FILES['junit_xml']}",
+        f"--benchmark-json={out_dir / collect.ARTIFACT_FILES['bench_json']}",
         "-q",
     ]
 
+    # 部分重跑时覆盖率没有参考意义，可通过 config.coverage=false 关闭以减少开销
+    if config.get("coverage", True):
+        cmd += [f"--cov={base_dir or '.'}", f"--cov-report=xml:{out_dir / collect.ARTIFACT_FILES['coverage_xml']}"]
+
+    # 使用 pytest 自带缓存只重跑上次失败的用例（没有失败记录时执行全部）
+    if config.get("last_failed"):
+        cmd += ["--last-failed"]
+
     if reruns:
         cmd += ["--reruns", str(reruns)]
 
@@ -68,49 +136,227 @@ def build_pytest_cmd(req: Dict) -> List[str]:
     return cmd
 
 
-def run_pytest(cmd: List[str], env: Dict[str, str]) -> Tuple[int, float]:
-    print("[runner] running:", " ".join(cmd))
+def _run_pytest_streaming(
+    cmd: List[str],
+    env: Dict[str, str],
+    on_line: Optional[LineCallback] = None,
+    artifacts_dir: pathlib.Path = ARTIFACTS_DIR,
+) -> Tuple[StreamResult, float]:
+    print("[runner] running:", " ".join(cmd), flush=True)
     start = time.time()
-    result = subprocess.run(
+    result = run_streaming(
         cmd,
         cwd=BASE_DIR,
         env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+        stdout_path=artifacts_dir / collect.ARTIFACT_FILES["pytest_stdout"],
+        stderr_path=artifacts_dir / collect.ARTIFACT_FILES["pytest_stderr"],
+        on_line=on_line,
     )
-    duration = time.time() - start
-
-    PYTEST_STDOUT.write_text(result.stdout or "", encoding="utf-8")
-    PYTEST_STDERR.write_text(result.stderr or "", encoding="utf-8")
+    return result, time.time() - start
 
-    if result.stdout:
-        print(result.stdout, end="")
-    if result.stderr:
-        print(result.stderr, end="", file=sys.stderr)
 
+def run_pytest(
+    cmd: List[str],
+    env: Dict[str, str],
+    on_line: Optional[LineCallback] = None,
+    artifacts_dir: pathlib.Path = ARTIFACTS_DIR,
+) -> Tuple[int, float]:
+    """执行 pytest 子进程，输出逐行写入本次产物目录的日志文件并回显，on_line 可实时接收每一行。"""
+    result, duration = _run_pytest_streaming(cmd, env, on_line, artifacts_dir)
     return result.returncode, duration
 
 
+class ResultCollector:
+    """
+    pytest 插件：在进程内收集每个用例的结果，结构与 pytest-json-report 的 tests 字段一致。
+    给出 terminal 时把终端报告（进度、失败详情、插件输出的覆盖率等）写入该流，而不是进程的 sys.stdout。
+    """
+
+    def __init__(self, terminal: Optional[Any] = None) -> None:
+        self.tests: Dict[str, Dict[str, Any]] = {}
+        self.exitstatus: Optional[int] = None
+        self.terminal = terminal
+
+    def pytest_plugin_registered(self, plugin, manager) -> None:  # noqa: ANN001
+        # 终端报告插件在 configure 阶段创建，创建时已绑定 sys.stdout；注册时改写其输出目标
+        if self.terminal is not None and manager.get_name(plugin) == "terminalreporter":
+            plugin._tw._file = self.terminal
+
+    @staticmethod
+    def _merge_outcome(current: str, report) -> str:  # noqa: ANN001
+        if report.when == "call":
+            if hasattr(report, "wasxfail"):
+                outcome = "xfailed" if report.skipped else "xpassed"
+            else:
+                outcome = report.outcome
+            return current if current == "error" else outcome
+        if report.failed:
+            return "error"
+        if report.skipped and report.when == "setup":
+            return "xfailed" if hasattr(report, "wasxfail") else "skipped"
+        return current
+
+    def pytest_runtest_logreport(self, report) -> None:  # noqa: ANN001
+        entry = self.tests.setdefault(
+            report.nodeid,
+            {"nodeid": report.nodeid, "lineno": report.location[1], "outcome": "passed"},
+        )
+        stage: Dict[str, Any] = {"duration": report.duration, "outcome": report.outcome}
+        if report.failed:
+            stage["longrepr"] = str(report.longrepr)
+        entry[report.when] = stage
+        entry["outcome"] = self._merge_outcome(entry["outcome"], report)
+
+    def pytest_sessionfinish(self, session, exitstatus) -> None:  # noqa: ANN001
+        self.exitstatus = int(exitstatus)
+
+    def results(self) -> List[Dict[str, Any]]:
+        return list(self.tests.values())
+
+
+# 进程内执行会修改环境变量、sys.path 与 sys.modules，同一进程内的多次执行必须串行
+_INPROCESS_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def _inprocess_context(env: Dict[str, str]) -> Iterator[None]:
+    # 只改动有差异的环境变量，避免同进程其他线程（如并发的子进程执行）看到被清空的环境；
+    # 不切换工作目录（进程级状态），路径参数已解析为绝对路径
+    saved_env = {key: os.environ.get(key) for key, value in env.items() if os.environ.get(key) != value}
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    os.environ.update({key: env[key] for key in saved_env})
+    try:
+        yield
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        sys.path[:] = saved_path
+        _purge_user_modules(saved_modules)
+
+
+def _purge_user_modules(saved_modules: set) -> None:
+    """
+    卸载本次执行导入的项目代码（测试模块、conftest 等），下次执行时重新导入修复后的版本；
+    标准库与 site-packages 中的第三方库保留在 sys.modules 中，保持“热”状态。
+    """
+    library_roots = tuple({os.path.realpath(p) for p in (sys.prefix, sys.base_prefix, sys.exec_prefix)})
+    for name in set(sys.modules) - saved_modules:
+        module = sys.modules.get(name)
+        module_file = getattr(module, "__file__", None)
+        if module_file and os.path.realpath(module_file).startswith(library_roots):
+            continue
+        sys.modules.pop(name, None)
+
+
+def run_pytest_inprocess(
+    req: Dict,
+    env: Dict[str, str],
+    on_line: Optional[LineCallback] = None,
+    artifacts_dir: Optional[pathlib.Path] = None,
+) -> Tuple[int, float, List[Dict[str, Any]], str, str]:
+    """
+    在当前进程内执行 pytest，返回 (退出码, 耗时, 用例结果, stdout 尾部, stderr 尾部)。
+    输出与子进程引擎一致：逐行写入日志文件、回显并回调，内存中只保留有界尾部。
+
+    不替换进程的 sys.stdout / sys.stderr（同进程其他线程的输出不会混入本次日志）：
+    用例输出由 pytest 自身在 Python 层捕获（--capture=sys，不重定向 fd 1/2），
+    终端报告由 ResultCollector 改写到本次的日志。
+    """
+    import pytest
+
+    out_dir = artifacts_dir or resolve_artifacts_dir(req)
+    args = build_pytest_cmd(req, out_dir, base_dir=BASE_DIR)[3:]  # 去掉 python -m pytest 前缀
+    args.append("--capture=sys")
+    print("[runner] running in-process: pytest", " ".join(args), flush=True)
+    stdout_tee = LineTee(STDOUT, out_dir / collect.ARTIFACT_FILES["pytest_stdout"], sys.stdout, on_line)
+    stderr_tee = LineTee(STDERR, out_dir / collect.ARTIFACT_FILES["pytest_stderr"], sys.stderr, on_line)
+    collector = ResultCollector(terminal=stdout_tee)
+    try:
+        with _INPROCESS_LOCK, _inprocess_context(env):
+            start = time.time()
+            exit_code = int(pytest.main(args, plugins=[collector]))
+            duration = time.time() - start
+    finally:
+        stdout_tee.close()
+        stderr_tee.close()
+    return exit_code, duration, collector.results(), stdout_tee.tail.text(), stderr_tee.tail.text()
+
+
+def build_env(request: Dict, artifacts_dir: Optional[pathlib.Path] = None) -> Dict[str, str]:
+    env = os.environ.copy()
+    if artifacts_dir is not None:
+        # 覆盖率数据文件默认写在工作目录，并发执行时会互相覆盖
+        env["COVERAGE_FILE"] = str(artifacts_dir / ".coverage")
+    for key, value in request.get("env", {}).items():
+        env[key] = str(value)
+    return env
+
+
+def _timeout_needs_subprocess(request: Dict) -> bool:
+    """配置了超时且不在主线程时，pytest-timeout 无法安全地在进程内生效。"""
+    timeout_s = request.get("suite", {}).get("config", {}).get("timeout_s")
+    return bool(timeout_s) and threading.current_thread() is not threading.main_thread()
+
+
+def execute(request: Dict, on_line: Optional[LineCallback] = None) -> Tuple[int, Dict[str, Any], str, str]:
+    """
+    进程内执行入口，供 pipeline / Gradio 直接调用：
+    返回 (退出码, 结构化摘要, pytest stdout 尾部, pytest stderr 尾部)，摘要即 collect 输出的同一结构；
+    on_line(stream, line) 在执行过程中实时接收每一行输出。
+    非主线程中配置了 timeout_s 时，pytest 改在子进程中执行（超时只结束该子进程），汇总仍在进程内完成。
+    """
+    artifacts_dir = resolve_artifacts_dir(request)
+    env = build_env(request, artifacts_dir)
+    tests: Optional[List[Dict[str, Any]]]
+    if _timeout_needs_subprocess(request):
+        print("[runner] 非主线程中配置了 timeout_s，改用 pytest 子进程执行", flush=True)
+        result, duration = _run_pytest_streaming(build_pytest_cmd(request, artifacts_dir), env, on_line, artifacts_dir)
+        # 用例结果由 collect 从 json 报告 / junit 中读取
+        exit_code, tests, stdout_text, stderr_text = result.returncode, None, result.stdout, result.stderr
+    else:
+        exit_code, duration, tests, stdout_text, stderr_text = run_pytest_inprocess(request, env, on_line, artifacts_dir)
+    summary = collect.finalize(
+        duration,
+        exit_code,
+        request.get("run_id"),
+        request.get("llm"),
+        tests,
+        artifacts_dir=artifacts_dir,
+        retention=request.get("retention"),
+    )
+    return exit_code, summary, stdout_text, stderr_text
+
+
 def main() -> None:
     default_req = BASE_DIR / "input_examples" / "exec_request.json"
     req_path = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else default_req
     request = load_request(req_path)
 
-    env = os.environ.copy()
-    for key, value in request.get("env", {}).items():
-        env[key] = str(value)
+    if request.get("engine", ENGINE_SUBPROCESS) == ENGINE_INPROCESS:
+        exit_code, summary, _, _ = execute(request)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        sys.exit(exit_code)
 
-    pytest_cmd = build_pytest_cmd(request)
-    exit_code, duration = run_pytest(pytest_cmd, env)
+    artifacts_dir = resolve_artifacts_dir(request)
+    env = build_env(request, artifacts_dir)
+    pytest_cmd = build_pytest_cmd(request, artifacts_dir)
+    exit_code, duration = run_pytest(pytest_cmd, env, artifacts_dir=artifacts_dir)
 
     run_id = request.get("run_id")
+    llm_stats = request.get("llm")
     collect_cmd: List[Optional[str]] = [
         sys.executable,
         str(BASE_DIR / "runner" / "collect.py"),
         f"{duration}",
         f"{exit_code}",
         run_id or "",
+        json.dumps(llm_stats, ensure_ascii=False) if llm_stats else "",
+        str(artifacts_dir),
+        json.dumps(request["retention"]) if request.get("retention") is not None else "",
     ]
     subprocess.check_call(
         [arg for arg in collect_cmd if arg is not None],
@@ -0,0 +1,191 @@
+"""
+子进程输出的流式采集：逐行写入日志文件、回显到终端并回调给调用方，内存中只保留有界的尾部。
+
+stdout / stderr 各由一个读线程消费，避免任一管道写满导致子进程阻塞；
+完整输出只落在日志文件中，TailBuffer 仅保留最后 tail_chars 个字符用于摘要与界面展示。
+"""
+import collections
+import io
+import os
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, TextIO, Union
+
+STDOUT = "stdout"
+STDERR = "stderr"
+DEFAULT_TAIL_CHARS = 256 * 1024
+
+# 回调参数为 (流名称 "stdout"/"stderr", 含换行符的一行输出)
+LineCallback = Callable[[str, str], None]
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+class TailBuffer:
+    """按行保存的有界尾部缓冲：超出 max_chars 时从头部整行丢弃。"""
+
+    def __init__(self, max_chars: int = DEFAULT_TAIL_CHARS) -> None:
+        self.max_chars = max_chars
+        self._lines: Deque[str] = collections.deque()
+        self._chars = 0
+        self.total_lines = 0
+        self.dropped_lines = 0
+
+    def append(self, line: str) -> None:
+        self._lines.append(line)
+        self._chars += len(line)
+        self.total_lines += 1
+        while self._chars > self.max_chars and len(self._lines) > 1:
+            self._chars -= len(self._lines.popleft())
+            self.dropped_lines += 1
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped_lines > 0
+
+    def text(self) -> str:
+        return "".join(self._lines)
+
+
+@dataclass
+class StreamResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    stdout_lines: int = 0
+    stderr_lines: int = 0
+    truncated: Dict[str, bool] = field(default_factory=dict)
+
+
+class LineTee(io.TextIOBase):
+    """把逐行输出分发到日志文件、终端回显、回调与尾部缓冲；线程安全，也可作为文件对象直接写入。"""
+
+    # 可重入：回显目标本身可能是另一个 LineTee
+    _echo_lock = threading.RLock()
+
+    def __init__(
+        self,
+        name: str,
+        log_path: Optional[PathLike] = None,
+        echo: Optional[TextIO] = None,
+        on_line: Optional[LineCallback] = None,
+        tail_chars: int = DEFAULT_TAIL_CHARS,
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.echo = echo
+        self.on_line = on_line
+        self.tail = TailBuffer(tail_chars)
+        # 行缓冲：每行写入后立即可见，进程中途崩溃也能保留已输出的日志
+        self._log: Optional[TextIO] = (
+            open(log_path, "w", encoding="utf-8", buffering=1) if log_path is not None else None  # noqa: SIM115
+        )
+        self._partial = ""
+        self._lock = threading.Lock()
+
+    def feed_line(self, line: str) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.write(line)
+            self.tail.append(line)
+        if self.echo is not None:
+            with LineTee._echo_lock:
+                try:
+                    self.echo.write(line)
+                    self.echo.flush()
+                except (ValueError, OSError):
+                    # 回显目标已关闭（例如被其他线程临时替换的 sys.stdout），只停止回显
+                    self.echo = None
+        if self.on_line is not None:
+            self.on_line(self.name, line)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        """文件接口（如进程内 pytest 的终端报告）：按换行切分后逐行分发。"""
+        data = self._partial + text
+        lines = data.splitlines(keepends=True)
+        self._partial = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        for line in lines:
+            self.feed_line(line)
+        return len(text)
+
+    def flush(self) -> None:
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self) -> None:
+        if self._partial:
+            partial, self._partial = self._partial, ""
+            self.feed_line(partial)
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        super().close()
+
+
+def _pump(pipe: TextIO, tee: LineTee) -> None:
+    # 无论回调是否出错都要读完管道，否则子进程写满管道后会永久阻塞
+    try:
+        for line in iter(pipe.readline, ""):
+            try:
+                tee.feed_line(line)
+            except Exception as exc:  # noqa: BLE001
+                tee.on_line = None
+                print(f"[stream_capture] 输出回调异常，已停止回调: {exc}", file=sys.__stderr__)
+    finally:
+        pipe.close()
+
+
+def run_streaming(
+    cmd: List[str],
+    cwd: Optional[PathLike] = None,
+    env: Optional[Dict[str, str]] = None,
+    stdout_path: Optional[PathLike] = None,
+    stderr_path: Optional[PathLike] = None,
+    on_line: Optional[LineCallback] = None,
+    echo: bool = True,
+    tail_chars: int = DEFAULT_TAIL_CHARS,
+) -> StreamResult:
+    """执行命令并流式采集输出，返回退出码与 stdout / stderr 的有界尾部。"""
+    proc_env = dict(os.environ if env is None else env)
+    # 子进程输出到管道时默认块缓冲，关闭缓冲才能逐行看到进度
+    proc_env.setdefault("PYTHONUNBUFFERED", "1")
+    tees = {
+        STDOUT: LineTee(STDOUT, stdout_path, sys.stdout if echo else None, on_line, tail_chars),
+        STDERR: LineTee(STDERR, stderr_path, sys.stderr if echo else None, on_line, tail_chars),
+    }
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env=proc_env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        readers = [
+            threading.Thread(target=_pump, args=(proc.stdout, tees[STDOUT]), daemon=True),
+            threading.Thread(target=_pump, args=(proc.stderr, tees[STDERR]), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        returncode = proc.wait()
+        for reader in readers:
+            reader.join()
+    finally:
+        for tee in tees.values():
+            tee.close()
+    return StreamResult(
+        returncode=returncode,
+        stdout=tees[STDOUT].tail.text(),
+        stderr=tees[STDERR].tail.text(),
+        stdout_lines=tees[STDOUT].tail.total_lines,
+        stderr_lines=tees[STDERR].tail.total_lines,
+        truncated={name: tee.tail.truncated for name, tee in tees.items()},
+    )
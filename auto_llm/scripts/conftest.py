@@ -0,0 +1,10 @@
+"""
+scripts 目录下单元测试的公共配置：与 stopping.py 相同，把项目根目录加入 sys.path，
+使测试既能按文件名导入同目录脚本，也能以 auto_llm.generator.* 导入生成器模块。
+"""
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
@@ -4,6 +4,9 @@ DeepSeek Coder 本地推理包装脚本：
 - 通过 stdin 接收 JSON（包含 system/user 提示）
 - 使用 ModelScope + Transformers 加载 deepseek-ai/deepseek-coder-* 模型进行生成
 - 将生成文本通过 stdout 返回
+- 指定 --worker 时常驻运行：模型只加载一次，按行读取 JSON 请求、按行输出 JSON 响应
+  （协议与 qwen_cli.py 一致：{"id", "system", "user"} -> {"id", "output"}；{"op": "ping"} -> {"status": "ok"}）
+- 请求可附带 "stop_at" / "stop"，产物完整后提前结束生成（见 scripts/stopping.py）
 
 用法示例：
 python auto_llm/scripts/deepseek_cli.py --model deepseek-ai/deepseek-coder-6.7b-instruct
@@ -14,11 +17,13 @@ from __future__ import annotations
 import argparse
 import json
 import sys
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import torch
 from modelscope import AutoModelForCausalLM, AutoTokenizer
 
+from stopping import build_stopping_criteria, make_detector, truncate_artifact
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="DeepSeek 本地推理 CLI")
@@ -42,6 +47,11 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="禁用 tokenizer.apply_chat_template，改用简单拼接 system 和 user 文本",
     )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="常驻 worker 模式，通过 stdin/stdout 按行收发 JSON",
+    )
     return parser.parse_args()
 
 
@@ -115,20 +125,16 @@ def build_inputs(
     return encoded
 
 
-def main() -> None:
-    args = parse_args()
-    tokenizer, model = load_model_and_tokenizer(args)
+def generate_text(
+    tokenizer,
+    model,
+    args: argparse.Namespace,
+    system_prompt: str,
+    user_prompt: str,
+    stop_at: Optional[str] = None,
+    stop: Optional[List[str]] = None,
+) -> str:
     model_device = next(model.parameters()).device
-
-    payload_raw = sys.stdin.read()
-    if not payload_raw:
-        print("[deepseek_cli] 未收到输入 payload", file=sys.stderr)
-        raise SystemExit(1)
-
-    payload = json.loads(payload_raw)
-    system_prompt = payload.get("system", "") or ""
-    user_prompt = payload.get("user", "") or ""
-
     inputs = build_inputs(
         tokenizer=tokenizer,
         system_msg=system_prompt,
@@ -145,15 +151,84 @@ def main() -> None:
         "top_k": args.top_k,
         "eos_token_id": tokenizer.eos_token_id,
     }
+    input_length = inputs["input_ids"].shape[-1]
+    # 产物（代码块 / JSON）完整后立即停止，不再生成用不到的尾部说明
+    criteria = build_stopping_criteria(tokenizer, input_length, [make_detector(stop_at, stop)])
+    if criteria is not None:
+        gen_kwargs["stopping_criteria"] = criteria
 
     with torch.no_grad():
         output_ids = model.generate(**inputs, **gen_kwargs)
 
-    input_length = inputs["input_ids"].shape[-1]
     generated = output_ids[0][input_length:]
     text = tokenizer.decode(generated, skip_special_tokens=True)
+    return truncate_artifact(text, stop_at, stop).strip()
+
+
+def serve_worker(tokenizer, model, args: argparse.Namespace) -> None:
+    """常驻模式：按行处理 JSON 请求，直到 stdin 关闭。"""
+    protocol_out = sys.stdout
+    # 生成过程中的任何 print 都转到 stderr，保证 stdout 只承载协议数据
+    sys.stdout = sys.stderr
+
+    def _send(message: Dict[str, Any]) -> None:
+        protocol_out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        protocol_out.flush()
+
+    _send({"event": "ready"})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            payload = json.loads(line)
+            request_id = payload.get("id")
+            if payload.get("op") == "ping":
+                _send({"id": request_id, "status": "ok"})
+                continue
+            text = generate_text(
+                tokenizer,
+                model,
+                args,
+                payload.get("system", "") or "",
+                payload.get("user", "") or "",
+                stop_at=payload.get("stop_at"),
+                stop=payload.get("stop"),
+            )
+            _send({"id": request_id, "output": text})
+        except Exception as exc:  # noqa: BLE001
+            _send({"id": request_id, "error": f"{type(exc).__name__}: {exc}"})
+
+
+def main() -> None:
+    args = parse_args()
+    tokenizer, model = load_model_and_tokenizer(args)
+
+    if args.worker:
+        serve_worker(tokenizer, model, args)
+        return
+
+    payload_raw = sys.stdin.read()
+    if not payload_raw:
+        print("[deepseek_cli] 未收到输入 payload", file=sys.stderr)
+        raise SystemExit(1)
 
-    sys.stdout.write(text.strip())
+    payload = json.loads(payload_raw)
+    system_prompt = payload.get("system", "") or ""
+    user_prompt = payload.get("user", "") or ""
+
+    sys.stdout.write(
+        generate_text(
+            tokenizer,
+            model,
+            args,
+            system_prompt,
+            user_prompt,
+            stop_at=payload.get("stop_at"),
+            stop=payload.get("stop"),
+        )
+    )
 
 
 if __name__ == "__main__":
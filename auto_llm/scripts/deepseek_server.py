@@ -5,6 +5,17 @@ DeepSeek Coder 本地推理 HTTP 服务。
 特性：
 - 启动时常驻加载模型，仅首次初始化较耗时。
 - 暴露一个 /generate POST 接口，接受 system/user 文本，返回模型生成结果。
+- 动态批处理：短时间窗口内到达的请求左侧补齐后合并为一次 generate 调用，
+  由 --max-batch-size / --max-wait-ms 控制；队列深度与批大小统计见 GET /stats。
+- 流式输出：请求体携带 "stream": true（或调用 /generate_stream）时以 SSE 逐段返回，
+  每个事件为 data: {"delta": "..."}，结束时发送 data: [DONE]。
+- 提前终止：请求体携带 "stop_at": "code_block" | "json" 或 "stop": [...] 时，
+  产物完整（首个代码块闭合 / 最外层 JSON 括号配平）或出现停止序列后立即结束该请求的生成，
+  输出截断到产物末尾；流式客户端断开时同样停止生成。
+- 前缀缓存：系统提示词部分的 past_key_values 按 LRU 缓存（--prefix-cache-mb 设显存上限），
+  流式请求与单条成批的请求命中后只需对用户提示词做 prefill；命中率与节省的 prefill 时间见 GET /stats。
+- 结构化输出：请求体携带 "response_format": {"type": "json_object" | "json_schema", ...} 时
+  以 JSON 语法约束解码（scripts/json_grammar.py），输出保证是合法 JSON，可与批处理中的普通请求同批执行。
 - 默认监听 0.0.0.0:8010，可通过参数自定义。
 
 依赖：
@@ -23,14 +34,23 @@ DeepSeek Coder 本地推理 HTTP 服务。
 from __future__ import annotations
 
 import argparse
-from typing import Any, Dict, List, Optional
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import torch
-from fastapi import FastAPI
-from modelscope import AutoModelForCausalLM, AutoTokenizer
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
+from json_grammar import JSON_RESPONSE_TYPES, build_json_processor
+from prefix_cache import DEFAULT_PREFIX_CACHE_MB, MIN_PREFIX_TOKENS, PrefixKVCache
+from stopping import build_stopping_criteria, clip_stream, detectors_for, make_detector, truncate_artifact
+
 
 class GenerateRequest(BaseModel):
     system: Optional[str] = ""
@@ -40,6 +60,10 @@ class GenerateRequest(BaseModel):
     top_k: Optional[int] = 40
     top_p: Optional[float] = 0.9
     use_chat_template: Optional[bool] = True
+    stream: Optional[bool] = False
+    stop_at: Optional[str] = None
+    stop: Optional[List[str]] = None
+    response_format: Optional[Dict[str, Any]] = None
 
 
 class GenerateResponse(BaseModel):
@@ -61,6 +85,30 @@ def parse_args() -> argparse.Namespace:
         default="bfloat16",
         help="加载模型所用精度，可选 float16/bfloat16/float32/auto，默认 bfloat16",
     )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=8,
+        help="单次 generate 合并的最大请求数，设为 1 即关闭批处理，默认 8",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=20.0,
+        help="收到首个请求后等待更多请求凑批的最长时间（毫秒），默认 20",
+    )
+    parser.add_argument(
+        "--prefix-cache-mb",
+        type=float,
+        default=DEFAULT_PREFIX_CACHE_MB,
+        help=f"系统提示词前缀 KV 缓存的显存上限（MB），0 关闭，默认 {DEFAULT_PREFIX_CACHE_MB}",
+    )
+    parser.add_argument(
+        "--prefix-min-tokens",
+        type=int,
+        default=MIN_PREFIX_TOKENS,
+        help=f"前缀至少多少 token 才缓存，默认 {MIN_PREFIX_TOKENS}",
+    )
     return parser.parse_args()
 
 
@@ -78,6 +126,9 @@ def resolve_dtype(dtype_str: str):
 
 
 def load_model(model_name: str, device: Optional[str], dtype_str: Optional[str]):
+    # 延迟导入，便于在未安装 modelscope 的环境中用替身模型调试批处理逻辑
+    from modelscope import AutoModelForCausalLM, AutoTokenizer
+
     dtype = resolve_dtype(dtype_str)
 
     tokenizer = AutoTokenizer.from_pretrained(
@@ -131,36 +182,385 @@ def build_inputs(
     return inputs
 
 
-def create_app(tokenizer, model) -> FastAPI:
-    app = FastAPI(title="DeepSeek Coder Service", version="1.0.0")
-    model_device = next(model.parameters()).device
+def prefix_past(tokenizer, prefix_cache: Optional[PrefixKVCache], req: GenerateRequest, input_ids):
+    """单条请求的系统提示词前缀命中缓存时返回 past_key_values 副本，否则返回 None。"""
+    if prefix_cache is None or not prefix_cache.enabled or not req.system:
+        return None
+    use_chat_template = bool(req.use_chat_template)
 
-    @app.post("/generate", response_model=GenerateResponse)
-    def generate(req: GenerateRequest) -> GenerateResponse:
+    def _probe(user_text: str) -> List[int]:
+        ids = build_inputs(tokenizer, req.system or "", user_text, use_chat_template, "cpu")["input_ids"]
+        return ids[0].tolist()
+
+    prefix_len = prefix_cache.prefix_len((req.system, use_chat_template), _probe)
+    return prefix_cache.prepare(input_ids, prefix_len)
+
+
+def _gen_kwargs(req: GenerateRequest) -> Dict[str, Any]:
+    return {
+        "max_new_tokens": req.max_new_tokens or 512,
+        "do_sample": True,
+        "temperature": req.temperature if req.temperature is not None else 0.7,
+        "top_p": req.top_p if req.top_p is not None else 0.9,
+        "top_k": req.top_k if req.top_k is not None else 40,
+    }
+
+
+def batch_key(req: GenerateRequest) -> Tuple[Any, ...]:
+    """采样参数与模板设置一致的请求才能合并到同一次 generate 调用。"""
+    kwargs = _gen_kwargs(req)
+    return (
+        kwargs["max_new_tokens"],
+        kwargs["temperature"],
+        kwargs["top_p"],
+        kwargs["top_k"],
+        bool(req.use_chat_template),
+    )
+
+
+def generate_batch(
+    tokenizer,
+    model,
+    reqs: List[GenerateRequest],
+    prefix_cache: Optional[PrefixKVCache] = None,
+) -> List[str]:
+    """
+    将一组采样参数相同的请求左侧补齐后合并为一次 generate 调用。
+    只有一条请求时复用系统提示词前缀缓存；多条请求左侧补齐后前缀位置各不相同，不走缓存。
+    """
+    model_device = next(model.parameters()).device
+    sequences = []
+    for req in reqs:
         inputs = build_inputs(
             tokenizer=tokenizer,
             system_text=req.system or "",
             user_text=req.user,
-            use_chat_template=req.use_chat_template,
+            use_chat_template=bool(req.use_chat_template),
             device=model_device,
         )
-
-        gen_kwargs = {
-            "max_new_tokens": req.max_new_tokens or 512,
-            "do_sample": True,
-            "temperature": req.temperature if req.temperature is not None else 0.7,
-            "top_p": req.top_p if req.top_p is not None else 0.9,
-            "top_k": req.top_k if req.top_k is not None else 40,
-            "eos_token_id": tokenizer.eos_token_id,
+        sequences.append(inputs["input_ids"][0])
+
+    pad_id = tokenizer.pad_token_id
+    if pad_id is None:
+        pad_id = tokenizer.eos_token_id
+    max_len = max(seq.shape[-1] for seq in sequences)
+    input_ids = torch.full((len(sequences), max_len), pad_id, dtype=sequences[0].dtype, device=model_device)
+    attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long, device=model_device)
+    for row, seq in enumerate(sequences):
+        input_ids[row, max_len - seq.shape[-1]:] = seq
+        attention_mask[row, max_len - seq.shape[-1]:] = 1
+
+    gen_kwargs = _gen_kwargs(reqs[0])
+    gen_kwargs["eos_token_id"] = tokenizer.eos_token_id
+    gen_kwargs["pad_token_id"] = pad_id
+    # 每行独立检测产物是否完整，已完成的行由 generate 以 pad 填充，全部完成后整批结束
+    criteria = build_stopping_criteria(tokenizer, max_len, detectors_for(reqs))
+    if criteria is not None:
+        gen_kwargs["stopping_criteria"] = criteria
+    # 要求 JSON 输出的行按语法约束解码，同批其他行不受影响
+    processors = build_json_processor(
+        tokenizer, max_len, [req.response_format for req in reqs], keep=gen_kwargs["top_k"]
+    )
+    if processors is not None:
+        gen_kwargs["logits_processor"] = processors
+    if len(reqs) == 1:
+        past = prefix_past(tokenizer, prefix_cache, reqs[0], input_ids)
+        if past is not None:
+            gen_kwargs["past_key_values"] = past
+
+    with torch.no_grad():
+        output_ids = model.generate(input_ids=input_ids, attention_mask=attention_mask, **gen_kwargs)
+
+    generated = output_ids[:, max_len:]
+    return [
+        truncate_artifact(tokenizer.decode(row, skip_special_tokens=True), req.stop_at, req.stop).strip()
+        for req, row in zip(reqs, generated)
+    ]
+
+
+class BatchScheduler:
+    """
+    微批调度器：后台线程从队列中取出请求，在 max_wait_ms 内尽量凑满 max_batch_size，
+    按采样参数分组后交给 run_batch 执行，再把结果分发回各个等待中的请求。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[GenerateRequest]], List[str]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+    ) -> None:
+        self.run_batch = run_batch
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait_s = max(float(max_wait_ms), 0.0) / 1000.0
+        self._queue: "queue.Queue[Tuple[GenerateRequest, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "requests": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "max_batch_size_seen": 0,
+            "batch_size_histogram": {},
         }
+        self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def for_model(
+        cls,
+        tokenizer,
+        model,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        prefix_cache: Optional[PrefixKVCache] = None,
+        lock: Optional[threading.Lock] = None,
+    ) -> "BatchScheduler":
+        """
+        以 generate_batch 执行批次的调度器。tokenizer / model 可以是任意兼容对象（如 CPU 上的小模型），
+        lock 用于与流式生成互斥使用同一模型。
+        """
+        lock = lock or threading.Lock()
+
+        def _run_batch(reqs: List[GenerateRequest]) -> List[str]:
+            with lock:
+                return generate_batch(tokenizer, model, reqs, prefix_cache)
+
+        return cls(run_batch=_run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def submit(self, req: GenerateRequest) -> Future:
+        future: Future = Future()
+        self._queue.put((req, future))
+        with self._lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return future
+
+    def generate(self, req: GenerateRequest, timeout: Optional[float] = None) -> str:
+        return self.submit(req).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[GenerateRequest, Future]]:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    items.append(self._queue.get_nowait())
+                else:
+                    items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self) -> None:
+        while True:
+            items = self._collect()
+            groups: Dict[Tuple[Any, ...], List[Tuple[GenerateRequest, Future]]] = {}
+            for item in items:
+                groups.setdefault(batch_key(item[0]), []).append(item)
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group: List[Tuple[GenerateRequest, Future]]) -> None:
+        with self._lock:
+            size = len(group)
+            self._stats["requests"] += size
+            self._stats["batches"] += 1
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], size)
+            histogram = self._stats["batch_size_histogram"]
+            histogram[size] = histogram.get(size, 0) + 1
+        try:
+            outputs = self.run_batch([req for req, _ in group])
+        except Exception as exc:  # noqa: BLE001
+            for _, future in group:
+                future.set_exception(exc)
+            return
+        for (_, future), text in zip(group, outputs):
+            future.set_result(text)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["batch_size_histogram"] = dict(self._stats["batch_size_histogram"])
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["avg_batch_size"] = (
+            round(snapshot["requests"] / snapshot["batches"], 3) if snapshot["batches"] else 0.0
+        )
+        snapshot["max_batch_size"] = self.max_batch_size
+        snapshot["max_wait_ms"] = self.max_wait_s * 1000.0
+        return snapshot
+
+
+class TokenStreamer:
+    """
+    兼容 transformers generate(streamer=...) 接口的增量解码器。
+    generate 首次 put 的是提示词，直接跳过；之后每批新 token 解码出新增文本放入队列。
+    """
+
+    def __init__(self, tokenizer) -> None:
+        self.tokenizer = tokenizer
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._tokens: List[int] = []
+        self._emitted = ""
+        self._prompt_skipped = False
+
+    def put(self, value) -> None:  # noqa: ANN001
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        if isinstance(value, torch.Tensor):
+            value = value.reshape(-1).tolist()
+        self._tokens.extend(int(token) for token in value)
+        text = self.tokenizer.decode(self._tokens, skip_special_tokens=True)
+        # 末尾是不完整的多字节字符时先不输出
+        if text.endswith("\ufffd"):
+            return
+        delta = text[len(self._emitted):]
+        if delta:
+            self._emitted = text
+            self._queue.put(delta)
+
+    def end(self) -> None:
+        text = self.tokenizer.decode(self._tokens, skip_special_tokens=True)
+        delta = text[len(self._emitted):]
+        if delta:
+            self._emitted = text
+            self._queue.put(delta)
+        self._queue.put(None)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            delta = self._queue.get()
+            if delta is None:
+                return
+            yield delta
+
+
+def stream_generate(
+    tokenizer,
+    model,
+    req: GenerateRequest,
+    lock: threading.Lock,
+    prefix_cache: Optional[PrefixKVCache] = None,
+) -> Iterator[str]:
+    """在后台线程中执行 generate，并逐段产出新生成的文本。"""
+    model_device = next(model.parameters()).device
+    inputs = build_inputs(
+        tokenizer=tokenizer,
+        system_text=req.system or "",
+        user_text=req.user,
+        use_chat_template=bool(req.use_chat_template),
+        device=model_device,
+    )
+    gen_kwargs = _gen_kwargs(req)
+    gen_kwargs["eos_token_id"] = tokenizer.eos_token_id
+    streamer = TokenStreamer(tokenizer)
+    errors: List[BaseException] = []
+    # 消费端提前退出（产物完整或客户端断开）时通知 generate 停止
+    cancel = threading.Event()
+    gen_kwargs["stopping_criteria"] = build_stopping_criteria(
+        tokenizer,
+        inputs["input_ids"].shape[-1],
+        detectors_for([req]),
+        cancel_event=cancel,
+    )
+    processors = build_json_processor(
+        tokenizer, inputs["input_ids"].shape[-1], [req.response_format], keep=gen_kwargs["top_k"]
+    )
+    if processors is not None:
+        gen_kwargs["logits_processor"] = processors
+
+    def _run() -> None:
+        try:
+            with lock, torch.no_grad():
+                past = prefix_past(tokenizer, prefix_cache, req, inputs["input_ids"])
+                if past is not None:
+                    gen_kwargs["past_key_values"] = past
+                model.generate(**inputs, streamer=streamer, **gen_kwargs)
+        except BaseException as exc:  # noqa: BLE001
+            errors.append(exc)
+            streamer.end()
+
+    threading.Thread(target=_run, daemon=True).start()
+    try:
+        yield from clip_stream(streamer, make_detector(req.stop_at, req.stop))
+    finally:
+        cancel.set()
+    if errors:
+        raise errors[0]
+
+
+def _sse_events(chunks: Iterator[str]) -> Iterator[str]:
+    try:
+        for delta in chunks:
+            # 保持 ASCII 转义，避免正文中的特殊换行符打断 SSE 行协议
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+    except Exception as exc:  # noqa: BLE001
+        yield f"data: {json.dumps({'error': str(exc)})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def create_app(
+    tokenizer,
+    model,
+    max_batch_size: int = 8,
+    max_wait_ms: float = 20.0,
+    prefix_cache: Optional[PrefixKVCache] = None,
+) -> FastAPI:
+    """
+    tokenizer / model 由调用方注入：main() 传入 load_model 加载的模型，
+    测试可传入 CPU 上的小模型（见 test_deepseek_server.py）。
+    """
+    app = FastAPI(title="DeepSeek Coder Service", version="1.0.0")
+    # 批处理与流式请求共用同一模型，generate 调用互斥执行
+    generation_lock = threading.Lock()
+    scheduler = BatchScheduler.for_model(
+        tokenizer,
+        model,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        prefix_cache=prefix_cache,
+        lock=generation_lock,
+    )
+    app.state.scheduler = scheduler
+    app.state.prefix_cache = prefix_cache
+
+    def _validate(req: GenerateRequest) -> None:
+        # 非法的 stop_at 在入队前拒绝，避免拖垮同批的其他请求
+        try:
+            make_detector(req.stop_at, req.stop)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        format_type = (req.response_format or {}).get("type", "text")
+        if format_type not in ("text", *JSON_RESPONSE_TYPES):
+            raise HTTPException(status_code=400, detail=f"不支持的 response_format: {format_type}")
+
+    def _stream_response(req: GenerateRequest) -> StreamingResponse:
+        _validate(req)
+        chunks = stream_generate(tokenizer, model, req, generation_lock, prefix_cache)
+        return StreamingResponse(
+            _sse_events(chunks),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
 
-        with torch.no_grad():
-            output_ids = model.generate(**inputs, **gen_kwargs)
-
-        input_len = inputs["input_ids"].shape[-1]
-        generated = output_ids[0][input_len:]
-        text = tokenizer.decode(generated, skip_special_tokens=True)
-        return GenerateResponse(output=text.strip())
+    @app.post("/generate", response_model=GenerateResponse)
+    def generate(req: GenerateRequest):  # noqa: ANN201
+        if req.stream:
+            return _stream_response(req)
+        _validate(req)
+        # 同步路由运行在线程池中，多个并发请求会在调度器里合并成批
+        return GenerateResponse(output=scheduler.generate(req))
+
+    @app.post("/generate_stream")
+    def generate_stream(req: GenerateRequest) -> StreamingResponse:
+        return _stream_response(req)
+
+    @app.get("/stats")
+    def stats() -> Dict[str, Any]:
+        result: Dict[str, Any] = {"batching": scheduler.stats()}
+        if prefix_cache is not None:
+            result["prefix_cache"] = prefix_cache.stats()
+        return result
 
     @app.get("/")
     def health() -> Dict[str, str]:
@@ -172,7 +572,14 @@ def create_app(tokenizer, model) -> FastAPI:
 def main() -> None:
     args = parse_args()
     tokenizer, model = load_model(args.model, args.device, args.dtype)
-    app = create_app(tokenizer, model)
+    prefix_cache = PrefixKVCache(model, max_mb=args.prefix_cache_mb, min_tokens=args.prefix_min_tokens)
+    app = create_app(
+        tokenizer,
+        model,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        prefix_cache=prefix_cache,
+    )
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
 
 
@@ -0,0 +1,431 @@
+"""
+本地推理脚本共用的 JSON 语法约束解码。
+
+请求携带 "response_format": {"type": "json_object" | "json_schema", ...} 时，
+JsonLogitsProcessor 在每一步只保留能让已生成文本仍是合法 JSON 前缀的候选 token：
+- JsonPrefixValidator 是逐字符的下推自动机，覆盖对象、数组、字符串（含转义）、数字与 true/false/null，
+  字符串中不允许出现未转义的控制字符；
+- json_schema 约束根节点类型，根节点为对象时还约束其顶层属性：属性值的类型（按首字符判定，integer 不允许小数与指数）、
+  键不重复、required 中的键全部出现后才能闭合，additionalProperties 为 false 时键名只能取 properties 中的名称；
+  更深层的结构只保证是合法 JSON，不按 schema 校验；
+- 候选 token 按 logits 从高到低逐个校验，凑满 keep 个合法候选（与 top_k 采样一致）后把其余 token 置为 -inf，
+  避免每步遍历整个词表；
+- JSON 闭合前屏蔽 EOS，闭合后只允许 EOS；所有候选都不合法时本步不做约束（兜底，不会卡死生成）。
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence
+
+import torch
+
+try:
+    from transformers import LogitsProcessor, LogitsProcessorList
+except ImportError:  # pragma: no cover - 未安装 transformers 时仅保留接口形状
+    LogitsProcessor = object  # type: ignore[assignment,misc]
+    LogitsProcessorList = list  # type: ignore[assignment,misc]
+
+__all__ = [
+    "JSON_RESPONSE_TYPES",
+    "JsonLogitsProcessor",
+    "JsonPrefixValidator",
+    "RootObjectSchema",
+    "build_json_processor",
+    "decode_delta",
+    "make_validator",
+    "wants_json",
+]
+
+JSON_RESPONSE_TYPES = ("json_object", "json_schema")
+# 计算候选 token 增量文本时参与解码的已生成 token 数（处理多字节字符与空格前缀）
+DECODE_WINDOW = 6
+# 每步最多校验的候选数，超过后不再寻找更多合法候选
+MAX_CANDIDATE_CHECKS = 256
+
+# 期望状态
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"  # "[" 之后
+_KEY = "key"
+_KEY_OR_END = "key_or_end"  # "{" 之后
+_COLON = "colon"
+_COMMA_OR_END = "comma_or_end"
+_DONE = "done"
+
+_WHITESPACE = " \t\r\n"
+_LITERALS = {"t": "rue", "f": "alse", "n": "ull"}
+_NUMBER_END = {"zero", "int", "frac", "exp_digits"}
+# JSON Schema 类型对应的值首字符
+_TYPE_STARTS = {
+    "object": "{",
+    "array": "[",
+    "string": '"',
+    "number": "-0123456789",
+    "integer": "-0123456789",
+    "boolean": "tf",
+    "null": "n",
+}
+
+
+def decode_delta(
+    tokenizer,
+    window: List[int],
+    prev_text: str,
+    token_ids: List[int],
+    skip_special_tokens: bool = False,
+) -> str:
+    """
+    在 window（最近 DECODE_WINDOW 个已处理 token，解码结果为 prev_text）之后追加 token_ids 新增的文本。
+    只解码窗口与新 token，每步开销与已生成长度无关。
+    """
+    text = tokenizer.decode(window + token_ids, skip_special_tokens=skip_special_tokens)
+    # 多字节字符被拆成多个 token 时，前一步解码出的 � 会在这里被替换为真实字符，
+    # 只取与上一步不同的部分
+    common = 0
+    for a, b in zip(prev_text, text):
+        if a != b:
+            break
+        common += 1
+    return text[common:]
+
+
+def _number_next(state: str, ch: str) -> Optional[str]:
+    digit = ch.isdigit() and ch.isascii()
+    if state == "minus":
+        return "zero" if ch == "0" else ("int" if digit else None)
+    if state == "zero":
+        return "dot" if ch == "." else ("exp" if ch in "eE" else None)
+    if state == "int":
+        if digit:
+            return "int"
+        return "dot" if ch == "." else ("exp" if ch in "eE" else None)
+    if state in ("dot", "frac"):
+        if digit:
+            return "frac"
+        return "exp" if state == "frac" and ch in "eE" else None
+    if state == "exp":
+        return "exp_sign" if ch in "+-" else ("exp_digits" if digit else None)
+    if state in ("exp_sign", "exp_digits"):
+        return "exp_digits" if digit else None
+    return None
+
+
+def _schema_types(spec: Dict[str, Any]) -> Optional[FrozenSet[str]]:
+    types = spec.get("type")
+    if isinstance(types, str):
+        types = [types]
+    known = frozenset(name for name in types or [] if name in _TYPE_STARTS)
+    return known or None
+
+
+class RootObjectSchema:
+    """根对象的顶层约束：各属性值允许的类型（None 表示不限）、必需键，以及是否禁止额外的键。"""
+
+    __slots__ = ("properties", "required", "closed")
+
+    def __init__(self, schema: Dict[str, Any]) -> None:
+        self.properties: Dict[str, Optional[FrozenSet[str]]] = {
+            name: _schema_types(spec) if isinstance(spec, dict) else None
+            for name, spec in (schema.get("properties") or {}).items()
+        }
+        self.required: FrozenSet[str] = frozenset(schema.get("required") or [])
+        self.closed = schema.get("additionalProperties") is False
+
+
+class JsonPrefixValidator:
+    """逐字符校验文本是否仍是合法 JSON 的前缀；feed 失败后状态不再可用，校验候选前先 copy()。"""
+
+    __slots__ = (
+        "stack",
+        "expect",
+        "token",
+        "is_key",
+        "escape",
+        "number",
+        "literal",
+        "root_type",
+        "root_schema",
+        "key",
+        "value_key",
+        "seen_keys",
+        "integer",
+    )
+
+    def __init__(self, root_type: Optional[str] = "object", root_schema: Optional[RootObjectSchema] = None) -> None:
+        self.stack: List[str] = []
+        self.expect = _VALUE
+        self.token: Optional[str] = None  # None / "string" / "number" / "literal"
+        self.is_key = False
+        self.escape = 0  # 0: 普通字符；-1: 反斜杠之后；>0: \u 之后还需的十六进制位数
+        self.number = ""
+        self.literal = ""
+        self.root_type = root_type
+        self.root_schema = root_schema
+        # 根对象中正在读取的键、刚读完等待取值的键、已出现的键；integer 为真时当前数字不允许小数与指数
+        self.key = ""
+        self.value_key: Optional[str] = None
+        self.seen_keys: FrozenSet[str] = frozenset()
+        self.integer = False
+
+    def copy(self) -> "JsonPrefixValidator":
+        clone = JsonPrefixValidator.__new__(JsonPrefixValidator)
+        for name in self.__slots__:
+            setattr(clone, name, getattr(self, name))
+        clone.stack = list(self.stack)
+        return clone
+
+    @property
+    def complete(self) -> bool:
+        return self.expect == _DONE and self.token is None
+
+    def feed(self, text: str) -> bool:
+        return all(self._step(ch) for ch in text)
+
+    # --- 状态转移 --------------------------------------------------------
+    def _value_done(self) -> None:
+        self.expect = _COMMA_OR_END if self.stack else _DONE
+
+    def _in_root_object(self) -> bool:
+        return self.root_schema is not None and self.stack == ["{"]
+
+    def _accept_key(self) -> bool:
+        schema = self.root_schema
+        if self.key in self.seen_keys or (schema.closed and self.key not in schema.properties):
+            return False
+        self.value_key = self.key
+        return True
+
+    def _start_root_property(self, ch: str) -> bool:
+        key, self.value_key = self.value_key, None
+        types = self.root_schema.properties.get(key)
+        self.integer = False
+        if types is not None:
+            if not any(ch in _TYPE_STARTS[name] for name in types):
+                return False
+            self.integer = ch in _TYPE_STARTS["integer"] and "number" not in types
+        self.seen_keys = self.seen_keys | {key}
+        return True
+
+    def _start_value(self, ch: str) -> bool:
+        if not self.stack and self.root_type:
+            allowed = {"object": "{", "array": "["}.get(self.root_type)
+            if allowed and ch != allowed:
+                return False
+        if self.value_key is not None and self._in_root_object() and not self._start_root_property(ch):
+            return False
+        if ch in "{[":
+            self.stack.append(ch)
+            self.expect = _KEY_OR_END if ch == "{" else _VALUE_OR_END
+        elif ch == '"':
+            self.token, self.is_key = "string", False
+        elif ch == "-" or (ch.isdigit() and ch.isascii()):
+            self.token = "number"
+            self.number = "minus" if ch == "-" else ("zero" if ch == "0" else "int")
+        elif ch in _LITERALS:
+            self.token, self.literal = "literal", _LITERALS[ch]
+        else:
+            return False
+        return True
+
+    def _close(self, ch: str) -> bool:
+        if not self.stack or {"}": "{", "]": "["}.get(ch) != self.stack[-1]:
+            return False
+        if self._in_root_object() and not self.root_schema.required <= self.seen_keys:
+            return False
+        self.stack.pop()
+        self._value_done()
+        return True
+
+    def _string(self, ch: str) -> bool:
+        if self.is_key and self._in_root_object() and not (self.escape == 0 and ch == '"'):
+            self.key += ch
+            if self.root_schema.closed and not any(name.startswith(self.key) for name in self.root_schema.properties):
+                return False
+        if self.escape == -1:
+            if ch == "u":
+                self.escape = 4
+                return True
+            self.escape = 0
+            return ch in '"\\/bfnrt'
+        if self.escape > 0:
+            if ch not in "0123456789abcdefABCDEF":
+                return False
+            self.escape -= 1
+            return True
+        if ch == "\\":
+            self.escape = -1
+        elif ch == '"':
+            self.token = None
+            if self.is_key:
+                if self._in_root_object() and not self._accept_key():
+                    return False
+                self.expect = _COLON
+            else:
+                self._value_done()
+        elif ord(ch) < 0x20:
+            return False
+        return True
+
+    def _step(self, ch: str) -> bool:
+        if self.token == "string":
+            return self._string(ch)
+        if self.token == "literal":
+            if ch != self.literal[0]:
+                return False
+            self.literal = self.literal[1:]
+            if not self.literal:
+                self.token = None
+                self._value_done()
+            return True
+        if self.token == "number":
+            nxt = _number_next(self.number, ch)
+            if nxt is not None:
+                if self.integer and nxt in ("dot", "exp"):
+                    return False
+                self.number = nxt
+                return True
+            if self.number not in _NUMBER_END:
+                return False
+            # 数字没有结束符，遇到其他字符即结束，再按数值之后的状态处理该字符
+            self.token = None
+            self.integer = False
+            self._value_done()
+        if ch in _WHITESPACE:
+            return True
+        expect = self.expect
+        if expect == _VALUE:
+            return self._start_value(ch)
+        if expect == _VALUE_OR_END:
+            return self._close(ch) if ch == "]" else self._start_value(ch)
+        if expect in (_KEY, _KEY_OR_END):
+            if ch == '"':
+                self.token, self.is_key = "string", True
+                self.key = ""
+                return True
+            return expect == _KEY_OR_END and self._close(ch)
+        if expect == _COLON:
+            if ch != ":":
+                return False
+            self.expect = _VALUE
+            return True
+        if expect == _COMMA_OR_END:
+            if ch == ",":
+                self.expect = _KEY if self.stack[-1] == "{" else _VALUE
+                return True
+            return self._close(ch)
+        return False
+
+
+def wants_json(response_format: Optional[Dict[str, Any]]) -> bool:
+    return bool(response_format) and response_format.get("type") in JSON_RESPONSE_TYPES
+
+
+def _schema(response_format: Dict[str, Any]) -> Dict[str, Any]:
+    return (response_format.get("json_schema") or {}).get("schema") or {}
+
+
+def _root_type(response_format: Dict[str, Any]) -> Optional[str]:
+    if response_format.get("type") == "json_object":
+        return "object"
+    schema = _schema(response_format)
+    return schema.get("type") if schema.get("type") in ("object", "array") else None
+
+
+def _root_schema(response_format: Dict[str, Any]) -> Optional[RootObjectSchema]:
+    schema = _schema(response_format)
+    if _root_type(response_format) != "object" or not (schema.get("properties") or schema.get("required")):
+        return None
+    return RootObjectSchema(schema)
+
+
+def make_validator(response_format: Dict[str, Any]) -> JsonPrefixValidator:
+    """按 response_format 构造校验器：根节点类型与根对象的顶层 schema 约束。"""
+    return JsonPrefixValidator(_root_type(response_format), _root_schema(response_format))
+
+
+class _RowState:
+    def __init__(self, validator: JsonPrefixValidator) -> None:
+        self.validator = validator
+        self.tokens: List[int] = []
+
+
+class JsonLogitsProcessor(LogitsProcessor):
+    """
+    按行约束 generate 的输出为合法 JSON；formats[i] 为 None 的行不做约束。
+    prompt_len 为（左侧补齐后的）提示词长度，之后的 token 视为生成内容。
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        prompt_len: int,
+        formats: Sequence[Optional[Dict[str, Any]]],
+        keep: int = 40,
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.keep = max(int(keep or 1), 1)
+        eos = tokenizer.eos_token_id
+        self.eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+        self.special_ids = set(getattr(tokenizer, "all_special_ids", []) or []) - self.eos_ids
+        self.rows: List[Optional[_RowState]] = [
+            _RowState(make_validator(fmt)) if wants_json(fmt) else None for fmt in formats
+        ]
+        self.unconstrained_steps = 0
+
+    def _delta(self, window: List[int], prev_text: str, token_id: int) -> str:
+        # � 被替换为真实字符只发生在字符串内部，对语法状态没有影响
+        return decode_delta(self.tokenizer, window, prev_text, [token_id])
+
+    def _advance(self, row: _RowState, token_id: int) -> bool:
+        window = row.tokens[-DECODE_WINDOW:]
+        prev_text = self.tokenizer.decode(window, skip_special_tokens=False) if window else ""
+        row.tokens.append(token_id)
+        if token_id in self.eos_ids:
+            return True
+        return row.validator.feed(self._delta(window, prev_text, token_id))
+
+    def _allowed(self, row: _RowState, scores: torch.Tensor) -> List[int]:
+        if row.validator.complete:
+            return sorted(self.eos_ids)
+        window = row.tokens[-DECODE_WINDOW:]
+        prev_text = self.tokenizer.decode(window, skip_special_tokens=False) if window else ""
+        allowed: List[int] = []
+        candidates = torch.argsort(scores, descending=True)[:MAX_CANDIDATE_CHECKS].tolist()
+        for token_id in candidates:
+            if token_id in self.eos_ids or token_id in self.special_ids:
+                continue
+            delta = self._delta(window, prev_text, token_id)
+            if delta and row.validator.copy().feed(delta):
+                allowed.append(token_id)
+                if len(allowed) >= self.keep:
+                    break
+        return allowed
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids.shape[-1] - self.prompt_len
+        for index, row in enumerate(self.rows):
+            if row is None:
+                continue
+            if generated > len(row.tokens) and not self._advance(row, int(input_ids[index, -1])):
+                # 兜底放开的步骤可能产生非法文本，此后不再约束该行
+                self.rows[index] = None
+                continue
+            allowed = self._allowed(row, scores[index])
+            if not allowed:
+                self.unconstrained_steps += 1
+                continue
+            masked = torch.full_like(scores[index], float("-inf"))
+            masked[allowed] = scores[index, allowed]
+            scores[index] = masked
+        return scores
+
+
+def build_json_processor(
+    tokenizer,
+    prompt_len: int,
+    formats: Sequence[Optional[Dict[str, Any]]],
+    keep: int = 40,
+) -> Optional[LogitsProcessorList]:
+    """任一请求要求 JSON 输出时返回可传给 generate(logits_processor=...) 的列表，否则返回 None。"""
+    if not any(wants_json(fmt) for fmt in formats):
+        return None
+    return LogitsProcessorList([JsonLogitsProcessor(tokenizer, prompt_len, formats, keep=keep)])
@@ -0,0 +1,177 @@
+"""
+本地推理脚本共用的提示词前缀 KV 缓存。
+
+生成脚本、生成用例与修复脚本时的系统提示词很长且每次完全相同，逐次重新 prefill 浪费算力。
+本模块把“系统提示词部分”的 token 序列作为键，缓存其 past_key_values（LRU，按显存字节数设上限）：
+- 命中时把缓存副本作为 generate(past_key_values=...) 传入，模型只需对用户提示词部分做 prefill；
+- 未命中时先对前缀单独 prefill 一次并缓存，再继续生成，总计算量与不缓存时相同；
+- 前缀边界由两个不同的探针用户文本与同一系统提示词套模板后的公共 token 前缀确定，
+  与具体 chat 模板无关，且每个系统提示词只计算一次；
+- stats() 报告命中 / 未命中 / 淘汰次数、占用字节数与累计节省的 prefill 时间（按建缓存时实测耗时计）。
+
+依赖 transformers 的 DynamicCache（4.36+），缺失时缓存自动停用。
+"""
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+import torch
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # pragma: no cover - 未安装 transformers 时停用前缀缓存
+    DynamicCache = None  # type: ignore[assignment,misc]
+
+__all__ = ["DEFAULT_PREFIX_CACHE_MB", "MIN_PREFIX_TOKENS", "PrefixKVCache", "common_prefix_len"]
+
+DEFAULT_PREFIX_CACHE_MB = 1024
+# 短于该长度的前缀 prefill 很快，不值得占用显存
+MIN_PREFIX_TOKENS = 32
+# 用于确定前缀边界的两段探针用户文本，首字符不同即可
+_PROBES = ("A", "B")
+
+# 探针函数：传入用户文本，返回与真实请求同样方式构造的 token id 序列
+PrefixProbe = Callable[[str], Sequence[int]]
+
+
+def common_prefix_len(left: Sequence[int], right: Sequence[int]) -> int:
+    length = 0
+    for a, b in zip(left, right):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def _nbytes(obj: Any) -> int:
+    """统计缓存对象中所有张量占用的字节数，兼容不同版本 DynamicCache 的内部结构。"""
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(item) for item in obj)
+    if hasattr(obj, "layers"):  # transformers >= 4.56
+        return sum(_nbytes(getattr(layer, "keys", None)) + _nbytes(getattr(layer, "values", None)) for layer in obj.layers)
+    if hasattr(obj, "key_cache"):
+        return _nbytes(obj.key_cache) + _nbytes(obj.value_cache)
+    return 0
+
+
+@dataclass
+class _Entry:
+    cache: Any
+    tokens: int
+    nbytes: int
+    prefill_s: float
+    hits: int = 0
+
+
+class PrefixKVCache:
+    """
+    按前缀 token 序列缓存 past_key_values 的 LRU；max_mb<=0 或缺少 DynamicCache 时停用。
+    prepare() 会调用模型做 prefill，调用方需保证与 generate 互斥执行（同一把生成锁）。
+    """
+
+    def __init__(self, model, max_mb: float = DEFAULT_PREFIX_CACHE_MB, min_tokens: int = MIN_PREFIX_TOKENS) -> None:
+        self.model = model
+        self.max_bytes = int(max(max_mb, 0) * 1024 * 1024)
+        self.min_tokens = max(int(min_tokens), 1)
+        self._entries: "OrderedDict[Tuple[int, ...], _Entry]" = OrderedDict()
+        self._boundaries: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "evictions": 0,
+            "tokens_saved": 0,
+            "prefill_saved_s": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and DynamicCache is not None
+
+    def prefix_len(self, key: Hashable, probe: PrefixProbe) -> int:
+        """返回 key（通常是系统提示词与模板设置）对应的前缀 token 数，结果按 key 记忆。"""
+        with self._lock:
+            cached = self._boundaries.get(key)
+        if cached is not None:
+            return cached
+        length = common_prefix_len(*(list(probe(text)) for text in _PROBES))
+        with self._lock:
+            self._boundaries[key] = length
+        return length
+
+    def prepare(self, input_ids: torch.Tensor, prefix_len: int) -> Optional[Any]:
+        """
+        为单条请求（input_ids 形状 [1, seq]）准备可直接传给 generate 的 past_key_values 副本；
+        前缀过短、缓存停用或前缀覆盖了整个输入时返回 None，调用方按无缓存方式生成。
+        """
+        if not self.enabled or input_ids.shape[0] != 1:
+            return None
+        if prefix_len < self.min_tokens or prefix_len >= input_ids.shape[-1]:
+            with self._lock:
+                self._stats["bypassed"] += 1
+            return None
+
+        key = tuple(input_ids[0, :prefix_len].tolist())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self._stats["hits"] += 1
+                self._stats["tokens_saved"] += entry.tokens
+                self._stats["prefill_saved_s"] += entry.prefill_s
+            else:
+                self._stats["misses"] += 1
+
+        if entry is None:
+            entry = self._prefill(input_ids[:, :prefix_len])
+            self._store(key, entry)
+        # generate 会在原地追加新 token 的 KV，必须传副本，缓存本身保持只含前缀
+        return copy.deepcopy(entry.cache)
+
+    def _prefill(self, prefix_ids: torch.Tensor) -> _Entry:
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=prefix_ids,
+                attention_mask=torch.ones_like(prefix_ids),
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+        if prefix_ids.is_cuda:
+            torch.cuda.synchronize(prefix_ids.device)
+        cache = outputs.past_key_values
+        return _Entry(cache, prefix_ids.shape[-1], _nbytes(cache), time.perf_counter() - start)
+
+    def _store(self, key: Tuple[int, ...], entry: _Entry) -> None:
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            total = sum(item.nbytes for item in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted.nbytes
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["bytes"] = sum(entry.nbytes for entry in self._entries.values())
+            snapshot["prefix_tokens"] = [entry.tokens for entry in self._entries.values()]
+        snapshot["enabled"] = self.enabled
+        snapshot["max_bytes"] = self.max_bytes
+        snapshot["prefill_saved_s"] = round(snapshot["prefill_saved_s"], 3)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 3) if lookups else 0.0
+        return snapshot
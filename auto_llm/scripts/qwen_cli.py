@@ -4,9 +4,22 @@
 - 通过 stdin 接收 JSON（包含 system/user 提示）
 - 使用 HuggingFace 加载模型生成回答
 - 将生成文本通过 stdout 返回
+- 指定 --worker 时常驻运行：模型只加载一次，按行读取 JSON 请求、按行输出 JSON 响应
 
 用法示例：
 python auto_exec/scripts/qwen_cli.py --model /home/.../qwen2.5 --max-new-tokens 1024
+
+常驻 worker 协议（每行一个 JSON 对象）：
+    启动完成: {"event": "ready"}
+    请求:     {"id": 1, "system": "...", "user": "..."}  ->  {"id": 1, "output": "..."}
+    健康检查: {"id": 2, "op": "ping"}                   ->  {"id": 2, "status": "ok"}
+    统计:     {"id": 4, "op": "stats"}                  ->  {"id": 4, "prefix_cache": {...}}
+    出错:     {"id": 3, "error": "..."}
+
+请求（单次或 worker）可附带 "stop_at": "code_block" | "json" 与 "stop": [...]，
+产物完整后提前结束生成，见 scripts/stopping.py。
+worker 模式下系统提示词前缀的 KV 按 LRU 缓存（--prefix-cache-mb），重复的系统提示词不再重新 prefill，
+见 scripts/prefix_cache.py。
 """
 from __future__ import annotations
 
@@ -14,11 +27,14 @@ import argparse
 import json
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from prefix_cache import DEFAULT_PREFIX_CACHE_MB, MIN_PREFIX_TOKENS, PrefixKVCache
+from stopping import build_stopping_criteria, make_detector, truncate_artifact
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Qwen 本地推理 CLI")
@@ -29,6 +45,19 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--temperature", type=float, default=0.7, help="采样温度")
     parser.add_argument("--top-p", type=float, default=0.9, help="top-p 采样阈值")
     parser.add_argument("--no-chat-template", action="store_true", help="禁用 tokenizer chat_template，使用简单拼接")
+    parser.add_argument("--worker", action="store_true", help="常驻 worker 模式，通过 stdin/stdout 按行收发 JSON")
+    parser.add_argument(
+        "--prefix-cache-mb",
+        type=float,
+        default=DEFAULT_PREFIX_CACHE_MB,
+        help=f"worker 模式下系统提示词前缀 KV 缓存的显存上限（MB），0 关闭，默认 {DEFAULT_PREFIX_CACHE_MB}",
+    )
+    parser.add_argument(
+        "--prefix-min-tokens",
+        type=int,
+        default=MIN_PREFIX_TOKENS,
+        help=f"前缀至少多少 token 才缓存，默认 {MIN_PREFIX_TOKENS}",
+    )
     return parser.parse_args()
 
 
@@ -89,38 +118,127 @@ def build_prompt(tokenizer: AutoTokenizer, system_msg: str, user_msg: str, disab
         return f"{system_msg.strip()}\n\n{user_msg.strip()}".strip()
 
 
-def main() -> None:
-    args = parse_args()
-    tokenizer, model = load_model(args)
-
-    payload_raw = sys.stdin.read()
-    if not payload_raw:
-        print("[qwen_cli] 未收到输入 payload", file=sys.stderr)
-        raise SystemExit(1)
-
-    payload = json.loads(payload_raw)
-    system_prompt = payload.get("system", "")
-    user_prompt = payload.get("user", "")
-
+def generate_text(
+    tokenizer,
+    model,
+    args: argparse.Namespace,
+    system_prompt: str,
+    user_prompt: str,
+    stop_at: Optional[str] = None,
+    stop: Optional[List[str]] = None,
+    prefix_cache: Optional[PrefixKVCache] = None,
+) -> str:
     prompt_text = build_prompt(tokenizer, system_prompt, user_prompt, args.no_chat_template)
     inputs = tokenizer(prompt_text, return_tensors="pt")
 
     if args.device and args.device.startswith("cuda"):
         inputs = {k: v.to(args.device) for k, v in inputs.items()}
 
+    input_length = inputs["input_ids"].shape[-1]
+    # 产物（代码块 / JSON）完整后立即停止，不再生成用不到的尾部说明
+    criteria = build_stopping_criteria(tokenizer, input_length, [make_detector(stop_at, stop)])
+
+    extra: Dict[str, Any] = {}
+    if prefix_cache is not None and prefix_cache.enabled and system_prompt:
+
+        def _probe(user_text: str) -> List[int]:
+            probe_text = build_prompt(tokenizer, system_prompt, user_text, args.no_chat_template)
+            return tokenizer(probe_text)["input_ids"]
+
+        prefix_len = prefix_cache.prefix_len((system_prompt, args.no_chat_template), _probe)
+        past = prefix_cache.prepare(inputs["input_ids"], prefix_len)
+        if past is not None:
+            extra["past_key_values"] = past
+
     with torch.no_grad():
         output_ids = model.generate(
             **inputs,
+            **extra,
             max_new_tokens=args.max_new_tokens,
             temperature=args.temperature,
             top_p=args.top_p,
             do_sample=True,
+            stopping_criteria=criteria,
         )
 
-    generated = output_ids[0][inputs["input_ids"].shape[-1]:]
+    generated = output_ids[0][input_length:]
     text = tokenizer.decode(generated, skip_special_tokens=True)
+    return truncate_artifact(text, stop_at, stop).strip()
 
-    sys.stdout.write(text.strip())
+
+def serve_worker(tokenizer, model, args: argparse.Namespace) -> None:
+    """常驻模式：按行处理 JSON 请求，直到 stdin 关闭。"""
+    prefix_cache = PrefixKVCache(
+        model,
+        max_mb=getattr(args, "prefix_cache_mb", DEFAULT_PREFIX_CACHE_MB),
+        min_tokens=getattr(args, "prefix_min_tokens", MIN_PREFIX_TOKENS),
+    )
+    protocol_out = sys.stdout
+    # 生成过程中的任何 print 都转到 stderr，保证 stdout 只承载协议数据
+    sys.stdout = sys.stderr
+
+    def _send(message: Dict[str, Any]) -> None:
+        protocol_out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        protocol_out.flush()
+
+    _send({"event": "ready"})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            payload = json.loads(line)
+            request_id = payload.get("id")
+            if payload.get("op") == "ping":
+                _send({"id": request_id, "status": "ok"})
+                continue
+            if payload.get("op") == "stats":
+                _send({"id": request_id, "prefix_cache": prefix_cache.stats()})
+                continue
+            text = generate_text(
+                tokenizer,
+                model,
+                args,
+                payload.get("system", "") or "",
+                payload.get("user", "") or "",
+                stop_at=payload.get("stop_at"),
+                stop=payload.get("stop"),
+                prefix_cache=prefix_cache,
+            )
+            _send({"id": request_id, "output": text})
+        except Exception as exc:  # noqa: BLE001
+            _send({"id": request_id, "error": f"{type(exc).__name__}: {exc}"})
+
+
+def main() -> None:
+    args = parse_args()
+    tokenizer, model = load_model(args)
+
+    if args.worker:
+        serve_worker(tokenizer, model, args)
+        return
+
+    payload_raw = sys.stdin.read()
+    if not payload_raw:
+        print("[qwen_cli] 未收到输入 payload", file=sys.stderr)
+        raise SystemExit(1)
+
+    payload = json.loads(payload_raw)
+    system_prompt = payload.get("system", "")
+    user_prompt = payload.get("user", "")
+
+    sys.stdout.write(
+        generate_text(
+            tokenizer,
+            model,
+            args,
+            system_prompt,
+            user_prompt,
+            stop_at=payload.get("stop_at"),
+            stop=payload.get("stop"),
+        )
+    )
 
 
 if __name__ == "__main__":
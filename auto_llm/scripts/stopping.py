@@ -0,0 +1,124 @@
+"""
+本地推理脚本共用的提前终止条件。
+
+请求 payload 可携带：
+    "stop_at": "code_block" | "json"   产物（首个代码块 / 最外层 JSON 对象）完整后停止
+    "stop":    ["...", ...]            任一停止序列出现后停止，输出不含该序列
+
+检测逻辑复用 auto_llm/generator/stop_detection.py，保证服务端截断与客户端解析一致。
+"""
+from __future__ import annotations
+
+import sys
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import torch
+
+from json_grammar import DECODE_WINDOW, decode_delta
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from auto_llm.generator.stop_detection import StopDetector, truncate_artifact  # noqa: E402
+from auto_llm.generator.stop_detection import clip_stream as _clip_stream  # noqa: E402
+
+try:
+    from transformers import StoppingCriteria, StoppingCriteriaList
+except ImportError:  # pragma: no cover - 未安装 transformers 时仅保留接口形状
+    StoppingCriteria = object  # type: ignore[assignment,misc]
+    StoppingCriteriaList = list  # type: ignore[assignment,misc]
+
+__all__ = [
+    "ArtifactStoppingCriteria",
+    "build_stopping_criteria",
+    "clip_stream",
+    "detectors_for",
+    "make_detector",
+    "truncate_artifact",
+]
+
+
+def make_detector(stop_at: Optional[str], stop: Optional[Sequence[str]] = None) -> Optional[StopDetector]:
+    detector = StopDetector(stop_at, stop)
+    return detector if detector.active else None
+
+
+# 多字节字符最多被拆成的 token 数：解码结果以 � 结尾时最多等待这么多个 token 再送入检测器
+MAX_PENDING_TOKENS = 4
+
+
+class ArtifactStoppingCriteria(StoppingCriteria):
+    """
+    每步只解码各行新生成的 token（带 DECODE_WINDOW 个已处理 token 作为上下文）并把新增文本交给
+    StopDetector.feed；某行产物完整即标记该行结束。每步开销与已生成长度无关。
+    cancel_event 被置位（例如流式客户端断开）时所有行立即结束。
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        prompt_len: int,
+        detectors: Sequence[Optional[StopDetector]],
+        cancel_event: Optional[threading.Event] = None,
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.detectors = list(detectors)
+        self.cancel_event = cancel_event
+        self.stopped_early = [False] * len(self.detectors)
+        # 各行已送入检测器的生成 token 数，以及其中最后 DECODE_WINDOW 个 token（解码上下文）
+        self._consumed = [0] * len(self.detectors)
+        self._windows: List[List[int]] = [[] for _ in self.detectors]
+
+    def _feed_new_tokens(self, row: int, detector: StopDetector, input_ids: torch.LongTensor) -> bool:
+        new_tokens = input_ids[row, self.prompt_len + self._consumed[row] :].tolist()
+        if not new_tokens:
+            return detector.complete
+        window = self._windows[row]
+        prev_text = self.tokenizer.decode(window, skip_special_tokens=True) if window else ""
+        delta = decode_delta(self.tokenizer, window, prev_text, new_tokens, skip_special_tokens=True)
+        if delta.endswith("\ufffd") and len(new_tokens) < MAX_PENDING_TOKENS:
+            # 多字节字符尚未解码完整，等后续 token 补齐后再一起送入检测器
+            return False
+        self._consumed[row] += len(new_tokens)
+        self._windows[row] = (window + new_tokens)[-DECODE_WINDOW:]
+        return detector.feed(delta)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            return done.fill_(True)
+        for row, detector in enumerate(self.detectors):
+            if detector is None:
+                continue
+            if not detector.complete and self._feed_new_tokens(row, detector, input_ids):
+                self.stopped_early[row] = True
+            done[row] = detector.complete
+        return done
+
+
+def build_stopping_criteria(
+    tokenizer,
+    prompt_len: int,
+    detectors: Sequence[Optional[StopDetector]],
+    cancel_event: Optional[threading.Event] = None,
+) -> Optional[StoppingCriteriaList]:
+    """没有任何行需要检测且无需取消时返回 None，generate 保持原有行为。"""
+    if cancel_event is None and not any(detectors):
+        return None
+    return StoppingCriteriaList([ArtifactStoppingCriteria(tokenizer, prompt_len, detectors, cancel_event)])
+
+
+def clip_stream(chunks: Iterable[str], detector: Optional[StopDetector]) -> Iterator[str]:
+    """流式输出只保留到产物结束位置，完整后不再继续读取。"""
+    if detector is None:
+        return iter(chunks)
+    return _clip_stream(chunks, detector)
+
+
+def detectors_for(requests: Iterable[object]) -> List[Optional[StopDetector]]:
+    """按请求对象上的 stop_at / stop 字段构造检测器。"""
+    return [make_detector(getattr(req, "stop_at", None), getattr(req, "stop", None)) for req in requests]
@@ -0,0 +1,181 @@
+"""
+deepseek_server 动态批处理的 CPU 测试：用随机初始化的小 GPT2 与字符级 tokenizer 代替真实模型，
+检查并发请求合并为一次 generate、左侧补齐、结果按请求顺序分发，以及 /stats 的批处理统计。
+
+运行：
+    pytest auto_llm/scripts/test_deepseek_server.py
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")  # fastapi.testclient 依赖
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from deepseek_server import BatchScheduler, GenerateRequest, create_app  # noqa: E402
+
+PAD_ID = 0
+EOS_ID = 1
+# ASCII 字符按码位顺延到特殊 token 之后
+CHAR_OFFSET = 2
+VOCAB_SIZE = 128
+
+
+class CharTokenizer:
+    """字符级替身 tokenizer，只实现 deepseek_server 用到的接口。"""
+
+    pad_token_id = PAD_ID
+    eos_token_id = EOS_ID
+    all_special_ids = [PAD_ID, EOS_ID]
+
+    def encode(self, text: str) -> List[int]:
+        return [CHAR_OFFSET + ord(ch) for ch in text]
+
+    def __call__(self, text: str, return_tensors: str = "pt") -> Dict[str, "torch.Tensor"]:
+        ids = torch.tensor([self.encode(text)], dtype=torch.long)
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+    def apply_chat_template(self, messages, add_generation_prompt: bool = True, return_tensors: str = "pt"):
+        text = "".join(f"<{msg['role']}>{msg['content']}" for msg in messages)
+        if add_generation_prompt:
+            text += "<assistant>"
+        return torch.tensor([self.encode(text)], dtype=torch.long)
+
+    def decode(self, ids, skip_special_tokens: bool = False) -> str:
+        if isinstance(ids, torch.Tensor):
+            ids = ids.tolist()
+        chars = []
+        for token_id in ids:
+            if token_id in self.all_special_ids:
+                if not skip_special_tokens:
+                    chars.append(f"<{token_id}>")
+                continue
+            chars.append(chr(token_id - CHAR_OFFSET))
+        return "".join(chars)
+
+
+class RecordingModel:
+    """包装小模型，记录每次 generate 的输入与输出，其余属性透传。"""
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.calls: List[Dict[str, "torch.Tensor"]] = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def parameters(self):
+        return self.model.parameters()
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        output_ids = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+        with self._lock:
+            self.calls.append({"input_ids": input_ids, "attention_mask": attention_mask, "output_ids": output_ids})
+        return output_ids
+
+
+@pytest.fixture(scope="module")
+def tokenizer() -> CharTokenizer:
+    return CharTokenizer()
+
+
+@pytest.fixture()
+def model() -> RecordingModel:
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(
+        vocab_size=VOCAB_SIZE,
+        n_positions=256,
+        n_embd=32,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=EOS_ID,
+        eos_token_id=EOS_ID,
+        pad_token_id=PAD_ID,
+    )
+    stub = transformers.GPT2LMHeadModel(config)
+    stub.eval()
+    return RecordingModel(stub)
+
+
+def _request(user: str) -> GenerateRequest:
+    return GenerateRequest(system="sys", user=user, max_new_tokens=4, use_chat_template=False)
+
+
+def test_scheduler_coalesces_and_fans_out_in_order(tokenizer, model):
+    scheduler = BatchScheduler.for_model(tokenizer, model, max_batch_size=3, max_wait_ms=2000)
+    users = ["a", "bbbb", "cccccccc"]
+    futures = [scheduler.submit(_request(user)) for user in users]
+    outputs = [future.result(timeout=60) for future in futures]
+
+    # 三个请求合并为一次 generate 调用
+    assert len(model.calls) == 1
+    call = model.calls[0]
+    input_ids, attention_mask = call["input_ids"], call["attention_mask"]
+    assert input_ids.shape[0] == len(users)
+
+    # 左侧补齐：每行的有效 token 靠右对齐，左侧为 pad 且注意力掩码为 0
+    max_len = input_ids.shape[-1]
+    for row, user in enumerate(users):
+        expected = tokenizer(f"sys\n\n{user}")["input_ids"][0]
+        pad = max_len - expected.shape[-1]
+        assert torch.equal(input_ids[row, pad:], expected)
+        assert torch.all(input_ids[row, :pad] == PAD_ID)
+        assert attention_mask[row, :pad].sum().item() == 0
+        assert attention_mask[row, pad:].sum().item() == expected.shape[-1]
+
+    # 每个请求拿到的是自己那一行的生成结果
+    generated = call["output_ids"][:, max_len:]
+    assert outputs == [tokenizer.decode(row, skip_special_tokens=True).strip() for row in generated]
+
+    stats = scheduler.stats()
+    assert stats["batches"] == 1
+    assert stats["requests"] == len(users)
+    assert stats["max_batch_size_seen"] == len(users)
+    assert stats["batch_size_histogram"] == {len(users): 1}
+
+
+def test_generate_endpoint_batches_concurrent_requests(tokenizer, model):
+    app = create_app(tokenizer, model, max_batch_size=4, max_wait_ms=2000)
+    client = TestClient(app)
+    users = ["x", "yy", "zzz", "wwww"]
+
+    def _post(user: str) -> str:
+        response = client.post(
+            "/generate",
+            json={"system": "sys", "user": user, "max_new_tokens": 4, "use_chat_template": False},
+        )
+        assert response.status_code == 200
+        return response.json()["output"]
+
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        outputs = list(pool.map(_post, users))
+
+    assert len(model.calls) == 1
+    call = model.calls[0]
+    max_len = call["input_ids"].shape[-1]
+    # 行顺序取决于请求到达调度器的先后，按提示词内容找到各请求对应的行
+    rows = {
+        tokenizer.decode(row, skip_special_tokens=True).rsplit("\n", 1)[-1]: index
+        for index, row in enumerate(call["input_ids"])
+    }
+    for user, output in zip(users, outputs):
+        expected = tokenizer.decode(call["output_ids"][rows[user], max_len:], skip_special_tokens=True).strip()
+        assert output == expected
+
+    batching = client.get("/stats").json()["batching"]
+    assert batching["queue_depth"] == 0
+    assert batching["max_queue_depth"] >= 1
+    assert batching["batches"] == 1
+    assert batching["requests"] == len(users)
+    assert batching["max_batch_size_seen"] == len(users)
+    assert batching["avg_batch_size"] == float(len(users))
+    assert batching["max_batch_size"] == 4
@@ -0,0 +1,140 @@
+"""
+generator/regen_manifest 的单元测试：按生成输入指纹决定跳过、只再生成变化的用例，还是完整生成。
+
+运行：
+    pytest auto_llm/scripts/test_regen_manifest.py
+"""
+from __future__ import annotations
+
+import copy
+from pathlib import Path
+
+import pytest
+
+from auto_llm.generator.regen_manifest import (
+    REGEN_FULL,
+    REGEN_PARTIAL,
+    REGEN_SKIP,
+    RegenManifest,
+    drop_case_tests,
+    suite_fingerprint,
+)
+
+ENTRY_POINT = "tests/test_calc.py"
+GUIDE = "系统提示词"
+IDENTITY = {"mode": "http", "model": "demo"}
+
+SUITE = {
+    "suite_name": "计算器",
+    "entry_point": ENTRY_POINT,
+    "test_cases": [
+        {"id": "API-1-TC001", "title": "加法", "steps": "POST /add"},
+        {"id": "API-1-TC002", "title": "减法", "steps": "POST /sub"},
+        {"id": "API-1-TC003", "title": "乘法", "steps": "POST /mul"},
+    ],
+}
+
+SCRIPT = '''import pytest
+
+
+@pytest.fixture
+def client():
+    return object()
+
+
+def test_api_1_tc001_add(client):
+    assert True
+
+
+def test_api_1_tc002_sub(client):
+    assert True
+
+
+class Test_API_1_TC003:
+    def test_mul(self, client):
+        assert True
+
+
+def test_api_1_tc0030_pow(client):
+    assert True
+'''
+
+
+@pytest.fixture()
+def recorded(tmp_path: Path):
+    """模拟一次成功执行：plan 后写入脚本并 commit，返回 (清单, 脚本路径)。"""
+    script_path = tmp_path / ENTRY_POINT
+    script_path.parent.mkdir(parents=True)
+    manifest = RegenManifest(tmp_path)
+    plan = manifest.plan(ENTRY_POINT, SUITE, suite_fingerprint(SUITE, GUIDE, IDENTITY), script_path)
+    assert plan.action == REGEN_FULL
+    script_path.write_text(SCRIPT, encoding="utf-8")
+    assert manifest.commit(ENTRY_POINT, script_path)
+    return RegenManifest(tmp_path), script_path
+
+
+def _plan(manifest: RegenManifest, suite, script_path: Path, guide: str = GUIDE):
+    return manifest.plan(ENTRY_POINT, suite, suite_fingerprint(suite, guide, IDENTITY), script_path)
+
+
+def test_unchanged_suite_is_skipped(recorded):
+    manifest, script_path = recorded
+    assert _plan(manifest, SUITE, script_path).action == REGEN_SKIP
+
+
+def test_changed_and_added_cases_regenerate_partially(recorded):
+    manifest, script_path = recorded
+    suite = copy.deepcopy(SUITE)
+    suite["test_cases"][1]["steps"] = "POST /subtract"
+    suite["test_cases"].append({"id": "API-1-TC004", "title": "除法", "steps": "POST /div"})
+
+    plan = _plan(manifest, suite, script_path)
+    assert plan.action == REGEN_PARTIAL
+    assert [case["id"] for case in plan.changed_cases] == ["API-1-TC002", "API-1-TC004"]
+    assert plan.removed_ids == []
+    # 只删除变化用例的测试，其余测试与 fixture 保留
+    assert "test_api_1_tc002_sub" not in plan.base_code
+    assert "test_api_1_tc001_add" in plan.base_code
+    assert "def client" in plan.base_code
+
+
+def test_removed_case_drops_its_tests(recorded):
+    manifest, script_path = recorded
+    suite = copy.deepcopy(SUITE)
+    del suite["test_cases"][2]
+
+    plan = _plan(manifest, suite, script_path)
+    assert plan.action == REGEN_PARTIAL
+    assert plan.changed_cases == []
+    assert plan.removed_ids == ["API-1-TC003"]
+    # 用例 ID 不区分大小写地匹配测试类名，且只按 _ 分隔的完整片段匹配
+    assert "Test_API_1_TC003" not in plan.base_code
+    assert "test_api_1_tc0030_pow" in plan.base_code
+
+
+@pytest.mark.parametrize(
+    "mutate, reason",
+    [
+        (lambda suite, path: suite.update(base_url="http://other"), "公共字段"),
+        (lambda suite, path: path.write_text(SCRIPT + "\n# 手工修改\n", encoding="utf-8"), "被修改"),
+        (lambda suite, path: suite["test_cases"][0].pop("id"), "唯一 ID"),
+    ],
+)
+def test_full_regeneration_when_incremental_is_unsafe(recorded, mutate, reason):
+    manifest, script_path = recorded
+    suite = copy.deepcopy(SUITE)
+    mutate(suite, script_path)
+    plan = _plan(manifest, suite, script_path)
+    assert plan.action == REGEN_FULL
+    assert reason in plan.reason
+
+
+def test_guide_change_and_force_regenerate_fully(recorded, tmp_path):
+    manifest, script_path = recorded
+    assert _plan(manifest, SUITE, script_path, guide="新的系统提示词").action == REGEN_FULL
+    assert _plan(RegenManifest(tmp_path, force=True), SUITE, script_path).action == REGEN_FULL
+
+
+def test_drop_case_tests_returns_none_when_case_has_no_test():
+    assert drop_case_tests(SCRIPT, ["API-1-TC009"]) is None
+    assert "test_api_1_tc001_add" not in drop_case_tests(SCRIPT, ["API-1-TC001"])
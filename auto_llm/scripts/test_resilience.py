@@ -0,0 +1,141 @@
+"""
+generator/resilience 的单元测试：Retry-After 解析、退避、熔断器状态转换，以及 call_with_retry 的重试与故障转移。
+等待通过注入的 sleep 记录而不真正休眠。
+
+运行：
+    pytest auto_llm/scripts/test_resilience.py
+"""
+from __future__ import annotations
+
+import argparse
+from typing import Dict, List
+
+import pytest
+
+from auto_llm.generator.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    RetryStats,
+    TransientHTTPError,
+    call_with_retry,
+    http_resilience_kwargs,
+    parse_retry_after,
+)
+
+PRIMARY = "http://primary"
+FALLBACK = "http://fallback"
+
+
+class FlakyEndpoints:
+    """按 endpoint 预设每次调用的结果：异常实例则抛出，否则原样返回。"""
+
+    def __init__(self, outcomes: Dict[str, List[object]]) -> None:
+        self.outcomes = outcomes
+        self.calls: List[str] = []
+
+    def __call__(self, endpoint: str) -> object:
+        self.calls.append(endpoint)
+        outcome = self.outcomes[endpoint].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _breakers(threshold: int = 5, reset_s: float = 30.0) -> Dict[str, CircuitBreaker]:
+    return {endpoint: CircuitBreaker(threshold, reset_s) for endpoint in (PRIMARY, FALLBACK)}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_policy_delay_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(base_delay_s=1.0, max_delay_s=4.0, max_retry_after_s=10.0)
+    assert all(0.0 <= policy.delay(10) <= 4.0 for _ in range(50))
+    assert policy.delay(1, retry_after=2.5) == 2.5
+    assert policy.delay(1, retry_after=120.0) == 10.0
+
+
+def test_breaker_opens_after_threshold_and_recovers_through_half_open():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_s=0.0)
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is True
+    assert breaker.state == CIRCUIT_OPEN and breaker.opens == 1
+
+    # 冷却结束后只放行一个探测请求
+    assert breaker.allow() is True
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED and breaker.failures == 0
+
+
+def test_retry_fails_over_to_next_endpoint():
+    func = FlakyEndpoints({PRIMARY: [TransientHTTPError("503", status=503)], FALLBACK: ["ok"]})
+    stats = RetryStats()
+    waits: List[float] = []
+    result = call_with_retry(
+        [PRIMARY, FALLBACK], func, RetryPolicy(base_delay_s=0.0), _breakers(), stats, sleep=waits.append
+    )
+    assert result == "ok"
+    assert func.calls == [PRIMARY, FALLBACK]
+    summary = stats.as_dict()
+    assert (summary["attempts"], summary["retries"], summary["failovers"], summary["failed_calls"]) == (2, 1, 1, 0)
+    assert waits == [0.0]
+
+
+def test_retry_after_is_used_for_backoff():
+    func = FlakyEndpoints({PRIMARY: [TransientHTTPError("429", status=429, retry_after=1.5), "ok"]})
+    waits: List[float] = []
+    breakers = {PRIMARY: CircuitBreaker()}
+    assert call_with_retry([PRIMARY], func, RetryPolicy(), breakers, RetryStats(), sleep=waits.append) == "ok"
+    assert waits == [1.5]
+
+
+def test_non_transient_error_is_not_retried():
+    func = FlakyEndpoints({PRIMARY: [ValueError("400")]})
+    stats = RetryStats()
+    with pytest.raises(ValueError):
+        call_with_retry([PRIMARY, FALLBACK], func, RetryPolicy(), _breakers(), stats, sleep=lambda _: None)
+    assert func.calls == [PRIMARY]
+    assert stats.retries == 0
+
+
+def test_exhausted_attempts_raise_last_error():
+    errors = [TransientHTTPError(f"timeout {index}") for index in range(3)]
+    func = FlakyEndpoints({PRIMARY: list(errors)})
+    stats = RetryStats()
+    with pytest.raises(TransientHTTPError, match="timeout 2"):
+        call_with_retry(
+            [PRIMARY], func, RetryPolicy(max_attempts=3), {PRIMARY: CircuitBreaker()}, stats, sleep=lambda _: None
+        )
+    assert stats.attempts == 3 and stats.failed_calls == 1
+
+
+def test_all_breakers_open_fails_fast():
+    breakers = _breakers(threshold=1, reset_s=600.0)
+    func = FlakyEndpoints({PRIMARY: [TransientHTTPError("down")], FALLBACK: [TransientHTTPError("down")]})
+    stats = RetryStats()
+    with pytest.raises(CircuitOpenError, match="熔断"):
+        call_with_retry([PRIMARY, FALLBACK], func, RetryPolicy(base_delay_s=0.0), breakers, stats, sleep=lambda _: None)
+    # 两个 endpoint 各失败一次后熔断，第三次尝试不再发出请求
+    assert func.calls == [PRIMARY, FALLBACK]
+    assert stats.circuit_opens == 2 and stats.short_circuited == 1
+
+
+def test_http_resilience_kwargs_defaults():
+    kwargs = http_resilience_kwargs(argparse.Namespace())
+    assert kwargs["http_fallback_endpoints"] == []
+    assert kwargs["retry_policy"].max_attempts == 4
+    assert kwargs["breaker_failure_threshold"] == 5
+    kwargs = http_resilience_kwargs(argparse.Namespace(http_max_retries=0, http_fallback_endpoint=[FALLBACK]))
+    assert kwargs["retry_policy"].max_attempts == 1
+    assert kwargs["http_fallback_endpoints"] == [FALLBACK]
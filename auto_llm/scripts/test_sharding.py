@@ -0,0 +1,143 @@
+"""
+generator/sharding 的单元测试：用例分片装箱，以及分片脚本合并时的去重、冲突重命名与引用改写。
+
+运行：
+    pytest auto_llm/scripts/test_sharding.py
+"""
+from __future__ import annotations
+
+import ast
+
+import pytest
+
+from auto_llm.generator.sharding import merge_test_modules, rename_identifiers, shard_suite, shard_test_cases
+
+SHARD_ONE = '''"""分片一。"""
+import pytest
+from math import sqrt
+
+BASE = 1
+
+
+def add(a, b):
+    return a + b
+
+
+@pytest.fixture
+def value():
+    return 3
+
+
+def test_add(value):
+    assert add(1, 2) == value
+'''
+
+SHARD_TWO = '''"""分片二。"""
+import json
+import pytest
+from math import floor, sqrt
+
+BASE = 1
+
+
+def add(a, b):
+    return a + b
+
+
+@pytest.fixture
+def value():
+    return 4
+
+
+@pytest.mark.usefixtures("value")
+def test_add(value, request):
+    assert add(2, 2) == request.getfixturevalue("value")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
+'''
+
+
+def _run(code: str) -> dict:
+    namespace: dict = {"__name__": "merged"}
+    exec(compile(code, "merged", "exec"), namespace)
+    return namespace
+
+
+def test_shard_test_cases_respects_count_and_size():
+    cases = [{"id": f"TC{i:03d}", "steps": "x" * 40} for i in range(5)]
+    assert [len(group) for group in shard_test_cases(cases, 2)] == [2, 2, 1]
+    # 单条序列化为 68 字符，上限 140 时每片只能放两条
+    assert [len(group) for group in shard_test_cases(cases, 10, 140)] == [2, 2, 1]
+
+
+def test_shard_suite_keeps_common_fields():
+    suite = {"suite_name": "demo", "test_cases": [{"id": "TC001"}, {"id": "TC002"}, {"id": "TC003"}]}
+    shards = shard_suite(suite, 2)
+    assert [[case["id"] for case in shard["test_cases"]] for shard in shards] == [["TC001", "TC002"], ["TC003"]]
+    assert all(shard["suite_name"] == "demo" for shard in shards)
+    assert shard_suite(suite, 0) == [suite]
+
+
+def test_merge_dedupes_identical_and_renames_conflicts():
+    merged = merge_test_modules([SHARD_ONE, SHARD_TWO])
+
+    assert merged.duplicates == ["BASE", "add"]
+    assert ("value", "value_shard2") in merged.renamed
+    assert ("test_add", "test_add_shard2") in merged.renamed
+    # 只有非测试定义的冲突需要告警
+    assert merged.conflicts == ["value"]
+
+    tree = ast.parse(merged.code)
+    assert ast.get_docstring(tree) == "分片一。"
+    assert "from math import sqrt, floor" in merged.code
+    # __main__ 守卫统一放到模块末尾
+    assert merged.code.rstrip().endswith("pytest.main([__file__])")
+
+    test_two = next(node for node in tree.body if getattr(node, "name", None) == "test_add_shard2")
+    # 第二个分片的测试通过参数、usefixtures 与 getfixturevalue 引用的都是重命名后的 fixture
+    assert [arg.arg for arg in test_two.args.args] == ["value_shard2", "request"]
+    source = ast.get_source_segment(merged.code, test_two)
+    assert '@pytest.mark.usefixtures("value_shard2")' in merged.code
+    assert 'request.getfixturevalue("value_shard2")' in source
+
+    namespace = _run(merged.code)
+    assert namespace["value"].__wrapped__() == 3
+    assert namespace["value_shard2"].__wrapped__() == 4
+
+
+def test_merge_renames_dependents_of_conflicting_helper():
+    first = "def helper():\n    return 1\n\n\ndef uses():\n    return helper()\n"
+    second = "def helper():\n    return 2\n\n\ndef uses():\n    return helper()\n"
+    merged = merge_test_modules([first, second])
+
+    # uses 本身相同，但依赖的 helper 被重命名后也与第一个分片不同
+    assert merged.conflicts == ["helper", "uses"]
+    namespace = _run(merged.code)
+    assert namespace["uses"]() == 1
+    assert namespace["uses_shard2"]() == 2
+
+
+def test_merge_rejects_unrenamable_conflict():
+    first = "A, B = 1, 2\n"
+    second = "A, B = 3, 4\n"
+    with pytest.raises(ValueError, match="无法自动重命名"):
+        merge_test_modules([first, second])
+
+
+def test_merge_reports_syntax_error_with_shard_index():
+    with pytest.raises(ValueError, match="第 2 个分片"):
+        merge_test_modules([SHARD_ONE, "def broken(:\n"])
+
+
+def test_rename_identifiers_keeps_attributes_and_keywords():
+    source = "# 中文注释\nvalue = obj.value\nresult = call(value=value)  # 值\n"
+    renamed = rename_identifiers(source, {"value": "value_shard2"})
+    assert renamed == "# 中文注释\nvalue_shard2 = obj.value\nresult = call(value=value_shard2)  # 值\n"
+
+
+def test_rename_identifiers_handles_non_ascii_columns():
+    source = 'label = "中文"; value = 1\nprint("中文", value)\n'
+    renamed = rename_identifiers(source, {"value": "v2"})
+    assert renamed == 'label = "中文"; v2 = 1\nprint("中文", v2)\n'
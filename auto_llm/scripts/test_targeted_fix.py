@@ -0,0 +1,132 @@
+"""
+generator/targeted_fix 的单元测试：从 report.json 定位失败测试、沿引用提取修复片段，
+以及把修复后的定义按名称拼回原文件（替换、新增定义的锚点、新增 import）。
+
+运行：
+    pytest auto_llm/scripts/test_targeted_fix.py
+"""
+from __future__ import annotations
+
+import ast
+
+import pytest
+
+from auto_llm.generator.targeted_fix import extract_repair_unit, failing_targets, splice_definitions
+
+ENTRY_POINT = "tests/test_calc.py"
+
+CODE = '''"""计算器接口测试。"""
+import pytest
+
+BASE = 10
+
+
+def add(a, b):
+    return a - b  # 缺陷
+
+
+def unrelated():
+    return 1
+
+
+@pytest.fixture
+def base():
+    return BASE
+
+
+def test_ok():
+    assert unrelated() == 1
+
+
+# 校验加法
+def test_add(base):
+    assert add(base, 1) == 11
+
+
+class TestGroup:
+    def test_m(self):
+        assert add(1, 1) == 2
+'''
+
+REPORT = {
+    "tests": [
+        {
+            "nodeid": f"{ENTRY_POINT}::test_add",
+            "outcome": "failed",
+            "call": {"outcome": "failed", "longrepr": "assert 9 == 11"},
+        },
+        {
+            "nodeid": f"{ENTRY_POINT}::TestGroup::test_m[1]",
+            "outcome": "failed",
+            "call": {"outcome": "failed", "longrepr": "assert 0 == 2"},
+        },
+        {"nodeid": f"{ENTRY_POINT}::test_ok", "outcome": "passed"},
+        {"nodeid": "tests/test_other.py::test_x", "outcome": "failed"},
+    ]
+}
+
+
+def test_failing_targets_maps_nodeids_to_top_level_definitions():
+    failures = failing_targets(REPORT, ENTRY_POINT)
+    assert [(failure.nodeid, failure.target) for failure in failures] == [
+        (f"{ENTRY_POINT}::test_add", "test_add"),
+        (f"{ENTRY_POINT}::TestGroup::test_m[1]", "TestGroup"),
+    ]
+    assert failures[0].detail == "[call] assert 9 == 11"
+
+
+def test_extract_repair_unit_collects_dependencies_but_not_other_tests():
+    unit = extract_repair_unit(CODE, failing_targets(REPORT, ENTRY_POINT))
+    assert unit is not None
+    assert unit.targets == ["test_add", "TestGroup"]
+    # fixture 参数 base -> 常量 BASE，以及两个测试共用的 add；通过的 test_ok 与 unrelated 不在其中
+    assert set(unit.definitions) == {"BASE", "add", "base", "test_add", "TestGroup"}
+    assert unit.imports == "import pytest"
+    assert unit.definitions["test_add"].startswith("# 校验加法\n")
+
+
+def test_extract_repair_unit_returns_none_for_unknown_target():
+    report = {"tests": [{"nodeid": f"{ENTRY_POINT}::test_missing", "outcome": "error"}]}
+    assert extract_repair_unit(CODE, failing_targets(report, ENTRY_POINT)) is None
+
+
+def test_splice_replaces_in_place_and_inserts_additions_before_anchor():
+    repaired = '''import math
+import pytest
+
+
+def add(a, b):
+    return a + b
+
+
+def _round(value):
+    return math.floor(value)
+'''
+    merged, touched = splice_definitions(CODE, repaired, anchor="test_add")
+    assert touched == ["add", "_round"]
+
+    tree = ast.parse(merged)
+    names = [getattr(node, "name", None) for node in tree.body]
+    # 被替换的定义留在原位置，新增定义插在锚点（含其前导注释）之前
+    assert names.index("add") < names.index("unrelated")
+    assert names.index("_round") == names.index("test_add") - 1
+    assert "return math.floor(value)\n\n\n# 校验加法\ndef test_add(base):" in merged
+    # 只追加原文件中没有的 import，并放在原有 import 之后
+    assert merged.count("import pytest") == 1
+    assert merged.index("import math") < merged.index("BASE = 10")
+
+    namespace: dict = {}
+    exec(compile(merged, "spliced", "exec"), namespace)
+    assert namespace["add"](1, 1) == 2
+    assert namespace["_round"](2.7) == 2
+
+
+def test_splice_without_anchor_appends_additions():
+    merged, touched = splice_definitions(CODE, "def helper():\n    return 2\n", anchor="missing")
+    assert touched == ["helper"]
+    assert merged.endswith("\n\n\ndef helper():\n    return 2\n")
+
+
+def test_splice_rejects_invalid_repair():
+    with pytest.raises(ValueError, match="语法错误"):
+        splice_definitions(CODE, "def add(a, b:\n    pass\n")
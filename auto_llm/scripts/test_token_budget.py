@@ -0,0 +1,89 @@
+"""
+generator/token_budget 的单元测试：字符估算、按优先级截断 / 丢弃次要段落，以及命令行参数的缺省处理。
+
+运行：
+    pytest auto_llm/scripts/test_token_budget.py
+"""
+from __future__ import annotations
+
+import argparse
+
+from auto_llm.generator.token_budget import (
+    MIN_TRIMMED_TOKENS,
+    TRIM_HEAD,
+    TRIM_TAIL,
+    PromptSection,
+    TokenBudget,
+    budget_from_args,
+    estimate_tokens,
+)
+
+
+def _lines(prefix: str, count: int) -> str:
+    return "\n".join(f"{prefix} 第 {index} 行" for index in range(count))
+
+
+def test_estimate_tokens_counts_cjk_per_char():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("中文ab") == 3
+
+
+def test_no_budget_keeps_everything():
+    sections = [PromptSection("a", "x" * 400), PromptSection("b", "")]
+    text, report = TokenBudget().assemble(sections, reserved="系统")
+    assert text == "x" * 400
+    assert report.max_tokens is None
+    assert [usage.name for usage in report.sections] == ["a"]
+    assert report.total_tokens == 100 + 2
+    assert not report.over_budget
+
+
+def test_low_priority_sections_are_trimmed_or_dropped():
+    sections = [
+        PromptSection("header", "套件头", required=True),
+        PromptSection("requirements", _lines("需求", 200), priority=60, trim=TRIM_HEAD),
+        PromptSection("logs", _lines("日志", 200), priority=40, trim=TRIM_TAIL),
+        PromptSection("notes", "备注" * 200, priority=10),
+    ]
+    budget = TokenBudget(600)
+    text, report = budget.assemble(sections)
+    usages = {usage.name: usage for usage in report.sections}
+
+    assert usages["header"].status == "kept"
+    assert usages["requirements"].status == "trimmed"
+    assert usages["logs"].status == "trimmed"
+    assert usages["notes"].status == "dropped" and usages["notes"].tokens == 0
+    assert report.total_tokens <= 600 and not report.over_budget
+    assert budget.count(text) <= report.total_tokens
+
+    # 需求文档保留开头、日志保留结尾，并标注截断位置
+    assert "需求 第 0 行" in text and "需求 第 199 行" not in text
+    assert "日志 第 199 行" in text and "日志 第 0 行" not in text
+    assert text.count("…（已截断）") == 2
+    assert "备注" not in text
+
+
+def test_required_sections_survive_even_over_budget():
+    sections = [
+        PromptSection("code", "x" * 4000, required=True),
+        PromptSection("hint", _lines("提示", 50), priority=90, trim=TRIM_HEAD),
+    ]
+    text, report = TokenBudget(500).assemble(sections)
+    assert text == "x" * 4000
+    assert report.over_budget
+    assert report.sections[1].status == "dropped"
+    assert "丢弃" in report.describe()
+
+
+def test_trimmed_section_keeps_minimum_tokens():
+    text = TokenBudget(MIN_TRIMMED_TOKENS * 4)._trim(_lines("日志", 200), MIN_TRIMMED_TOKENS, TRIM_TAIL)
+    assert estimate_tokens(text) <= MIN_TRIMMED_TOKENS
+    assert text.startswith("…（已截断）\n")
+
+
+def test_budget_from_args_uses_defaults_for_missing_fields():
+    budget = budget_from_args(argparse.Namespace())
+    assert budget.max_tokens is None
+    assert budget.count is estimate_tokens
+    assert budget_from_args(argparse.Namespace(prompt_token_budget=800, prompt_tokenizer="chars")).max_tokens == 800
@@ -6,9 +6,11 @@ import json
 import re
 import textwrap
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
 from .generator.llm_client import LLMClient
+from .generator.stop_detection import STOP_AT_JSON
+from .generator.structured_output import json_schema_response_format, schema_from_template
 
 
 DEFAULT_TESTCASE_GUIDE = textwrap.dedent(
@@ -160,6 +162,22 @@ def _basic_json_sanitize(candidate: str) -> str:
     return text
 
 
+def suite_json_schema() -> Dict[str, Any]:
+    """由 DEFAULT_TESTCASE_GUIDE 中的 JSON 模板推导测试套件的 JSON Schema，test_cases 至少一条。"""
+    # 指南的约束说明里也出现了 ``` 字样，不能用 _extract_json，直接从首个 { 解码模板
+    template, _ = json.JSONDecoder().raw_decode(DEFAULT_TESTCASE_GUIDE, DEFAULT_TESTCASE_GUIDE.index("{"))
+    schema = schema_from_template(template)
+    schema["properties"]["test_cases"]["minItems"] = 1
+    # fixture 的 details 随类型变化（本地模式不一定有 base_url），只约束为对象
+    schema["properties"]["fixtures"]["items"]["properties"]["details"] = {"type": "object"}
+    return schema
+
+
+def suite_response_format() -> Dict[str, Any]:
+    """生成测试套件时附带的 response_format，交给 LLMClient.json_response_format。"""
+    return json_schema_response_format("test_suite", suite_json_schema())
+
+
 def _decode_suite_response(
     response: str,
     client: LLMClient,
@@ -185,10 +203,11 @@ def _decode_suite_response(
                 请根据系统提示还原为结构正确的 JSON，并确保所有字段闭合、逗号和引号齐全。
                 """
             ).strip()
-            repair_response = client.generate_code(REPAIR_TESTCASE_GUIDE, repair_user_prompt)
+            repair_response = client.generate_code(REPAIR_TESTCASE_GUIDE, repair_user_prompt, stop_at=STOP_AT_JSON)
             try:
                 repair_json = _extract_json(repair_response)
             except ValueError as repair_extract_exc:
+                client.invalidate_cached(REPAIR_TESTCASE_GUIDE, repair_user_prompt, stop_at=STOP_AT_JSON)
                 raise ValueError(
                     f"解析模型输出失败: {exc}\n修复阶段未找到 JSON: {repair_extract_exc}"
                 ) from repair_extract_exc
@@ -196,6 +215,7 @@ def _decode_suite_response(
                 data = json.loads(repair_json)
                 json_text = repair_json
             except json.JSONDecodeError as repair_exc:
+                client.invalidate_cached(REPAIR_TESTCASE_GUIDE, repair_user_prompt, stop_at=STOP_AT_JSON)
                 raise ValueError(
                     f"解析模型输出失败: {exc}\n经过一次修复仍失败: {repair_exc}"
                 ) from repair_exc
@@ -214,6 +234,7 @@ def generate_test_suite(
     client: LLMClient,
     metadata: Optional[StoryMetadata] = None,
     system_prompt: Optional[str] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
 ) -> Dict[str, Any]:
     system_text = system_prompt or DEFAULT_TESTCASE_GUIDE
     user_text = build_user_prompt(story, metadata)
@@ -233,11 +254,13 @@ def generate_test_suite(
                 f"{error_msg}\n请勿包含多余文字，确保所有字符串与括号闭合。"
             )
 
-        response = client.generate_code(system_text, current_prompt)
+        response = client.generate_code(system_text, current_prompt, on_delta=on_delta, stop_at=STOP_AT_JSON)
         try:
             data = _decode_suite_response(response, client)
             break
         except ValueError as err:
+            # 无法解析的输出不应留在响应缓存中被下次原样重放
+            client.invalidate_cached(system_text, current_prompt, stop_at=STOP_AT_JSON)
             last_error = err
             data = None
 